@@ -0,0 +1,377 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import pickle
+import hashlib
+from common import *
+from opcodes import *
+from disassembler import disassemble, format_instruction, DECODE_6502
+
+"""
+Recursive-traversal code analyzer.
+
+Starting from the entry points and the NMI, RESET and IRQ vectors at
+$FFFA-$FFFF, code is decoded by following JSR, JMP and branch targets, so
+data between routines is never decoded as code. Branch targets come
+resolved from the disassembler the same way CPU.read_oper resolves them.
+
+The result is
+    blocks - control-flow graph of basic blocks indexed by start address,
+             block_of maps every decoded instruction to its block
+    xrefs  - target address -> set of (instruction address, Ref)
+    labels - names generated from the references, see labels()
+
+patch() writes new bytes into the image and only re-walks the blocks
+holding them, blocks that are no longer reachable are dropped.
+
+analyze() keeps finished analyses in a cache directory keyed by a hash of
+the image, base and entry points, so analysing the same image again only
+unpickles the result.
+"""
+
+VECTORS = ((0xfffa, 'nmi'), (0xfffc, 'reset'), (0xfffe, 'irq'))
+CACHE_VERSION = 1
+
+class Ref(NoValue):
+    CALL = 'JSR target'
+    JUMP = 'JMP target'
+    BRANCH = 'Branch target'
+    VECTOR = 'Interrupt vector'
+    READ = 'Data read'
+    WRITE = 'Data write'
+
+WRITES = (Op.STA, Op.STX, Op.STY, Op.INC, Op.DEC, Op.ASL, Op.LSR, Op.ROL, Op.ROR)
+BRANCHES = (Op.BCC, Op.BCS, Op.BEQ, Op.BMI, Op.BNE, Op.BPL, Op.BVC, Op.BVS)
+STOPS = (Op.RTS, Op.RTI, Op.BRK, Op.JMP, None)
+DATA_MODES = (AddrMode.ZP, AddrMode.ZPX, AddrMode.ZPY, AddrMode.ABS, AddrMode.ABSX, \
+              AddrMode.ABSY, AddrMode.IND, AddrMode.INDX, AddrMode.INDY)
+
+class BasicBlock():
+    __slots__ = ('start', 'end', 'insns', 'succs')
+
+    def __init__(self, start, end, insns, succs):
+        self.start = start
+        self.end = end
+        self.insns = insns
+        self.succs = succs
+
+    def __repr__(self):
+        return '<BasicBlock %s-%s -> %s>' % (hexStr(self.start, size=4, prefix='$'), \
+               hexStr(self.end, size=4, prefix='$'), \
+               ' '.join(hexStr(s, size=4, prefix='$') for s in self.succs))
+
+# references made by an instruction, the code ones first
+def references(ins):
+    code = ins.code
+    mode = ins.mode
+    if code in BRANCHES:
+        return [(ins.oper, Ref.BRANCH)]
+    if code is Op.JSR:
+        return [(ins.oper, Ref.CALL)]
+    if code is Op.JMP:
+        if mode is AddrMode.ABS:
+            return [(ins.oper, Ref.JUMP)]
+        return [(ins.oper, Ref.READ)]
+    if mode in DATA_MODES and ins.oper is not None:
+        return [(ins.oper, Ref.WRITE if code in WRITES else Ref.READ)]
+
+    return []
+
+class Analyzer():
+    def __init__(self, image, base=0, entries=(), table=DECODE_6502):
+        self.image = bytearray(image)
+        self.base = base
+        self.entries = tuple(entries)
+        self.table = table
+        self.block_of = {}
+        self.blocks = {}
+        self.page_blocks = {}
+        self.xrefs = {}
+        self.roots = {}
+
+        self.walk(self.find_roots())
+        self.merge()
+
+    def contains(self, addr):
+        return self.base <= addr < self.base + len(self.image)
+
+    def read_word(self, addr):
+        offset = addr - self.base
+        return self.image[offset] | (self.image[offset + 1] << 8)
+
+    def find_roots(self):
+        self.roots = {}
+        for entry in self.entries:
+            self.roots[entry] = 'entry_%s' % hexStr(entry, size=4)
+
+        for vector, name in VECTORS:
+            if self.contains(vector) and self.contains(vector + 1):
+                target = self.read_word(vector)
+                self.add_ref(target, vector, Ref.VECTOR)
+                self.roots.setdefault(target, name)
+
+        return list(self.roots)
+
+    def add_ref(self, target, source, ref):
+        self.xrefs.setdefault(target, set()).add((source, ref))
+
+    def remove_ref(self, target, source, ref):
+        refs = self.xrefs.get(target)
+        if refs is None:
+            return
+
+        refs.discard((source, ref))
+        if not refs:
+            del self.xrefs[target]
+
+    # decodes every block reachable from todo that is not known yet
+    def walk(self, todo):
+        todo = list(todo)
+        while todo:
+            addr = todo.pop()
+            if addr in self.blocks or not self.contains(addr):
+                continue
+
+            if addr in self.block_of:
+                self.split(self.blocks[self.block_of[addr]], addr)
+                continue
+
+            todo.extend(self.decode_block(addr))
+
+    # decodes the block at start, returns the addresses it leads to
+    def decode_block(self, start):
+        insns = []
+        succs = []
+        targets = []
+        end = self.base + len(self.image)
+        for ins in disassemble(self.image, start, start - self.base, table=self.table):
+            if insns and (ins.addr in self.blocks or ins.addr in self.block_of):
+                succs.append(ins.addr)
+                targets.append(ins.addr)
+                break
+
+            insns.append(ins)
+            code = ins.code
+            if ins.oper is None and ins.opcode.size > 1:
+                break
+
+            for target, ref in references(ins):
+                self.add_ref(target, ins.addr, ref)
+                if ref in (Ref.CALL, Ref.JUMP, Ref.BRANCH):
+                    targets.append(target)
+                if ref in (Ref.JUMP, Ref.BRANCH):
+                    succs.append(target)
+
+            if code in STOPS:
+                break
+
+            if code in BRANCHES or code is Op.JSR:
+                after = ins.addr + ins.size
+                if after < end:
+                    succs.append(after)
+                    targets.append(after)
+                break
+
+        block = BasicBlock(start, insns[-1].addr + insns[-1].size, insns, succs)
+        self.add_block(block)
+        return targets
+
+    def add_block(self, block):
+        self.blocks[block.start] = block
+        for ins in block.insns:
+            self.block_of[ins.addr] = block.start
+        for page in self.pages(block):
+            self.page_blocks.setdefault(page, set()).add(block.start)
+
+    def remove_block(self, block, keep_refs=False):
+        del self.blocks[block.start]
+        for ins in block.insns:
+            if self.block_of.get(ins.addr) == block.start:
+                del self.block_of[ins.addr]
+            if not keep_refs:
+                for target, ref in references(ins):
+                    self.remove_ref(target, ins.addr, ref)
+        for page in self.pages(block):
+            self.page_blocks[page].discard(block.start)
+
+    def pages(self, block):
+        return range(block.start >> 8, ((block.end - 1) >> 8) + 1)
+
+    # a jump into the middle of block splits it in two
+    def split(self, block, addr):
+        self.remove_block(block, keep_refs=True)
+        pos = next(i for i, ins in enumerate(block.insns) if ins.addr == addr)
+        self.add_block(BasicBlock(block.start, addr, block.insns[:pos], [addr]))
+        self.add_block(BasicBlock(addr, block.end, block.insns[pos:], block.succs))
+
+    def block_at(self, addr):
+        start = self.block_of.get(addr)
+        return None if start is None else self.blocks[start]
+
+    # blocks with an instruction byte in [start, end)
+    def touched(self, start, end):
+        hits = set()
+        for page in range(start >> 8, ((end - 1) >> 8) + 1):
+            for block_start in self.page_blocks.get(page, ()):
+                block = self.blocks[block_start]
+                if any(ins.addr < end and start < ins.addr + ins.size for ins in block.insns):
+                    hits.add(block)
+
+        return hits
+
+    # writes data at addr and re-walks the blocks it changed
+    def patch(self, addr, data):
+        offset = addr - self.base
+        self.image[offset:offset+len(data)] = data
+        end = addr + len(data)
+
+        todo = []
+        for block in self.touched(addr, end):
+            self.remove_block(block)
+            todo.append(block.start)
+
+        if any(addr < vector + 2 and vector < end for vector, name in VECTORS):
+            for target in list(self.xrefs):
+                for source, ref in list(self.xrefs[target]):
+                    if ref is Ref.VECTOR:
+                        self.remove_ref(target, source, ref)
+            todo.extend(self.find_roots())
+
+        self.walk(todo)
+        self.collect()
+
+    # drops the blocks no root leads to any more
+    def collect(self):
+        seen = set()
+        todo = list(self.roots)
+        while todo:
+            block = self.blocks.get(todo.pop())
+            if block is None or block.start in seen:
+                continue
+
+            seen.add(block.start)
+            todo.extend(block.succs)
+            for ins in block.insns:
+                if ins.code is Op.JSR:
+                    todo.append(ins.oper)
+
+        for block in [b for b in self.blocks.values() if b.start not in seen]:
+            self.remove_block(block)
+
+        self.merge()
+
+    # joins blocks that were split for a jump target which is gone
+    def merge(self):
+        preds = {}
+        for block in self.blocks.values():
+            for succ in block.succs:
+                preds.setdefault(succ, []).append(block.start)
+
+        for start in sorted(self.blocks):
+            block = self.blocks.get(start)
+            if block is None or start in self.roots or len(preds.get(start, ())) != 1:
+                continue
+            if any(ref in (Ref.CALL, Ref.JUMP, Ref.BRANCH) for source, ref in self.xrefs.get(start, ())):
+                continue
+
+            prev = self.blocks[preds[start][0]]
+            if prev.end != start or prev.succs != [start] or \
+               prev.insns[-1].code in BRANCHES + (Op.JSR,):
+                continue
+
+            self.remove_block(prev, keep_refs=True)
+            self.remove_block(block, keep_refs=True)
+            self.add_block(BasicBlock(prev.start, block.end, prev.insns + block.insns, block.succs))
+            for succ in block.succs:
+                preds[succ] = [prev.start if p == start else p for p in preds[succ]]
+
+    def labels(self):
+        labels = {}
+        for target, refs in self.xrefs.items():
+            kinds = set(ref for source, ref in refs)
+            if target in self.roots:
+                labels[target] = self.roots[target]
+            elif Ref.CALL in kinds:
+                labels[target] = 'sub_%s' % hexStr(target, size=4)
+            elif target in self.blocks:
+                labels[target] = 'loc_%s' % hexStr(target, size=4)
+            elif self.contains(target) and kinds & {Ref.READ, Ref.WRITE}:
+                labels[target] = 'data_%s' % hexStr(target, size=4)
+
+        for root, name in self.roots.items():
+            labels.setdefault(root, name)
+
+        return labels
+
+    def listing(self):
+        labels = self.labels()
+        for start in sorted(self.blocks):
+            block = self.blocks[start]
+            for ins in block.insns:
+                if ins.addr in labels:
+                    refs = sorted(source for source, ref in self.xrefs.get(ins.addr, ()))
+                    xref = ' '.join(hexStr(r, size=4, prefix='$') for r in refs)
+                    yield '%s:%s' % (labels[ins.addr], '    ; xref ' + xref if xref else '')
+
+                yield '    ' + format_labelled(ins, labels).rstrip()
+
+# format_instruction with the operand address replaced by its label
+def format_labelled(ins, labels):
+    text = format_instruction(ins, True)
+    label = labels.get(ins.oper)
+    if label is None or ins.mode in (None, AddrMode.A, AddrMode.IMM):
+        return text
+
+    size = 4 if ins.size == 3 or ins.mode is AddrMode.REL else 2
+    oper = ins.mode.print_oper(ins.oper).replace(hexStr(ins.oper, size=size, prefix='$'), label)
+    return '%s%s %s' % (text[:20], ins.code, oper)
+
+def cache_key(image, base, entries):
+    digest = hashlib.sha256()
+    digest.update(b'%d %d %s ' % (CACHE_VERSION, base, repr(tuple(entries)).encode()))
+    digest.update(image)
+    return digest.hexdigest()
+
+# Analyzer(image, base, entries), loaded from cache_dir when it was analysed before
+def analyze(image, base=0, entries=(), cache_dir=None):
+    if cache_dir is None:
+        return Analyzer(image, base, entries)
+
+    path = os.path.join(cache_dir, cache_key(image, base, entries) + '.pickle')
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    analyzer = Analyzer(image, base, entries)
+    os.makedirs(cache_dir, exist_ok=True)
+    temp = '%s.%d' % (path, os.getpid())
+    with open(temp, 'wb') as f:
+        pickle.dump(analyzer, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(temp, path)
+
+    return analyzer
+
+def usage():
+    return 'python3 %s [Binary File] [Base Hex Addr] [-e Entry Hex Addr]... [-c Cache Dir]' % \
+           sys.argv[0]
+
+def main(argv):
+    if len(argv) < 3 or argv[1] == '-h':
+        print(usage())
+        return
+
+    entries = [int(entry, 16) for entry in pop_options(argv, '-e')]
+    cache_dir = pop_option(argv, '-c')
+
+    with open(argv[1], 'rb') as f:
+        image = f.read()
+
+    analyzer = analyze(image, int(argv[2], 16), entries, cache_dir)
+    for line in analyzer.listing():
+        print(line)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,493 @@
+#!/usr/bin/python3
+
+import re
+import sys
+from common import *
+from opcodes import *
+
+"""
+Two-pass 6502 assembler.
+
+Source syntax, one statement per line, ';' starts a comment:
+    label:  LDA #$10        ; immediate
+            STA (ptr),Y     ; (zp,X) (zp),Y (abs) zp,X abs,Y ... like AddrMode.print_oper
+            ASL             ; accumulator mode when there is no implied one
+    name = expr             ; constant
+            .org $0600
+            .byte 1, 'a', "text", <label, >label
+            .word label, *+2
+
+Expressions are numbers ($hex, %binary, decimal, 'c'), symbols, '*' for the
+address of the current statement, + - * / & | ^ << >> ~ and parentheses.
+A leading < or > takes the low or high byte of the whole expression.
+
+Pass one parses every line once and lays out addresses. An operand that
+fits in one byte takes the zero page mode when its value is known at that
+point, forward references get the absolute mode. Pass two evaluates the
+operands and writes the bytes straight into a 64K bytearray. Expressions
+are translated to Python code and compiled once per distinct text, so both
+passes are linear in the number of lines.
+
+Assembler.assemble() can be called again with an edited source. When the
+edited lines keep their sizes and no symbol changes, only those lines are
+encoded again, everything else is kept from the previous run.
+"""
+
+class AssemblyError(Exception):
+    def __init__(self, lineno, message):
+        self.lineno = lineno
+        super().__init__('line %d: %s' % (lineno, message))
+
+# (Op, AddrMode) -> opcode byte
+def build_index(opcodes=OPCODES_6502):
+    index = {}
+    for opcode in opcodes:
+        if opcode.code is not None:
+            index[(opcode.code, opcode.mode)] = opcode.binary
+
+    return index
+
+INDEX_6502 = build_index()
+
+SYMBOL = r'[A-Za-z_.@][\w.@]*'
+LINE_RE = re.compile(r'\s*(?:(%s)\s*:)?\s*(?:([.A-Za-z]\w*)(?:\s+(.*?))?)?\s*$' % SYMBOL)
+CONST_RE = re.compile(r'\s*(%s)\s*=\s*(.+?)\s*$' % SYMBOL)
+TOKEN_RE = re.compile(r"\s*(?:(\$[0-9a-fA-F]+)|(%[01]+)|(\d+)|'(.)'|(" + SYMBOL + r")|(<<|>>|[-+*/&|^~()]))")
+
+MODE_RES = ((AddrMode.IMM, re.compile(r'#(.+)$')), \
+            (AddrMode.INDX, re.compile(r'\((.+),\s*[xX]\s*\)$')), \
+            (AddrMode.INDY, re.compile(r'\((.+)\)\s*,\s*[yY]$')), \
+            ('X', re.compile(r'(.+?)\s*,\s*[xX]$')), \
+            ('Y', re.compile(r'(.+?)\s*,\s*[yY]$')))
+IND_RE = re.compile(r'\((.+)\)$')
+
+# zero page and absolute form of each operand shape
+SHAPES = {None: (AddrMode.ZP, AddrMode.ABS), 'X': (AddrMode.ZPX, AddrMode.ABSX), \
+          'Y': (AddrMode.ZPY, AddrMode.ABSY)}
+
+# statement kinds
+EMPTY = 0
+INSTR = 1
+BYTE = 2
+WORD = 3
+ORG = 4
+CONST = 5
+
+class Line():
+    __slots__ = ('lineno', 'text', 'label', 'kind', 'addr', 'size', 'binary', 'mode', 'exprs')
+
+    def __init__(self, lineno, text):
+        self.lineno = lineno
+        self.text = text
+        self.label = None
+        self.kind = EMPTY
+        self.addr = 0
+        self.size = 0
+        self.binary = None
+        self.mode = None
+        self.exprs = ()
+
+# symbols defined before a line, what pass one sees when it gets there
+class Visible():
+    def __init__(self, symbols, defined, lineno):
+        self.symbols = symbols
+        self.defined = defined
+        self.lineno = lineno
+
+    def __getitem__(self, name):
+        if self.defined.get(name, self.lineno) >= self.lineno:
+            raise KeyError(name)
+
+        return self.symbols[name]
+
+def strip_comment(text):
+    if ';' not in text:
+        return text
+    if '"' not in text and "'" not in text:
+        return text.split(';', 1)[0]
+
+    quote = None
+    for pos, char in enumerate(text):
+        if quote is not None:
+            if char == quote:
+                quote = None
+        elif char in '"\'':
+            # 'c' is a character, a lone ' is not a string
+            if char == "'" and text[pos + 2:pos + 3] != "'":
+                continue
+            quote = char
+        elif char == ';':
+            return text[:pos]
+
+    return text
+
+def split_args(text):
+    args = []
+    current = ''
+    quote = None
+    for char in text:
+        if quote is not None:
+            current += char
+            if char == quote:
+                quote = None
+        elif char == '"':
+            quote = char
+            current += char
+        elif char == ',':
+            args.append(current.strip())
+            current = ''
+        else:
+            current += char
+
+    args.append(current.strip())
+    return [arg for arg in args if arg]
+
+class Assembler():
+    def __init__(self, opcodes=OPCODES_6502, origin=0):
+        self.index = INDEX_6502 if opcodes is OPCODES_6502 else build_index(opcodes)
+        self.origin = origin
+        self.compiled = {}
+        self.lines = []
+        self.symbols = {}
+        self.defined = {}
+        self.memory = bytearray(0x10000)
+        self.low = 0x10000
+        self.high = 0
+        self.encoded = 0
+
+    # expression text -> code object evaluated with S = symbols, P = pc
+    def compile(self, text, lineno):
+        code = self.compiled.get(text)
+        if code is not None:
+            return code
+
+        expr = text.strip()
+        wrap = '%s'
+        if expr[:1] == '<':
+            wrap, expr = '(%s) & 0xff', expr[1:]
+        elif expr[:1] == '>':
+            wrap, expr = '((%s) >> 8) & 0xff', expr[1:]
+
+        out = []
+        pos = 0
+        operand = True
+        expr = expr.rstrip()
+        while pos < len(expr):
+            match = TOKEN_RE.match(expr, pos)
+            if match is None:
+                raise AssemblyError(lineno, 'bad expression %r' % text)
+
+            pos = match.end()
+            hexnum, binnum, decnum, char, symbol, oper = match.groups()
+            if hexnum:
+                out.append(str(int(hexnum[1:], 16)))
+            elif binnum:
+                out.append(str(int(binnum[1:], 2)))
+            elif decnum:
+                out.append(decnum)
+            elif char is not None:
+                out.append(str(ord(char)))
+            elif symbol:
+                out.append('S[%r]' % symbol)
+            elif oper == '*' and operand:
+                out.append('P')
+            else:
+                out.append('//' if oper == '/' else oper)
+                operand = oper != ')'
+                continue
+
+            operand = False
+
+        try:
+            code = compile(wrap % ' '.join(out), '<expr>', 'eval')
+        except SyntaxError:
+            raise AssemblyError(lineno, 'bad expression %r' % text)
+
+        self.compiled[text] = code
+        return code
+
+    def evaluate(self, code, pc, symbols):
+        return eval(code, {'__builtins__': {}, 'S': symbols, 'P': pc})
+
+    # value in pass one, None for forward references
+    def try_evaluate(self, code, pc, symbols):
+        try:
+            return self.evaluate(code, pc, symbols)
+        except KeyError:
+            return None
+
+    def define(self, line, name, value):
+        if name in self.symbols:
+            raise AssemblyError(line.lineno, 'symbol %s defined twice' % name)
+
+        self.symbols[name] = value
+        self.defined[name] = line.lineno
+
+    # parses one line and sizes it, pc is the address it starts at
+    def parse(self, line, pc, symbols):
+        line.addr = pc
+        line.label = None
+        text = strip_comment(line.text)
+        if not text.strip():
+            line.kind = EMPTY
+            line.size = 0
+            return
+
+        match = CONST_RE.match(text)
+        if match is not None:
+            line.kind = CONST
+            line.label = match.group(1)
+            line.size = 0
+            line.exprs = (self.compile(match.group(2), line.lineno),)
+            return
+
+        match = LINE_RE.match(text)
+        if match is None:
+            raise AssemblyError(line.lineno, 'syntax error: %s' % text.strip())
+
+        line.label, name, operand = match.groups()
+        operand = operand or ''
+        if name is None:
+            line.kind = EMPTY
+            line.size = 0
+        elif name[0] == '.':
+            self.parse_directive(line, name.lower(), operand)
+        else:
+            self.parse_instruction(line, name.upper(), operand, pc, symbols)
+
+    def parse_directive(self, line, name, operand):
+        if name == '.org':
+            line.kind = ORG
+            line.size = 0
+            line.exprs = (self.compile(operand, line.lineno),)
+        elif name in ('.byte', '.db'):
+            line.kind = BYTE
+            exprs = []
+            for arg in split_args(operand):
+                if arg[0] == '"':
+                    exprs.extend(self.compile(str(ord(c)), line.lineno) for c in arg[1:-1])
+                else:
+                    exprs.append(self.compile(arg, line.lineno))
+            line.exprs = tuple(exprs)
+            line.size = len(exprs)
+        elif name in ('.word', '.dw'):
+            line.kind = WORD
+            line.exprs = tuple(self.compile(arg, line.lineno) for arg in split_args(operand))
+            line.size = 2 * len(line.exprs)
+        else:
+            raise AssemblyError(line.lineno, 'unknown directive %s' % name)
+
+    def parse_instruction(self, line, name, operand, pc, symbols):
+        code = Op.__members__.get(name)
+        if code is None:
+            raise AssemblyError(line.lineno, 'unknown instruction %s' % name)
+
+        index = self.index
+        line.kind = INSTR
+        line.exprs = ()
+        operand = operand.strip()
+        if not operand or operand in ('A', 'a'):
+            mode = None if (code, None) in index else AddrMode.A
+        elif (code, AddrMode.REL) in index:
+            mode = AddrMode.REL
+            line.exprs = (self.compile(operand, line.lineno),)
+        else:
+            mode, expr = self.parse_operand(code, operand)
+            line.exprs = (self.compile(expr, line.lineno),)
+            if mode in SHAPES:
+                zp, absolute = SHAPES[mode]
+                mode = absolute
+                if (code, zp) in index:
+                    value = self.try_evaluate(line.exprs[0], pc, symbols)
+                    if (code, absolute) not in index or value is not None and 0 <= value < 0x100:
+                        mode = zp
+
+        binary = index.get((code, mode))
+        if binary is None:
+            raise AssemblyError(line.lineno, '%s has no %s mode' % (name, mode.value if mode else 'implied'))
+
+        line.binary = binary
+        line.mode = mode
+        line.size = OpCode.get_size(mode)
+
+    def parse_operand(self, code, operand):
+        for mode, regex in MODE_RES:
+            match = regex.match(operand)
+            if match is not None:
+                return mode, match.group(1)
+
+        match = IND_RE.match(operand)
+        if match is not None and (code, AddrMode.IND) in self.index:
+            return AddrMode.IND, match.group(1)
+
+        return None, operand
+
+    def value(self, line, code):
+        try:
+            return self.evaluate(code, line.addr, self.symbols)
+        except KeyError as e:
+            raise AssemblyError(line.lineno, 'undefined symbol %s' % e.args[0])
+        except (ArithmeticError, TypeError) as e:
+            raise AssemblyError(line.lineno, str(e))
+
+    def byte(self, line, code):
+        value = self.value(line, code)
+        if not -0x80 <= value <= 0xff:
+            raise AssemblyError(line.lineno, 'value %d does not fit in a byte' % value)
+
+        return value & 0xff
+
+    # pass two for one line
+    def encode(self, line):
+        memory = self.memory
+        addr = line.addr
+        kind = line.kind
+        if kind == INSTR:
+            memory[addr] = line.binary
+            mode = line.mode
+            if line.size == 2:
+                if mode is AddrMode.REL:
+                    offset = self.value(line, line.exprs[0]) - (addr + 2)
+                    if not -0x80 <= offset <= 0x7f:
+                        raise AssemblyError(line.lineno, 'branch out of range')
+                    memory[addr + 1] = offset & 0xff
+                elif mode is AddrMode.IMM:
+                    memory[addr + 1] = self.byte(line, line.exprs[0])
+                else:
+                    value = self.value(line, line.exprs[0])
+                    if not 0 <= value < 0x100:
+                        raise AssemblyError(line.lineno, 'address %d is not in zero page' % value)
+                    memory[addr + 1] = value
+            elif line.size == 3:
+                value = self.value(line, line.exprs[0]) & 0xffff
+                memory[addr + 1] = value & 0xff
+                memory[addr + 2] = value >> 8
+        elif kind == BYTE:
+            for pos, code in enumerate(line.exprs):
+                memory[addr + pos] = self.byte(line, code)
+        elif kind == WORD:
+            for pos, code in enumerate(line.exprs):
+                value = self.value(line, code) & 0xffff
+                memory[addr + 2 * pos] = value & 0xff
+                memory[addr + 2 * pos + 1] = value >> 8
+
+        self.encoded += 1
+
+    # pass one over lines, the addresses and symbols they define
+    def layout(self, lines):
+        self.symbols = symbols = {}
+        self.defined = {}
+        pc = self.origin
+        for line in lines:
+            self.parse(line, pc, symbols)
+            if line.kind == ORG:
+                pc = line.addr = self.value(line, line.exprs[0])
+            elif line.kind == CONST:
+                self.define(line, line.label, self.value(line, line.exprs[0]))
+                continue
+
+            if line.label is not None:
+                self.define(line, line.label, pc)
+
+            if pc + line.size > 0x10000:
+                raise AssemblyError(line.lineno, 'code runs past $FFFF')
+            pc += line.size
+
+    def full(self, lines):
+        self.layout(lines)
+        self.memory = bytearray(0x10000)
+        self.low = 0x10000
+        self.high = 0
+        for line in lines:
+            if line.size:
+                self.encode(line)
+                self.low = min(self.low, line.addr)
+                self.high = max(self.high, line.addr + line.size)
+
+        self.lines = lines
+
+    # re-encodes the changed lines in place when the layout stays the same
+    def patch(self, lines, changed):
+        old = self.lines
+        for pos in changed:
+            line = lines[pos]
+            prev = old[pos]
+            self.parse(line, prev.addr, Visible(self.symbols, self.defined, line.lineno))
+            if line.kind != prev.kind or line.size != prev.size or line.label != prev.label or \
+               line.kind in (ORG, CONST):
+                return False
+
+        for pos in changed:
+            self.encode(lines[pos])
+
+        self.lines = lines
+        return True
+
+    # assembles source, incrementally when it is an edit of the last source
+    def assemble(self, source):
+        texts = source.splitlines() if isinstance(source, str) else list(source)
+        self.encoded = 0
+
+        old = self.lines
+        if len(texts) == len(old) and old:
+            changed = [pos for pos, text in enumerate(texts) if text != old[pos].text]
+            lines = list(old)
+            for pos in changed:
+                lines[pos] = Line(pos + 1, texts[pos])
+            if self.patch(lines, changed):
+                return self
+
+        self.full([Line(pos + 1, text) for pos, text in enumerate(texts)])
+        return self
+
+    # the assembled bytes from the lowest to the highest address written
+    def code(self):
+        if self.high <= self.low:
+            return b''
+
+        return bytes(self.memory[self.low:self.high])
+
+    # (address, bytes) of every run of consecutive statements
+    def segments(self):
+        segments = []
+        start = end = None
+        for line in self.lines:
+            if not line.size:
+                continue
+            if line.addr != end:
+                if start is not None:
+                    segments.append((start, bytes(self.memory[start:end])))
+                start = line.addr
+            end = line.addr + line.size
+
+        if start is not None:
+            segments.append((start, bytes(self.memory[start:end])))
+
+        return segments
+
+def assemble(source, origin=0):
+    return Assembler(origin=origin).assemble(source)
+
+def usage():
+    return 'python3 %s [Source File] [-o Output File]' % sys.argv[0]
+
+def main(argv):
+    if len(argv) < 2 or argv[1] == '-h':
+        print(usage())
+        return
+
+    output = pop_option(argv, '-o')
+
+    with open(argv[1]) as f:
+        asm = assemble(f.read())
+
+    if output is not None:
+        with open(output, 'wb') as f:
+            f.write(asm.code())
+        return
+
+    for addr, data in asm.segments():
+        print('%s: %s' % (hexStr(addr, size=4), data.hex(' ')))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,143 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+from multiprocessing import Pool
+from common import *
+from processor import *
+
+"""
+Runs many independent programs on a process pool.
+
+Every worker builds one Processor and resets it between jobs with
+Processor.reset, which only copies back the pages the previous job wrote
+and keeps the decoded blocks of unchanged code.
+
+Command line: one JSON job per input line, one JSON result per output line
+    {"addr": "0x600", "program": "a2 00 e8 00", "regs": {"a": 1},
+     "max_cycles": 100000, "dump": [["0x0200", 16]]}
+    python3 batch.py [Jobs File] [-j Processes]
+
+python3 batch.py -c checks that jobs run in a row on one Processor give
+the results of jobs run on fresh ones.
+"""
+
+class Job():
+    __slots__ = ('program', 'addr', 'regs', 'max_cycles', 'dump', 'filename')
+
+    # program is raw bytes or a hex string, filename a raw binary to load
+    # instead. dump lists (start, length) ranges to return.
+    def __init__(self, program=None, addr=0x0600, regs=None, max_cycles=1000000, dump=(), \
+                 filename=None):
+        self.program = program
+        self.addr = addr
+        self.regs = regs
+        self.max_cycles = max_cycles
+        self.dump = dump
+        self.filename = filename
+
+class Result():
+    __slots__ = ('regs', 'cycles', 'reason', 'memory')
+
+    def __init__(self, regs, cycles, reason, memory):
+        self.regs = regs
+        self.cycles = cycles
+        self.reason = reason
+        self.memory = memory
+
+    def __repr__(self):
+        return '<Result %s cycles:%d regs:%s>' % (self.reason, self.cycles, self.regs)
+
+worker = None
+
+def init_worker(recompile=False):
+    global worker
+    worker = Processor(recompile=recompile)
+
+def load_job(proc, job):
+    if job.filename is not None:
+        with open(job.filename, 'rb') as f:
+            proc.bus.load(f.read(), job.addr)
+    elif isinstance(job.program, str):
+        proc.bus.load_str(job.program, job.addr)
+    else:
+        proc.bus.load(job.program, job.addr)
+
+    proc.cpu.config(pc=job.addr)
+    if job.regs:
+        proc.cpu.config(**job.regs)
+
+def run_job(job, proc=None):
+    proc = proc or worker
+    proc.reset()
+    load_job(proc, job)
+
+    reason, cycles = proc.run(max_cycles=job.max_cycles)
+    memory = tuple(proc.bus[addr:addr+size] for addr, size in job.dump)
+    return Result(proc.cpu.regs(), cycles, reason.name, memory)
+
+def run_batch(jobs, processes=None, chunksize=16, recompile=False):
+    with Pool(processes, initializer=init_worker, initargs=(recompile,)) as pool:
+        return pool.map(run_job, jobs, chunksize)
+
+def parse_job(line):
+    spec = json.loads(line)
+    addr = spec.get('addr', 0x0600)
+    if isinstance(addr, str):
+        addr = int(addr, 16)
+
+    dump = [(int(a, 16) if isinstance(a, str) else a, size) for a, size in spec.get('dump', ())]
+    return Job(spec.get('program'), addr, spec.get('regs'), spec.get('max_cycles', 1000000), \
+               dump, spec.get('filename'))
+
+def format_result(result):
+    pc, a, x, y, sp, status = result.regs
+    return json.dumps({'reason': result.reason, 'cycles': result.cycles, \
+                       'regs': {'pc': pc, 'a': a, 'x': x, 'y': y, 'sp': sp, 'status': status}, \
+                       'memory': [m.hex() for m in result.memory]})
+
+# jobs leaving code and data behind in RAM, WRAM and at $8000, each
+# followed by one reading it back
+CHECK_JOBS = (Job('a9 42 85 10 00', dump=((0x0010, 1),)), \
+              Job('a5 10 00', dump=((0x0010, 1),)), \
+              Job('a9 42 8d 00 60 00', dump=((0x6000, 1),)), \
+              Job('ad 00 60 00', dump=((0x6000, 1),)), \
+              Job('a9 42 00', addr=0x8000, dump=((0x8000, 4),)), \
+              Job('ad 01 80 00', dump=((0x8000, 4),)))
+
+def check():
+    proc = Processor()
+    failed = 0
+    for i, job in enumerate(CHECK_JOBS):
+        reused = run_job(job, proc)
+        fresh = run_job(job, Processor())
+        if (reused.regs, reused.memory) != (fresh.regs, fresh.memory):
+            print('job %d: %s after the previous job, %s on a fresh Processor' % \
+                  (i, format_result(reused), format_result(fresh)))
+            failed += 1
+
+    print('%d/%d jobs match' % (len(CHECK_JOBS) - failed, len(CHECK_JOBS)))
+
+def usage():
+    return 'python3 %s [Jobs File] [-j Processes] | -c' % sys.argv[0]
+
+def main(argv):
+    if len(argv) < 2 or argv[1] == '-h':
+        print(usage())
+        return
+
+    if argv[1] == '-c':
+        check()
+        return
+
+    processes = int(pop_option(argv, '-j', os.cpu_count()))
+
+    with open(argv[1]) as f:
+        jobs = [parse_job(line) for line in f if line.strip()]
+
+    for result in run_batch(jobs, processes):
+        print(format_result(result))
+
+if __name__ == '__main__':
+    main(sys.argv)
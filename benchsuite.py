@@ -0,0 +1,750 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import platform
+import subprocess
+import tracemalloc
+from common import *
+from opcodes import *
+from ram import RAM
+from processor import Processor, StopReason
+from assembler import assemble
+from disassembler import disassemble
+from loader import load_raw, load_text, to_ihex, to_srec, to_hex
+from savestate import PageStore
+
+"""
+Benchmark suite.
+
+Workloads are 6502 programs generated and assembled on the spot, so
+nothing binary is bundled:
+    count     - nested DEY/DEX loops around a 16-bit zero page counter
+    memcopy   - 4K copies between WRAM pages through (zp),Y pointers
+    zpmath    - 8x8 shift-and-add multiplies summed in zero page
+    fib       - recursive Fibonacci through JSR/RTS and the stack
+    tablewalk - a shuffled pointer table walked with (zp),Y, some records
+                crossing pages
+    disasm    - the streaming disassembler over a 1 MB random buffer
+Each CPU workload runs under every selected Processor mode and checks the
+result the program leaves in memory, so a broken CPU does not pass as a
+fast one.
+
+Per result: instructions and cycles (counted once by a profiled run, the
+programs are deterministic), the best wall time of the repeats, emulated
+MIPS and cycles per second, and the peak traced Python allocation of an
+extra untimed run.
+
+Micro benchmarks time single features, each row the best of the repeats
+and shown against the row it is compared to:
+    dispatch  - a block of 'ADC $20' instructions through the old string
+                based dispatch (getattr(cpu, 'do_' + str(op.code))), the
+                dispatch table, the block cache, the profiler, an attached
+                debugger with nothing set and with a breakpoint and a
+                write watchpoint the program never reaches, and the rewind
+                history
+    loop      - nested loops filling page $03 from the block cache and
+                recompiled, the recompiler only pays off on hot blocks
+    idle      - a program polling an IO register until a clock event sets
+                it, idle loops stepped through and skipped
+    reset     - a new Processor with the program reloaded against
+                Processor.restore of a snapshot
+    states    - saving and loading states through a PageStore, and the
+                disk space per state
+    assembler - lines per second on a generated source
+    loaders   - each program loader on 4 MB inputs, checking that the
+                data and RAM.to_str output load back
+
+Startup is timed as a command run to completion, best of the repeats:
+    python        - the bare interpreter, for reference
+    disassembler  - disassembler.py on a short byte string
+    processor     - processor.py running a short loop
+    batch         - per request, processor.py -b fed STARTUP_REQUESTS
+                    requests on stdin
+
+Results are written as JSON. Given a baseline file, results slower than
+the baseline by more than the tolerance, or whose instruction or cycle
+counts changed, are reported and the exit status is 1:
+    python3 benchsuite.py [-o Results] [-b Baseline] [-r Repeats] [-t Tolerance]
+                          [-m blocks,recompiled] [Workloads or Micro Benchmarks...]
+"""
+
+VERSION = 3
+MODES = {'blocks': {}, 'recompiled': {'recompile': True}, 'traced': {'verbose': True}}
+DEFAULT_MODES = ('blocks', 'recompiled')
+START = 0x0600
+
+COUNT_SRC = '''
+        .org $0600
+        LDX #$80
+outer:  LDY #0
+inner:  INC $10
+        BNE next
+        INC $11
+next:   DEY
+        BNE inner
+        DEX
+        BNE outer
+        BRK
+'''
+
+MEMCOPY_SRC = '''
+src = $00
+dst = $02
+pass = $04
+        .org $0600
+        LDA #8
+        STA pass
+again:  LDA #0
+        STA src
+        STA dst
+        LDA #$60
+        STA src+1
+        LDA #$70
+        STA dst+1
+        LDX #16
+        LDY #0
+copy:   LDA (src),Y
+        STA (dst),Y
+        INY
+        BNE copy
+        INC src+1
+        INC dst+1
+        DEX
+        BNE copy
+        DEC pass
+        BNE again
+        BRK
+        .org $6000
+'''
+
+ZPMATH_SRC = '''
+acc = $10
+prod = $13
+mcand = $15
+mplier = $17
+i = $18
+pass = $19
+        .org $0600
+        LDA #0
+        STA acc
+        STA acc+1
+        STA acc+2
+        LDA #4
+        STA pass
+again:  LDA #255
+        STA i
+loop:   LDA i
+        STA mcand
+        LDA #0
+        STA mcand+1
+        STA prod
+        STA prod+1
+        LDA #$9d
+        STA mplier
+        LDX #8
+bit:    LSR mplier
+        BCC skip
+        CLC
+        LDA prod
+        ADC mcand
+        STA prod
+        LDA prod+1
+        ADC mcand+1
+        STA prod+1
+skip:   ASL mcand
+        ROL mcand+1
+        DEX
+        BNE bit
+        CLC
+        LDA acc
+        ADC prod
+        STA acc
+        LDA acc+1
+        ADC prod+1
+        STA acc+1
+        LDA acc+2
+        ADC #0
+        STA acc+2
+        DEC i
+        BNE loop
+        DEC pass
+        BNE again
+        BRK
+'''
+
+FIB_SRC = '''
+sum = $20
+        .org $0600
+        LDA #0
+        STA sum
+        STA sum+1
+        LDX #18
+        JSR fib
+        BRK
+fib:    CPX #2
+        BCC base
+        DEX
+        TXA
+        PHA
+        JSR fib
+        PLA
+        TAX
+        DEX
+        JSR fib
+        RTS
+base:   TXA
+        CLC
+        ADC sum
+        STA sum
+        BCC done
+        INC sum+1
+done:   RTS
+'''
+
+TABLEWALK_SRC = '''
+ptr = $00
+sum = $02
+pass = $04
+table = $6000
+        .org $0600
+        LDA #0
+        STA sum
+        STA sum+1
+        LDA #16
+        STA pass
+again:  LDX #0
+next:   LDA table,X
+        STA ptr
+        LDA table+1,X
+        STA ptr+1
+        LDY #15
+field:  LDA (ptr),Y
+        CLC
+        ADC sum
+        STA sum
+        BCC nc
+        INC sum+1
+nc:     DEY
+        BPL field
+        INX
+        INX
+        BNE next
+        DEC pass
+        BNE again
+        BRK
+'''
+
+RECORDS = 0x6405
+RECORD_SIZE = 17
+
+def byte_lines(data):
+    return ''.join('        .byte %s\n' % ', '.join(str(b) for b in data[pos:pos+16]) \
+                   for pos in range(0, len(data), 16))
+
+def memcopy_workload(rng):
+    data = rng.randbytes(0x1000)
+    check = lambda proc: bytes(proc.wram.data[0x1000:0x2000]) == data
+    return MEMCOPY_SRC + byte_lines(data), check
+
+def tablewalk_workload(rng):
+    order = list(range(128))
+    rng.shuffle(order)
+    records = rng.randbytes(128 * RECORD_SIZE)
+    pointers = [RECORDS + k * RECORD_SIZE for k in order]
+
+    source = TABLEWALK_SRC + '        .org $6000\n'
+    source += ''.join('        .word $%04x\n' % ptr for ptr in pointers)
+    source += '        .org $%04x\n' % RECORDS + byte_lines(records)
+
+    total = 16 * sum(sum(records[k*RECORD_SIZE:k*RECORD_SIZE+16]) for k in range(128))
+    return source, lambda proc: proc.bus.read_word(0x02) == total & 0xffff
+
+def count_workload(rng):
+    return COUNT_SRC, lambda proc: proc.ram.data[0x10] == 0 and proc.ram.data[0x11] == 0x80
+
+def zpmath_workload(rng):
+    total = 4 * sum(i * 0x9d for i in range(1, 256)) & 0xffffff
+    return ZPMATH_SRC, lambda proc: int.from_bytes(proc.ram.data[0x10:0x13], 'little') == total
+
+def fib_workload(rng):
+    return FIB_SRC, lambda proc: proc.bus.read_word(0x20) == 2584
+
+WORKLOADS = {'count': count_workload, 'memcopy': memcopy_workload, 'zpmath': zpmath_workload, \
+             'fib': fib_workload, 'tablewalk': tablewalk_workload}
+DISASM_SIZE = 1 << 20
+
+class Program():
+    def __init__(self, name):
+        self.name = name
+        self.source, self.check = WORKLOADS[name](random.Random(name))
+        self.segments = assemble(self.source).segments()
+
+    def machine(self, **kwargs):
+        proc = Processor(**kwargs)
+        for addr, blob in self.segments:
+            proc.bus.load(blob, addr)
+        proc.cpu.config(pc=START)
+        return proc
+
+    # instructions and cycles of one run, from the profiler tables
+    def count(self):
+        proc = self.machine(profile=True)
+        reason, cycles = proc.run()
+        proc.profiler.flush()
+        if reason != StopReason.BRK or not self.check(proc):
+            raise RuntimeError('%s: wrong result, stopped by %s' % (self.name, reason))
+
+        return sum(proc.profiler.op_counts), cycles
+
+    def run(self, mode):
+        proc = self.machine(**MODES[mode])
+        start = time.perf_counter()
+        reason, cycles = proc.run()
+        elapsed = time.perf_counter() - start
+        if not self.check(proc):
+            raise RuntimeError('%s/%s: wrong result' % (self.name, mode))
+
+        return elapsed, cycles
+
+    def peak(self, mode):
+        tracemalloc.start()
+        try:
+            self.machine(**MODES[mode]).run()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+def result(instructions, cycles, seconds, peak):
+    out = {'instructions': instructions, 'cycles': cycles, 'seconds': round(seconds, 6), \
+           'mips': round(instructions / seconds / 1e6, 4), 'peak_kb': peak >> 10}
+    if cycles is not None:
+        out['cycles_per_sec'] = round(cycles / seconds)
+    return out
+
+def measure_program(name, modes, repeats):
+    program = Program(name)
+    instructions, cycles = program.count()
+
+    results = {}
+    for mode in modes:
+        best = None
+        for _ in range(repeats):
+            elapsed, run_cycles = program.run(mode)
+            if run_cycles != cycles:
+                raise RuntimeError('%s/%s: %d cycles, profiled run took %d' % \
+                                   (name, mode, run_cycles, cycles))
+            best = elapsed if best is None else min(best, elapsed)
+
+        results['%s/%s' % (name, mode)] = result(instructions, cycles, best, program.peak(mode))
+
+    return results
+
+def measure_disasm(repeats, size=DISASM_SIZE):
+    data = random.Random('disasm').randbytes(size)
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        count = sum(1 for ins in disassemble(data))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    try:
+        sum(1 for ins in disassemble(data))
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'disasm': result(count, None, best, peak)}
+
+MICRO_ADDR = 0x200
+MICRO_PASSES = 200
+ADC_OPS = 500
+# units where less is better, the others are rates
+COST_UNITS = ('ms/wait', 'us/reset', 'us/state', 'bytes/state')
+
+def run_getattr(proc):
+    cpu = proc.cpu
+    op = None
+    while op != Op.BRK:
+        binary = cpu.read_next()
+        op = cpu.opcodes[binary].code
+        getattr(cpu, 'do_' + str(op))(cpu.opcodes[binary], cpu.decoders[binary]())
+
+def run_dispatch(proc):
+    while proc.cpu.execute() != Op.BRK:
+        continue
+
+def run_blocks(proc):
+    proc.execute()
+
+def run_debugger(proc):
+    proc.attach_debugger()
+    proc.execute()
+
+def run_breakpoints(proc):
+    debugger = proc.attach_debugger()
+    if not debugger.active():
+        debugger.add_break(0xfff0)
+        debugger.watch(0x0700)
+    proc.execute()
+
+def run_history(proc):
+    if proc.history is None:
+        proc.enable_history()
+    proc.execute()
+
+DISPATCH_RUNS = (('getattr', run_getattr, {}), ('dispatch', run_dispatch, {}), \
+                 ('blocks', run_blocks, {}), ('profiled', run_blocks, {'profile': True}), \
+                 ('debugger', run_debugger, {}), ('breakpoint', run_breakpoints, {}), \
+                 ('history', run_history, {}))
+
+# every micro benchmark returns rows of (name, value, unit, name of the row
+# it is compared to or None)
+def micro_dispatch(passes):
+    rows = []
+    for name, run, kwargs in DISPATCH_RUNS:
+        proc = Processor(**kwargs)
+        proc.bus.load(bytes.fromhex('6520' * ADC_OPS + '00'), MICRO_ADDR)
+
+        start = time.perf_counter()
+        for _ in range(passes):
+            proc.cpu.config(pc=MICRO_ADDR, sp=0xFF)
+            run(proc)
+        elapsed = time.perf_counter() - start
+
+        rate = passes * (ADC_OPS + 1) / elapsed
+        rows.append((name, rate, 'instr/s', 'getattr' if name != 'getattr' else None))
+
+    return rows
+
+# LDY #16; outer: LDX #0; inner: TXA; STA $0300,X; INX; BNE inner; DEY;
+# BNE outer; BRK
+LOOP_PROGRAM = 'a0 10 a2 00 8a 9d 00 03 e8 d0 f9 88 d0 f4 00'
+LOOP_OPS = 2 + 16 * (3 + 256 * 4)
+
+def micro_loop(passes):
+    rows = []
+    for name, kwargs in (('blocks', {}), ('recompiled', {'recompile': True})):
+        proc = Processor(**kwargs)
+        proc.bus.load_str(LOOP_PROGRAM, MICRO_ADDR)
+        count = max(passes // 20, 1)
+
+        start = time.perf_counter()
+        for _ in range(count):
+            proc.cpu.config(pc=MICRO_ADDR, sp=0xFF)
+            proc.execute()
+        elapsed = time.perf_counter() - start
+
+        rows.append((name, count * LOOP_OPS / elapsed, 'instr/s', \
+                     'blocks' if name != 'blocks' else None))
+
+    return rows
+
+# LDA $4010; BPL -5; BRK
+IDLE_PROGRAM = 'ad 10 40 10 fb 00'
+IDLE_CYCLES = 1000000
+
+# wall time of waiting IDLE_CYCLES for the timer to fire
+def micro_idle(passes):
+    rows = []
+    for name, fast_forward in (('step', False), ('skip', True)):
+        proc = Processor()
+        proc.fast_forward = fast_forward
+        proc.bus.load_str(IDLE_PROGRAM, MICRO_ADDR)
+        proc.cpu.config(pc=MICRO_ADDR)
+        proc.clk.schedule(IDLE_CYCLES, lambda cycle: proc.io_regs.write(0x4010, 0x80))
+
+        start = time.perf_counter()
+        proc.execute()
+        rows.append((name, (time.perf_counter() - start) * 1e3, 'ms/wait', \
+                     'step' if fast_forward else None))
+
+    return rows
+
+# LDX #0; TXA; STA $0300,X; INX; BNE -7; BRK
+FILL_PROGRAM = 'a2 00 8a 9d 00 03 e8 d0 f9 00'
+
+def fill_machine():
+    proc = Processor()
+    proc.bus.load_str(FILL_PROGRAM, MICRO_ADDR)
+    proc.cpu.config(pc=MICRO_ADDR)
+    return proc
+
+def reset_rebuild(proc, snapshot):
+    return fill_machine()
+
+def reset_restore(proc, snapshot):
+    proc.restore(snapshot)
+    return proc
+
+# the reset after a short run of the fill loop
+def micro_reset(passes):
+    rows = []
+    for name, reset in (('rebuild', reset_rebuild), ('restore', reset_restore)):
+        proc = fill_machine()
+        snapshot = proc.snapshot()
+
+        elapsed = 0
+        for _ in range(passes):
+            proc.run(max_instructions=50)
+            start = time.perf_counter()
+            proc = reset(proc, snapshot)
+            elapsed += time.perf_counter() - start
+
+        rows.append((name, elapsed / passes * 1e6, 'us/reset', \
+                     'rebuild' if name != 'rebuild' else None))
+
+    return rows
+
+# states of the fill loop saved every 50 instructions into a PageStore
+def micro_states(passes):
+    proc = fill_machine()
+    path = tempfile.mkdtemp()
+    try:
+        with PageStore(path) as store:
+            saving = 0
+            for _ in range(passes):
+                proc.run(max_instructions=50)
+                start = time.perf_counter()
+                store.save(proc)
+                saving += time.perf_counter() - start
+
+            start = time.perf_counter()
+            for state in range(passes):
+                store.load(proc, state)
+            loading = time.perf_counter() - start
+
+            return [('save', saving / passes * 1e6, 'us/state', None), \
+                    ('load', loading / passes * 1e6, 'us/state', None), \
+                    ('disk', store.disk_size() / passes, 'bytes/state', None)]
+    finally:
+        shutil.rmtree(path)
+
+# a loop body of every addressing mode, repeated under fresh labels
+ASM_BODY = '''l%d: LDA #$10
+        STA $20,X
+        ADC table,Y
+        LDA (ptr),Y
+        CMP #<table
+        BNE l%d
+'''
+
+def micro_assembler(passes):
+    source = 'ptr = $20\n.org $0600\n'
+    source += ''.join(ASM_BODY % (i, i) for i in range(passes * 10))
+    source += 'table: .byte 1, 2, 3\n'
+    lines = source.count('\n')
+
+    start = time.perf_counter()
+    assemble(source)
+    return [('lines', lines / (time.perf_counter() - start), 'lines/s', None)]
+
+LOADER_SIZE = 4 << 20
+
+# input MB/s of each loader format on LOADER_SIZE bytes of random data
+def micro_loaders(passes, size=LOADER_SIZE):
+    data = random.Random(0).randbytes(size)
+    memory = bytearray(size)
+    inputs = (('raw', data), ('ihex', to_ihex(data)), ('srec', to_srec(data)), \
+              ('hex', to_hex(data)))
+
+    rows = []
+    for fmt, text in inputs:
+        start = time.perf_counter()
+        if fmt == 'raw':
+            load_raw(memory, text)
+        else:
+            load_text(memory, text, fmt)
+        elapsed = time.perf_counter() - start
+
+        if memory != data:
+            raise RuntimeError('%s loader did not load the data back' % fmt)
+        rows.append((fmt, len(text) / elapsed / 1e6, 'MB/s', None))
+
+    # the hex loader reads RAM.to_str output, column header included
+    ram = RAM(0x10000)
+    ram.load(data[:0x10000], 0)
+    copy = bytearray(0x10000)
+    load_text(copy, ram.to_str(0x100, 0xff00), 'hex')
+    if copy != bytes(0x100) + ram.data[0x100:]:
+        raise RuntimeError('hex loader did not load RAM.to_str output back')
+
+    return rows
+
+MICRO = {'dispatch': micro_dispatch, 'loop': micro_loop, 'idle': micro_idle, \
+         'reset': micro_reset, 'states': micro_states, 'assembler': micro_assembler, \
+         'loaders': micro_loaders}
+
+# the rows of a micro benchmark, best of repeats
+def measure_micro(name, repeats, passes=MICRO_PASSES):
+    best = {}
+    for _ in range(repeats):
+        for row, value, unit, ref in MICRO[name](passes):
+            key = '%s/%s' % (name, row)
+            old = best.get(key)
+            if old is None or (value < old['value'] if unit in COST_UNITS else value > old['value']):
+                best[key] = {'value': value, 'unit': unit, \
+                             'ref': '%s/%s' % (name, ref) if ref is not None else None}
+
+    return best
+
+STARTUP_PROGRAM = 'a2 05 ca d0 fd 00'
+STARTUP_REQUESTS = 100
+STARTUP = {'python': ['-c', 'pass'], \
+           'disassembler': ['disassembler.py', '600', STARTUP_PROGRAM], \
+           'processor': ['processor.py', '600', STARTUP_PROGRAM], \
+           'batch': ['processor.py', '-b']}
+
+# ms of every STARTUP command, best of repeats
+def measure_startup(repeats):
+    here = os.path.dirname(os.path.abspath(__file__))
+    batch = ('600 "%s"\n' % STARTUP_PROGRAM * STARTUP_REQUESTS).encode()
+    times = {}
+    for name, args in STARTUP.items():
+        best = None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + args, cwd=here, check=True, stdout=subprocess.DEVNULL, \
+                           input=batch if name == 'batch' else None)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        times[name] = round(best * 1000 / (STARTUP_REQUESTS if name == 'batch' else 1), 3)
+
+    return times
+
+def run_suite(names=None, modes=DEFAULT_MODES, repeats=5):
+    names = names or list(WORKLOADS) + ['disasm'] + list(MICRO)
+    results = {}
+    micro = {}
+    for name in names:
+        if name == 'disasm':
+            results.update(measure_disasm(repeats))
+        elif name in MICRO:
+            micro.update(measure_micro(name, repeats))
+        else:
+            results.update(measure_program(name, modes, repeats))
+
+    return {'version': VERSION, 'python': platform.python_version(), \
+            'implementation': platform.python_implementation(), 'machine': platform.machine(), \
+            'startup': measure_startup(repeats), 'results': results, 'micro': micro}
+
+# (key, message) of every regression against the baseline
+def compare(current, baseline, tolerance=0.1):
+    regressions = []
+    for key, old in sorted(baseline['results'].items()):
+        new = current['results'].get(key)
+        if new is None:
+            continue
+
+        for count in ('instructions', 'cycles'):
+            if new[count] != old[count]:
+                regressions.append((key, '%s changed %s -> %s' % (count, old[count], new[count])))
+
+        ratio = new['mips'] / old['mips']
+        if ratio < 1 - tolerance:
+            regressions.append((key, '%.1f%% slower' % ((1 - ratio) * 100)))
+
+    for key, old in sorted(baseline['micro'].items()):
+        new = current['micro'].get(key)
+        if new is None:
+            continue
+
+        ratio = new['value'] / old['value']
+        if old['unit'] in COST_UNITS:
+            if ratio > 1 + tolerance:
+                regressions.append((key, '%.1f%% more %s' % ((ratio - 1) * 100, old['unit'])))
+        elif ratio < 1 - tolerance:
+            regressions.append((key, '%.1f%% slower' % ((1 - ratio) * 100)))
+
+    for name, old in sorted(baseline['startup'].items()):
+        new = current['startup'].get(name)
+        if new is not None and new > old * (1 + tolerance):
+            regressions.append(('startup ' + name, '%.1f%% slower' % ((new / old - 1) * 100)))
+
+    return regressions
+
+def print_results(current, baseline=None):
+    print('%-22s %10s %12s %8s %14s %10s %8s' % \
+          ('Workload', 'Instr', 'Cycles', 'MIPS', 'Cycles/s', 'Peak KB', 'Change'))
+    for key, res in current['results'].items():
+        change = ''
+        if baseline is not None and key in baseline['results']:
+            change = '%+.1f%%' % ((res['mips'] / baseline['results'][key]['mips'] - 1) * 100)
+
+        cycles = res['cycles'] if res['cycles'] is not None else '-'
+        rate = res.get('cycles_per_sec', '-')
+        print('%-22s %10d %12s %8.3f %14s %10d %8s' % \
+              (key, res['instructions'], cycles, res['mips'], rate, res['peak_kb'], change))
+
+    micro = current['micro']
+    for key, res in micro.items():
+        change = ''
+        if baseline is not None and key in baseline['micro']:
+            change = '%+.1f%%' % ((res['value'] / baseline['micro'][key]['value'] - 1) * 100)
+
+        against = ''
+        if res['ref'] in micro:
+            ref = micro[res['ref']]['value']
+            factor = ref / res['value'] if res['unit'] in COST_UNITS else res['value'] / ref
+            against = '%.2fx %s' % (factor, res['ref'])
+        print('%-22s %14.3f %-11s %8s  %s' % (key, res['value'], res['unit'], change, against))
+
+    for name, ms in current['startup'].items():
+        change = ''
+        if baseline is not None and name in baseline['startup']:
+            change = '%+.1f%%' % ((ms / baseline['startup'][name] - 1) * 100)
+        print('%-22s %10.2f ms %s' % ('startup ' + name, ms, change))
+
+def usage():
+    return 'python3 %s [-o Results] [-b Baseline] [-r Repeats] [-t Tolerance] ' \
+           '[-m Modes] [Workloads or Micro Benchmarks...]' % sys.argv[0]
+
+def main(argv):
+    if '-h' in argv:
+        print(usage())
+        return 0
+
+    output = pop_option(argv, '-o')
+    baseline_file = pop_option(argv, '-b')
+    repeats = int(pop_option(argv, '-r', '5'))
+    tolerance = float(pop_option(argv, '-t', '0.1'))
+    modes = pop_option(argv, '-m', ','.join(DEFAULT_MODES)).split(',')
+    for name in argv[1:] + modes:
+        if name not in WORKLOADS and name not in MICRO and name not in MODES and name != 'disasm':
+            print('unknown workload or mode %r' % name)
+            return 2
+
+    current = run_suite(argv[1:], modes, repeats)
+
+    baseline = None
+    if baseline_file is not None:
+        with open(baseline_file) as f:
+            baseline = json.load(f)
+        if baseline.get('version') != VERSION:
+            print('%s is not a version %d result file' % (baseline_file, VERSION))
+            return 2
+
+    print_results(current, baseline)
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(current, f, indent=1, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(current, baseline, tolerance)
+        for key, message in regressions:
+            print('REGRESSION %s: %s' % (key, message))
+        return 1 if regressions else 0
+
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,193 @@
+from common import *
+from opcodes import *
+from bus import PAGE_SIZE
+from idle import idle_loop
+
+"""
+Basic block decode cache.
+
+A block is the straight-line run of instructions starting at a PC, up to
+and including the first branch, jump, JSR, RTS, RTI or BRK. CLI and PLP
+end a block too, so an IRQ they unmask is taken right after them. Each entry of
+Block.ops is a tuple
+    (opcode byte, resolved operand, size, base cycles)
+with operands resolved the way CPU.decoders resolve them, so the ops can be
+handed straight to CPU.dispatch. Block.cycles is the most the block can
+take, with every indexed read crossing a page and the branch taken to
+another page, so a run loop knows whether it fits before the next clock
+event.
+
+Every writable page holding cached code, and every mirror of it, is
+write-watched on the bus. A write that changes a cached byte discards the
+blocks covering it. Read-only pages only change when the bus maps other
+memory there, which discards all their blocks (see unmap). A discarded block's ops list is emptied in place, so a run loop that is
+iterating over it stops after the current instruction.
+
+Block.idle is the IdleLoop of a block that loops back to its own start
+and can be skipped over by the run loop, or None (see idle.py).
+"""
+
+ENDS_BLOCK = (Op.BCC, Op.BCS, Op.BEQ, Op.BMI, Op.BNE, Op.BPL, Op.BVC, Op.BVS, \
+              Op.JMP, Op.JSR, Op.RTS, Op.RTI, Op.BRK, Op.CLI, Op.PLP, None)
+
+class Block():
+    __slots__ = ('start', 'end', 'ops', 'cycles', 'count', 'func', 'idle')
+
+    def __init__(self, start, end, ops, cycles):
+        self.start = start
+        self.end = end
+        self.ops = ops
+        self.cycles = cycles
+        self.count = 0
+        self.func = None
+        self.idle = None
+
+    def pages(self):
+        return range(self.start >> 8, ((self.end - 1) >> 8) + 1)
+
+class BlockCache():
+    def __init__(self, bus, opcodes, max_ops=64):
+        self.bus = bus
+        self.opcodes = opcodes
+        self.max_ops = max_ops
+        self.ends_block = [opcode.code in ENDS_BLOCK for opcode in opcodes]
+        self.max_cycles = [opcode.cycles + opcode.page_cycles + \
+                           (2 if opcode.mode is AddrMode.REL else 0) for opcode in opcodes]
+        self.blocks = {}
+        self.page_blocks = {}
+        self.aliases = {}
+
+    def get(self, pc):
+        block = self.blocks.get(pc)
+        if block is None:
+            block = self.build(pc)
+
+        return block
+
+    def peek(self, addr):
+        page = self.bus.base_rpages[addr >> 8]
+        if page is None:
+            return None
+
+        return page[addr & 0xff]
+
+    def decode(self, addr):
+        binary = self.peek(addr)
+        if binary is None:
+            return None
+
+        opcode = self.opcodes[binary]
+        size = opcode.size
+        if addr + size > 0x10000:
+            return None
+
+        oper = None
+        if opcode.mode is AddrMode.IMM:
+            oper = addr + 1
+        elif size > 1:
+            oper = self.peek(addr + 1)
+            if size == 3:
+                hi = self.peek(addr + 2)
+                oper = None if oper is None or hi is None else oper | (hi << 8)
+            if oper is None:
+                return None
+            if opcode.mode is AddrMode.REL:
+                oper = (addr + 2 + toSigned(oper)) & 0xffff
+
+        return (binary, oper, size, opcode.cycles)
+
+    def build(self, pc):
+        ops = []
+        addr = pc
+        while len(ops) < self.max_ops:
+            op = self.decode(addr)
+            if op is None:
+                break
+
+            ops.append(op)
+            addr += op[2]
+            if self.ends_block[op[0]]:
+                break
+
+        if not ops:
+            return None
+
+        block = Block(pc, addr, ops, sum(self.max_cycles[op[0]] for op in ops))
+        block.idle = idle_loop(block, self.opcodes, self.bus)
+        self.blocks[pc] = block
+        for page in block.pages():
+            self.page_blocks.setdefault(page, []).append(block)
+            self.watch(page)
+
+        return block
+
+    def watch(self, page):
+        if page in self.aliases:
+            return
+
+        aliases = self.bus.aliases(page)
+        for alias in aliases:
+            self.aliases[alias] = aliases
+            if self.bus.base_wpages[alias] is not None:
+                self.bus.watch_writes(alias, self.invalidate)
+
+    def unwatch(self, page):
+        aliases = self.aliases.get(page, ())
+        if any(self.page_blocks.get(alias) for alias in aliases):
+            return
+
+        for alias in aliases:
+            del self.aliases[alias]
+            self.bus.unwatch_writes(alias, self.invalidate)
+
+    def invalidate(self, addr, value):
+        # writing back the same byte leaves the decode valid
+        if self.peek(addr) == value:
+            return
+
+        low = addr & 0xff
+        for page in self.aliases[addr >> 8]:
+            blocks = self.page_blocks.get(page)
+            if not blocks:
+                continue
+
+            page_addr = (page << 8) | low
+            for block in tuple(blocks):
+                if block.start <= page_addr < block.end:
+                    self.discard(block)
+
+    def discard(self, block):
+        del self.blocks[block.start]
+        del block.ops[:]
+        block.func = None
+
+        for page in block.pages():
+            self.page_blocks[page].remove(block)
+            if not self.page_blocks[page]:
+                del self.page_blocks[page]
+                self.unwatch(page)
+
+    # remap listener, the pages [first, end) show other memory now
+    def unmap(self, first, end):
+        for page in range(first, end):
+            for alias in self.aliases.get(page, ()):
+                for block in tuple(self.page_blocks.get(alias, ())):
+                    self.discard(block)
+
+    # called before page is overwritten with data behind the bus' back
+    def rewrite(self, page, data):
+        if not any(self.page_blocks.get(alias) for alias in self.aliases.get(page, ())):
+            return
+
+        view = self.bus.base_rpages[page]
+        base = page << 8
+        for offset in range(PAGE_SIZE):
+            # the last block on the page is gone once it is unwatched
+            if page not in self.aliases:
+                break
+            if view[offset] != data[offset]:
+                self.invalidate(base | offset, data[offset])
+
+    def flush(self):
+        for block in tuple(self.blocks.values()):
+            self.discard(block)
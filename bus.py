@@ -0,0 +1,295 @@
+from common import *
+from ram import *
+
+"""
+CPU address bus.
+
+The 64K address space is split into 256 pages of 256 bytes. Every page has
+an entry in the read and the write page table:
+    rpages[page] / wpages[page] - memoryview of the 256 bytes backing the
+                                  page, or None if the page is a device
+    rdevs[page] / wdevs[page]   - device handlers, called as read(addr) and
+                                  write(addr, value) when the memoryview
+                                  entry is None
+
+Mirrors are several pages sharing views of the same buffer. The page lists
+are only ever updated in place, so callers may keep references to them.
+
+map_pages() swaps in prebuilt page views, which is how mappers switch
+banks. Remap listeners are called as listener(first, end) after the
+entries of pages [first, end) changed.
+
+Write watchers trap every write to a page: the page is taken off the fast
+path (wpages[page] = None) and its write handler calls each watcher with
+(addr, value) before doing the write mapped underneath. Read watchers do
+the same for reads (rpages[page] = None) and are called with the value
+read. Pages without watchers are not affected. base_rpages / base_wpages
+always hold the mapped views, watched or not, for code that looks at
+memory without being a CPU access.
+
+plain[page] is true for memory pages and for device pages mapped with
+plain=True, whose reads have no side effects and only change by a write
+or a clock event. Idle loop detection only skips loops reading those.
+
+bus[addr] is a CPU read. Slices and peek() look at memory without side
+effects: no watchers run and device pages read as 0 unless they are plain.
+"""
+
+PAGE_SIZE = 0x100
+PAGES = 0x100
+
+class Registers():
+    def __init__(self, base, size, mirror=True):
+        self.base = base
+        self.size = size
+        self.mirror = mirror
+        self.data = bytearray(size)
+
+    def read(self, addr):
+        offset = addr - self.base
+        if self.mirror:
+            offset %= self.size
+        elif offset >= self.size:
+            return 0
+
+        return self.data[offset]
+
+    def write(self, addr, value):
+        offset = addr - self.base
+        if self.mirror:
+            offset %= self.size
+        elif offset >= self.size:
+            return
+
+        self.data[offset] = value
+
+class Bus(RAM):
+    def __init__(self, size=0x10000, addr_size=4):
+        self.size = size
+        self.addr_size = addr_size
+        self.rpages = [None] * PAGES
+        self.wpages = [None] * PAGES
+        self.rdevs = [self.open_bus] * PAGES
+        self.wdevs = [self.ignore] * PAGES
+        self.base_rpages = [None] * PAGES
+        self.base_rdevs = [self.open_bus] * PAGES
+        self.base_wpages = [None] * PAGES
+        self.base_wdevs = [self.ignore] * PAGES
+        self.backing = [None] * PAGES
+        self.read_watchers = [None] * PAGES
+        self.plain = [False] * PAGES
+        self.watchers = [None] * PAGES
+        self.remap_listeners = []
+
+    def open_bus(self, addr):
+        return 0
+
+    def ignore(self, addr, value):
+        pass
+
+    # maps [start, end] to data, wrapping around data for mirrors
+    def map_memory(self, start, end, data, offset=0, writable=True):
+        view = memoryview(data)
+        for page in range(start >> 8, (end >> 8) + 1):
+            base = (offset + (page << 8) - start) % len(data)
+            page_view = view[base:base+PAGE_SIZE]
+
+            self.set_read(page, page_view, self.open_bus)
+            self.backing[page] = (id(data), base)
+            self.plain[page] = True
+            self.set_write(page, page_view if writable else None, self.ignore)
+
+    def map_device(self, start, end, read=None, write=None, plain=False):
+        for page in range(start >> 8, (end >> 8) + 1):
+            self.set_read(page, None, read if read is not None else self.open_bus)
+            self.backing[page] = None
+            self.plain[page] = plain or read is None
+            self.set_write(page, None, write if write is not None else self.ignore)
+
+    # points pages from first on at views, read-only with writes going to
+    # write. Pages showing the same view object are mirrors.
+    def map_pages(self, first, views, write=None):
+        write = write if write is not None else self.ignore
+        page = first
+        for view in views:
+            self.set_read(page, view, self.open_bus)
+            self.backing[page] = (id(view), 0)
+            self.plain[page] = True
+            self.set_write(page, None, write)
+            page += 1
+
+        for listener in self.remap_listeners:
+            listener(first, page)
+
+    def set_read(self, page, view, handler):
+        self.base_rpages[page] = view
+        self.base_rdevs[page] = handler
+        if self.read_watchers[page] is None:
+            self.rpages[page] = view
+            self.rdevs[page] = handler
+
+    def set_write(self, page, view, handler):
+        self.base_wpages[page] = view
+        self.base_wdevs[page] = handler
+        if self.watchers[page] is None:
+            self.wpages[page] = view
+            self.wdevs[page] = handler
+
+    # pages mapped to the same bytes as page, page itself included
+    def aliases(self, page):
+        backing = self.backing[page]
+        if backing is None:
+            return [page]
+
+        return [p for p in range(PAGES) if self.backing[p] == backing]
+
+    def watch_writes(self, page, watcher):
+        if self.watchers[page] is None:
+            self.watchers[page] = []
+            self.wpages[page] = None
+            self.wdevs[page] = self.watched_write
+
+        self.watchers[page].append(watcher)
+
+    def unwatch_writes(self, page, watcher):
+        watchers = self.watchers[page]
+        if watchers is None or watcher not in watchers:
+            return
+
+        watchers.remove(watcher)
+        if not watchers:
+            self.watchers[page] = None
+            self.wpages[page] = self.base_wpages[page]
+            self.wdevs[page] = self.base_wdevs[page]
+
+    def watched_write(self, addr, value):
+        page = addr >> 8
+        for watcher in tuple(self.watchers[page]):
+            watcher(addr, value)
+
+        view = self.base_wpages[page]
+        if view is not None:
+            view[addr & 0xff] = value
+        else:
+            self.base_wdevs[page](addr, value)
+
+    def watch_reads(self, page, watcher):
+        if self.read_watchers[page] is None:
+            self.read_watchers[page] = []
+            self.rpages[page] = None
+            self.rdevs[page] = self.watched_read
+
+        self.read_watchers[page].append(watcher)
+
+    def unwatch_reads(self, page, watcher):
+        watchers = self.read_watchers[page]
+        if watchers is None or watcher not in watchers:
+            return
+
+        watchers.remove(watcher)
+        if not watchers:
+            self.read_watchers[page] = None
+            self.rpages[page] = self.base_rpages[page]
+            self.rdevs[page] = self.base_rdevs[page]
+
+    def watched_read(self, addr):
+        page = addr >> 8
+        view = self.base_rpages[page]
+        if view is not None:
+            value = view[addr & 0xff]
+        else:
+            value = self.base_rdevs[page](addr)
+
+        for watcher in tuple(self.read_watchers[page]):
+            watcher(addr, value)
+
+        return value
+
+    def read(self, addr):
+        page = self.rpages[addr >> 8]
+        if page is not None:
+            return page[addr & 0xff]
+
+        return self.rdevs[addr >> 8](addr)
+
+    def write(self, addr, value):
+        page = self.wpages[addr >> 8]
+        if page is not None:
+            page[addr & 0xff] = value
+        else:
+            self.wdevs[addr >> 8](addr, value)
+
+    def read_word(self, addr):
+        return self.read(addr) | (self.read((addr + 1) & 0xffff) << 8)
+
+    # writes straight into the backing memory, read-only pages included.
+    # Remap listeners are told about read-only pages it changed, nothing
+    # watches their writes.
+    def load(self, blob, offset):
+        addr = offset
+        end = offset + len(blob)
+        if offset < 0 or end > self.size:
+            raise ValueError('%d bytes at %s run past %s' % \
+                             (len(blob), hexStr(offset, size=4, prefix='$'), \
+                              hexStr(self.size - 1, size=4, prefix='$')))
+        for page in range(offset >> 8, (end + 0xff) >> 8):
+            view = self.base_rpages[page]
+            if view is not None and view.readonly:
+                raise ValueError('%s is in read-only memory' % \
+                                 hexStr(max(offset, page << 8), size=4, prefix='$'))
+
+        pos = 0
+        while addr < end:
+            page = addr >> 8
+            lo = addr & 0xff
+            count = min(PAGE_SIZE - lo, end - addr)
+            view = self.base_rpages[page]
+            if view is not None:
+                # watchers see the old bytes, as they do for a CPU write
+                if self.watchers[page] is not None:
+                    for i in range(count):
+                        for watcher in tuple(self.watchers[page] or ()):
+                            watcher(addr + i, blob[pos + i])
+                view[lo:lo+count] = blob[pos:pos+count]
+                if self.base_wpages[page] is None:
+                    for listener in self.remap_listeners:
+                        listener(page, page + 1)
+            else:
+                for i in range(count):
+                    self.wdevs[page](addr + i, blob[pos + i])
+
+            addr += count
+            pos += count
+
+    def peek(self, addr):
+        page = addr >> 8
+        view = self.base_rpages[page]
+        if view is not None:
+            return view[addr & 0xff]
+
+        return self.base_rdevs[page](addr) if self.plain[page] else 0
+
+    def __getitem__(self, pos):
+        if not isinstance(pos, slice):
+            return self.read(pos)
+
+        start, stop, step = pos.indices(self.size)
+        if step != 1:
+            return bytes(self.peek(a) for a in range(start, stop, step))
+
+        out = bytearray()
+        addr = start
+        while addr < stop:
+            page = addr >> 8
+            end = min((page + 1) << 8, stop)
+            view = self.base_rpages[page]
+            if view is not None:
+                out += view[addr & 0xff:((end - 1) & 0xff) + 1]
+            else:
+                out += bytes(self.peek(a) for a in range(addr, end))
+            addr = end
+
+        return bytes(out)
+
+    def __setitem__(self, pos, value):
+        self.write(pos, value)
@@ -1,4 +1,7 @@
+from functools import partial
 from common import *
+from opcodes import *
+from recorder import TraceRecorder
 
 """
     C = 0 #Carry flag
@@ -9,18 +12,63 @@ from common import *
     U = 5 #unused. logical 1 at all times
     V = 6 #overflow flag
     S = 7 #sign flag
+
+The CPU keeps N, Z and V as the last result they were computed from and
+only packs them into a status byte when it is pushed or inspected:
+    n - bit 7 is the sign flag
+    z - zero flag is set when z == 0
+    v - bit 7 is the overflow flag
+    c, i, d, b - 0 or 1
+
+Every instruction adds its base cycles from OpCode.cycles to the clock in
+one go. Only the page crossing of an indexed read and taken branches are
+charged on top, by the addr_*_read resolvers and branch().
+
+Interrupts:
+    NMI   - edge triggered, nmi() latches it
+    IRQ   - level triggered and masked by I, set_irq() drives one line of
+            a wired-OR bitmask so several devices can hold it
+    RESET - reset() takes the RESET vector, I is set and SP drops by three
+Raising a line the CPU has to act on schedules a clock event due at once,
+which moves the clock deadline the run loops already compare against, so
+nothing is polled while the lines are quiet. The interrupt is taken at the
+next instruction boundary the run loop checks the deadline at, RESET
+first, then NMI, then IRQ. CLI, PLP and RTI re-check a held IRQ line when
+they clear I. Vectors: NMI $FFFA, RESET $FFFC, IRQ/BRK $FFFE.
 """
-class StatusRegister(Register):
+
+NMI_VECTOR = 0xfffa
+RESET_VECTOR = 0xfffc
+IRQ_VECTOR = 0xfffe
+INTERRUPT_CYCLES = 7
+
+class StatusRegister():
     bitmap = {'C':0, 'Z':1, 'I':2, 'D':3, 'B':4, 'U':5, 'V':6, 'S':7}
-    
-    def __init__(self, value):
-        Register.__init__(StatusRegister, value)        
+
+    def __init__(self, cpu):
+        object.__setattr__(self, 'cpu', cpu)
+
+    @property
+    def value(self):
+        return self.cpu.get_status()
+
+    def __getitem__(self, pos):
+        return (self.cpu.get_status() & (1 << pos)) > 0
+
+    def __setitem__(self, pos, value):
+        if value is None or value == 0:
+            self.cpu.set_status(clearBit(self.cpu.get_status(), pos))
+        else:
+            self.cpu.set_status(setBit(self.cpu.get_status(), pos))
 
     def __getattr__(self, attrName):
+        if attrName not in StatusRegister.bitmap:
+            raise AttributeError(attrName)
+
         return self[StatusRegister.bitmap[attrName]]
-        
+
     def __setattr__(self, attrName, val):
-        if attrName in StatusRegister.bitmap.keys():
+        if attrName in StatusRegister.bitmap:
             self[StatusRegister.bitmap[attrName]] = val
         else:
             super().__setattr__(attrName, val)
@@ -29,43 +77,140 @@ class StatusRegister(Register):
         return 'S V - B D I Z C\n%d %d %d %d %d %d %d %d' % \
                (self.S, self.V, self.U, self.B, self.D, self.I, self.Z, self.C)
 
-class CPU:              
+class IllegalOpcode(Exception):
+    def __init__(self, opcode, addr):
+        self.opcode = opcode
+        self.addr = addr
+        super().__init__('illegal opcode %s at %s' % \
+                         (hexStr(opcode.binary, prefix='$'), hexStr(addr, size=4, prefix='$')))
+
+class CPU:
+    __slots__ = ('ram', 'opcodes', 'pc', 'a', 'x', 'y', 'sp', 'n', 'z', 'c', 'v', 'i', 'd', 'b', \
+                 'clk', 'verbose', 'dispatch', 'decoders', 'resolvers', 'cycles', 'rpages', 'wpages', \
+                 'trace', 'irq_lines', 'nmi_pending', 'reset_pending', 'service_event')
+
     def __init__(self, clk, ram, opcodes, pc=0, status=0x20, a=0, x=0, y=0, sp=0xFF, verbose=False):
         self.ram = ram
+        self.rpages = ram.rpages
+        self.wpages = ram.wpages
         self.opcodes = opcodes
         self.pc = pc
-        self.status = StatusRegister(status)
-        self.y = Register(y)
-        self.x = Register(x)
-        self.a = Register(a)
-        self.sp = Register(sp)
+        self.set_status(status)
+        self.y = y
+        self.x = x
+        self.a = a
+        self.sp = sp
         self.clk = clk
-        self.verbose = verbose
+        self.verbose = False
+        self.trace = None
+        self.irq_lines = 0
+        self.nmi_pending = False
+        self.reset_pending = False
+        self.service_event = None
+        self.cycles = [opcode.cycles for opcode in opcodes]
+        self.decoders = self.build_decoders()
+        self.resolvers = self.build_resolvers()
+        self.dispatch = self.build_dispatch()
+        self.config(verbose=verbose)
 
     def config(self, pc=None, status=None, a=None, x=None, y=None, sp=None, clk_cnt=None, verbose=None):
         if pc is not None:
             self.pc = pc
 
         if status is not None:
-            self.status = StatusRegister(status)
+            self.set_status(status)
 
         if y is not None:
-            self.y = Register(y)
+            self.y = y
 
         if x is not None:
-            self.x = Register(x)
+            self.x = x
 
         if a is not None:
-            self.a = Register(a)
+            self.a = a
 
         if sp is not None:
-            self.sp = Register(sp)
+            self.sp = sp
 
         if clk_cnt is not None:
             self.clk.counter = clk_cnt
 
         if verbose is not None:
             self.verbose = verbose
+            self.__class__ = TracingCPU if verbose else CPU
+            if verbose and self.trace is None:
+                self.trace = TraceRecorder()
+
+    def regs(self):
+        return (self.pc, self.a, self.x, self.y, self.sp, self.get_status())
+
+    def set_regs(self, regs):
+        self.pc, self.a, self.x, self.y, self.sp, status = regs
+        self.set_status(status)
+
+    @property
+    def status(self):
+        return StatusRegister(self)
+
+    @status.setter
+    def status(self, value):
+        if isinstance(value, StatusRegister):
+            value = value.value
+        self.set_status(value)
+
+    def get_status(self):
+        return (self.n & 0x80) | ((self.v & 0x80) >> 1) | 0x20 | (self.b << 4) | \
+               (self.d << 3) | (self.i << 2) | ((self.z == 0) << 1) | self.c
+
+    def set_status(self, value):
+        self.n = value & 0x80
+        self.v = (value & 0x40) << 1
+        self.b = (value >> 4) & 1
+        self.d = (value >> 3) & 1
+        self.i = (value >> 2) & 1
+        self.z = 0 if value & 0x02 else 1
+        self.c = value & 1
+
+    def build_decoders(self):
+        decoders = {None: self.decode_none, AddrMode.A: self.decode_none, \
+                    AddrMode.IMM: self.decode_imm, AddrMode.REL: self.decode_rel}
+
+        table = []
+        for opcode in self.opcodes:
+            decoder = decoders.get(opcode.mode)
+            if decoder is None:
+                decoder = self.decode_byte if opcode.size == 2 else self.decode_word
+
+            table.append(decoder)
+
+        return table
+
+    def build_resolvers(self):
+        table = []
+        for opcode in self.opcodes:
+            resolver = None
+            if opcode.page_cycles:
+                resolver = getattr(self, 'addr_%s_read' % opcode.mode.name)
+            elif opcode.mode is not None:
+                resolver = getattr(self, 'addr_' + opcode.mode.name)
+
+            table.append(resolver)
+
+        return table
+
+    def build_dispatch(self):
+        table = []
+        for opcode in self.opcodes:
+            handler = None
+            if opcode.code is not None:
+                handler = getattr(self, 'do_' + opcode.code.name, None)
+
+            if handler is None:
+                handler = self.trap
+
+            table.append(partial(handler, opcode))
+
+        return table
 
     def print_opcodes(self):
         for c in range(0, len(self.opcodes), 2):
@@ -77,8 +222,8 @@ class CPU:
 
     def reg_to_str(self):
         return 'A:%s X:%s Y:%s PC:%s SP:%s SV-BDIZC:%s Clk:%d' % \
-               (hexStr(self.a.value), hexStr(self.x.value), hexStr(self.y.value), \
-                hexStr(self.pc), hexStr(self.sp.value), binStr(self.status.value), \
+               (hexStr(self.a), hexStr(self.x), hexStr(self.y), \
+                hexStr(self.pc), hexStr(self.sp), binStr(self.get_status()), \
                 self.clk.counter)
 
     def read_oper(self, op, oper=None):
@@ -86,108 +231,427 @@ class CPU:
         if oper_size == 0:
             return None
 
+        # branch targets are relative to the end of the instruction
         if oper is None:
             oper = self.read_next(oper_size)
-        
+            end = self.pc
+        else:
+            end = self.pc + op.size
+
         if op.mode == AddrMode.REL:
-            oper = toSigned(oper) + self.pc
+            oper = (toSigned(oper) + end) & 0xffff
 
         return oper
 
-    def fetch_src(self, op):
-        src = None
-        oper = self.read_oper(op)
-
-        if op.mode in (AddrMode.ZP, AddrMode.ABS):
-           pass 
-        elif op.mode == AddrMode.ZPX:
-            oper += self.x.value
-        elif op.mode == AddrMode.ZPY:
-            oper += self.y.value
-        elif op.mode == AddrMode.ABSX:
-            oper += self.x.value
-        elif op.mode == AddrMode.ABSY:
-            oper += self.y.value
-        elif op.mode == AddrMode.IND:
-            ind_addr = oper
-            oper = cpu.read(ind_addr, 2)
-        elif self.mode == AddrMode.INDX:
-            ind_addr = (oper + self.x.value) & 0x00ff
-            oper = self.read(ind_addr, 2)
-        elif self.mode == AddrMode.INDY:
-            ind_addr = oper
-            oper = self.read(ind_addr, 2) + self.y.value
-            
-        if oper is not None:
-            src = self.read(oper)
-            
-        return src, oper
+    # operand decoders, run with pc just past the opcode byte.
+    # IMM resolves to the address of the operand byte, REL to the target.
+    def decode_none(self):
+        return None
+
+    def decode_imm(self):
+        addr = self.pc
+        self.pc += 1
+        return addr
+
+    def decode_rel(self):
+        offset = self.read_next()
+        return (self.pc + toSigned(offset)) & 0xffff
+
+    def decode_byte(self):
+        return self.read_next()
+
+    def decode_word(self):
+        return self.read_next(2)
+
+    def addr_A(self, oper):
+        return None
+
+    def addr_IMM(self, oper):
+        return oper
+
+    def addr_REL(self, oper):
+        return oper
+
+    def addr_ZP(self, oper):
+        return oper
+
+    def addr_ZPX(self, oper):
+        return (oper + self.x) & 0xff
+
+    def addr_ZPY(self, oper):
+        return (oper + self.y) & 0xff
+
+    def addr_ABS(self, oper):
+        return oper
+
+    def addr_ABSX(self, oper):
+        return (oper + self.x) & 0xffff
+
+    def addr_ABSY(self, oper):
+        return (oper + self.y) & 0xffff
+
+    # indexed reads take a cycle more when the index crosses a page
+    def addr_ABSX_read(self, oper):
+        addr = (oper + self.x) & 0xffff
+        if (addr ^ oper) & 0xff00:
+            self.clk.counter += 1
+        return addr
+
+    def addr_ABSY_read(self, oper):
+        addr = (oper + self.y) & 0xffff
+        if (addr ^ oper) & 0xff00:
+            self.clk.counter += 1
+        return addr
+
+    def addr_IND(self, oper):
+        # the high byte is not carried into the next page
+        hi_addr = (oper & 0xff00) | ((oper + 1) & 0xff)
+        return self.read(oper) | (self.read(hi_addr) << 8)
+
+    def addr_INDX(self, oper):
+        ind_addr = (oper + self.x) & 0xff
+        return self.read(ind_addr) | (self.read((ind_addr + 1) & 0xff) << 8)
+
+    def addr_INDY(self, oper):
+        base = self.read(oper) | (self.read((oper + 1) & 0xff) << 8)
+        return (base + self.y) & 0xffff
+
+    def addr_INDY_read(self, oper):
+        base = self.read(oper) | (self.read((oper + 1) & 0xff) << 8)
+        addr = (base + self.y) & 0xffff
+        if (addr ^ base) & 0xff00:
+            self.clk.counter += 1
+        return addr
+
+    def fetch_src(self, op, oper):
+        addr = self.resolvers[op.binary](oper)
+        if addr is None:
+            return self.a, None
+
+        return self.read(addr), addr
 
     def store_src(self, op, src, addr):
-        if op.mode is None:
-            return
-       
-        dest = None
-        if op.mode in (AddrMode.A, AddrMode.IMM):
+        if addr is None:
             self.a = src
-            dest = 'A'
-        elif op.mode in (AddrMode.ZP, AddrMode.ABS):
-            self.ram[addr] = src
-            dest = hexStr(addr, size=4, prefix='$')
+        else:
+            self.write(addr, src)
 
-        if dest is not None:
-            self.clk.tick()
+    def push(self, value):
+        self.write(0x100 | self.sp, value)
+        self.sp = (self.sp - 1) & 0xff
 
-        if self.verbose and dest is not None:
-            print('%s -> %s' % (hexStr(src, prefix='$'), dest))
+    def pull(self):
+        self.sp = (self.sp + 1) & 0xff
+        return self.read(0x100 | self.sp)
 
-    def do_BRK(self, op):
-        self.clk.tick(7)
-        pass
+    def push_word(self, value):
+        self.push(value >> 8)
+        self.push(value & 0xff)
 
-    def do_ADC(self, op):
-        src, addr = self.fetch_src(op)
+    def pull_word(self):
+        lo = self.pull()
+        return lo | (self.pull() << 8)
 
-        temp = src + self.a.value + self.status.C
-        self.set_zero(temp & 0xff)
+    def trap(self, op, oper):
+        raise IllegalOpcode(op, self.pc - 1)
+
+    def add(self, src):
+        a = self.a
+        temp = a + src + self.c
+        result = temp & 0xff
 
         #decimal mode not supported
-        self.set_sign(temp)
+        self.v = ~(a ^ src) & (a ^ result)
+        self.c = temp >> 8
+        self.a = self.n = self.z = result
+
+    def compare(self, reg, op, oper):
+        src, addr = self.fetch_src(op, oper)
+        temp = reg - src
+        self.c = 0 if temp < 0 else 1
+        self.n = self.z = temp & 0xff
+
+    # a taken branch costs one cycle, two when it lands on another page
+    def branch(self, target, cond):
+        if cond:
+            self.clk.counter += 1 + ((self.pc ^ target) & 0xff00 != 0)
+            self.pc = target
+
+    # pushes pc and the status, B only set in the copy BRK pushes
+    def enter(self, vector, brk=0):
+        self.push_word(self.pc)
+        self.push((self.get_status() & 0xef) | brk)
+        self.i = 1
+        self.pc = self.read(vector, 2)
+
+    def nmi(self):
+        self.nmi_pending = True
+        self.request_service()
+
+    def set_irq(self, line=1, level=True):
+        if level:
+            self.irq_lines |= line
+            self.check_irq()
+        else:
+            self.irq_lines &= ~line
+
+    def reset(self):
+        self.reset_pending = True
+        self.request_service()
+
+    def check_irq(self):
+        if self.irq_lines and not self.i:
+            self.request_service()
+
+    # one clock event due now, the run loop takes it at the next boundary
+    def request_service(self):
+        if self.service_event is None:
+            self.service_event = self.clk.schedule(self.clk.counter, self.service)
+
+    def service(self, cycle):
+        self.service_event = None
+        if self.reset_pending:
+            self.reset_pending = False
+            self.nmi_pending = False
+            self.sp = (self.sp - 3) & 0xff
+            self.i = 1
+            self.pc = self.read(RESET_VECTOR, 2)
+        elif self.nmi_pending:
+            self.nmi_pending = False
+            self.enter(NMI_VECTOR)
+        elif self.irq_lines and not self.i:
+            self.enter(IRQ_VECTOR)
+        else:
+            return
 
-        #Calc overflow
-        self.set_overflow(temp)
-        self.set_carry(temp > 0xff)
+        self.clk.counter += INTERRUPT_CYCLES
 
-        self.store_src(op, temp & 0xff, addr)
-        self.clk.tick()
+    def do_BRK(self, op, oper):
+        # the byte after BRK is skipped on return
+        self.pc = (self.pc + 1) & 0xffff
+        self.enter(IRQ_VECTOR, 0x10)
 
-    def do_ASL(self, op):
-        src, addr = self.fetch_src(op)
-        
-        self.set_carry(src & 0x80)
-        src = src << 1
-        src = src & 0xff
-        self.set_sign(src)
-        self.set_zero(src)
+    def do_ADC(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+        self.add(src)
+
+    def do_SBC(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+        self.add(src ^ 0xff)
+
+    def do_AND(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+        self.a = self.n = self.z = self.a & src
+
+    def do_ORA(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+        self.a = self.n = self.z = self.a | src
+
+    def do_EOR(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+        self.a = self.n = self.z = self.a ^ src
+
+    def do_ASL(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+
+        self.c = src >> 7
+        src = (src << 1) & 0xff
+        self.n = self.z = src
 
         self.store_src(op, src, addr)
 
-        self.clk.tick()
+    def do_LSR(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
 
-    def execute_op(self, op): 
-        getattr(self, 'do_' + str(op.code))(op)
+        self.c = src & 1
+        src = src >> 1
+        self.n = self.z = src
 
-    def execute(self):
-        if self.verbose:
-            self.print_op_bytes()
+        self.store_src(op, src, addr)
 
-        opcode = self.opcodes[self.read_next()]
-        self.execute_op(opcode)
+    def do_ROL(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
 
-        if self.verbose:
-            print(self.reg_to_str())
+        result = ((src << 1) | self.c) & 0xff
+        self.c = src >> 7
+        self.n = self.z = result
+
+        self.store_src(op, result, addr)
+
+    def do_ROR(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+
+        result = (src >> 1) | (self.c << 7)
+        self.c = src & 1
+        self.n = self.z = result
+
+        self.store_src(op, result, addr)
+
+    def do_BIT(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+        self.n = src
+        self.v = src << 1
+        self.z = self.a & src
+
+    def do_BCC(self, op, oper):
+        self.branch(oper, not self.c)
+
+    def do_BCS(self, op, oper):
+        self.branch(oper, self.c)
+
+    def do_BEQ(self, op, oper):
+        self.branch(oper, self.z == 0)
+
+    def do_BNE(self, op, oper):
+        self.branch(oper, self.z != 0)
+
+    def do_BMI(self, op, oper):
+        self.branch(oper, self.n & 0x80)
+
+    def do_BPL(self, op, oper):
+        self.branch(oper, not self.n & 0x80)
+
+    def do_BVS(self, op, oper):
+        self.branch(oper, self.v & 0x80)
+
+    def do_BVC(self, op, oper):
+        self.branch(oper, not self.v & 0x80)
+
+    def do_CLC(self, op, oper):
+        self.c = 0
+
+    def do_CLD(self, op, oper):
+        self.d = 0
+
+    def do_CLI(self, op, oper):
+        self.i = 0
+        self.check_irq()
+
+    def do_CLV(self, op, oper):
+        self.v = 0
+
+    def do_SEC(self, op, oper):
+        self.c = 1
+
+    def do_SED(self, op, oper):
+        self.d = 1
+
+    def do_SEI(self, op, oper):
+        self.i = 1
+
+    def do_CMP(self, op, oper):
+        self.compare(self.a, op, oper)
+
+    def do_CPX(self, op, oper):
+        self.compare(self.x, op, oper)
+
+    def do_CPY(self, op, oper):
+        self.compare(self.y, op, oper)
+
+    def do_DEC(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+        src = (src - 1) & 0xff
+        self.n = self.z = src
+        self.store_src(op, src, addr)
+
+    def do_INC(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+        src = (src + 1) & 0xff
+        self.n = self.z = src
+        self.store_src(op, src, addr)
+
+    def do_DEX(self, op, oper):
+        self.x = self.n = self.z = (self.x - 1) & 0xff
+
+    def do_DEY(self, op, oper):
+        self.y = self.n = self.z = (self.y - 1) & 0xff
+
+    def do_INX(self, op, oper):
+        self.x = self.n = self.z = (self.x + 1) & 0xff
+
+    def do_INY(self, op, oper):
+        self.y = self.n = self.z = (self.y + 1) & 0xff
+
+    def do_JMP(self, op, oper):
+        self.pc = self.resolvers[op.binary](oper)
+
+    def do_JSR(self, op, oper):
+        self.push_word((self.pc - 1) & 0xffff)
+        self.pc = oper
+
+    def do_RTS(self, op, oper):
+        self.pc = (self.pull_word() + 1) & 0xffff
+
+    def do_RTI(self, op, oper):
+        self.set_status(self.pull())
+        self.pc = self.pull_word()
+        self.check_irq()
+
+    def do_LDA(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+        self.a = self.n = self.z = src
 
-        return opcode.code
+    def do_LDX(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+        self.x = self.n = self.z = src
+
+    def do_LDY(self, op, oper):
+        src, addr = self.fetch_src(op, oper)
+        self.y = self.n = self.z = src
+
+    def do_STA(self, op, oper):
+        self.store_src(op, self.a, self.resolvers[op.binary](oper))
+
+    def do_STX(self, op, oper):
+        self.store_src(op, self.x, self.resolvers[op.binary](oper))
+
+    def do_STY(self, op, oper):
+        self.store_src(op, self.y, self.resolvers[op.binary](oper))
+
+    def do_NOP(self, op, oper):
+        pass
+
+    def do_PHA(self, op, oper):
+        self.push(self.a)
+
+    def do_PHP(self, op, oper):
+        self.push(self.get_status() | 0x10)
+
+    def do_PLA(self, op, oper):
+        self.a = self.n = self.z = self.pull()
+
+    def do_PLP(self, op, oper):
+        self.set_status(self.pull())
+        self.check_irq()
+
+    def do_TAX(self, op, oper):
+        self.x = self.n = self.z = self.a
+
+    def do_TAY(self, op, oper):
+        self.y = self.n = self.z = self.a
+
+    def do_TSX(self, op, oper):
+        self.x = self.n = self.z = self.sp
+
+    def do_TXA(self, op, oper):
+        self.a = self.n = self.z = self.x
+
+    def do_TXS(self, op, oper):
+        self.sp = self.x
+
+    def do_TYA(self, op, oper):
+        self.a = self.n = self.z = self.y
+
+    def execute_op(self, op):
+        self.clk.counter += self.cycles[op.binary]
+        self.dispatch[op.binary](self.decoders[op.binary]())
+
+    def execute(self):
+        binary = self.read_next()
+        self.clk.counter += self.cycles[binary]
+        self.dispatch[binary](self.decoders[binary]())
+
+        return self.opcodes[binary].code
 
     def get_op_bytes(self, addr):
         opcode = self.opcodes[self.ram[addr]]
@@ -221,21 +685,8 @@ class CPU:
             hex_str = self.ram.to_str(addr, op_size, formatted=False)
 
             return '%-8s %-10s %-12s' % (addr_str, hex_str, decoded)
-        
-        return decoded
-
-    def set_sign(self, src):
-        self.status.S = testBit(src, 7)
-
-    def set_zero(self, src):
-        self.status.Z = src == 0
 
-    def set_carry(self, src):
-        self.status.C = src & 0x80
-
-    # TODO: fix this
-    def set_overflow(self, overflow):
-        self.status.V = overflow
+        return decoded
 
     def read_next(self, size=1):
         data = self.read(self.pc, size)
@@ -243,16 +694,55 @@ class CPU:
         self.pc += size
 
         return data
-    
+
+    # memory pages are accessed straight through the bus page tables,
+    # only device pages cost a call into the bus
+    def write(self, addr, value):
+        page = self.wpages[addr >> 8]
+        if page is not None:
+            page[addr & 0xff] = value
+        else:
+            self.ram.write(addr, value)
+
     def read(self, addr, size=1):
-        self.clk.tick()
-        
-        raw_bytes = self.ram[addr:addr+size]
+        page = self.rpages[addr >> 8]
+        if page is not None:
+            result = page[addr & 0xff]
+        else:
+            result = self.ram.read(addr)
 
-        result = int.from_bytes(raw_bytes, 'little')
-        if self.verbose:
-            print ('%s <- %s' % \
-                    (hexStr(result, size=2, prefix='$'), hexStr(addr, size=4, prefix='$')))
+        if size == 2:
+            hi_addr = (addr + 1) & 0xffff
+            page = self.rpages[hi_addr >> 8]
+            if page is not None:
+                result |= page[hi_addr & 0xff] << 8
+            else:
+                result |= self.ram.read(hi_addr) << 8
 
         return result
 
+# CPU recording every instruction into self.trace, swapped in by
+# config(verbose=True) so the plain CPU carries no tracing checks
+class TracingCPU(CPU):
+    __slots__ = ()
+
+    def execute(self):
+        pc = self.pc
+        binary = self.read_next()
+        self.clk.counter += self.cycles[binary]
+        oper = self.decoders[binary]()
+        trace_oper = oper
+        if oper is None:
+            trace_oper = 0
+        elif self.opcodes[binary].mode is AddrMode.IMM:
+            # from the page behind the bus, a bus read would reach read
+            # watchers and device handlers. 0 for device pages.
+            page = self.ram.base_rpages[oper >> 8]
+            trace_oper = page[oper & 0xff] if page is not None else 0
+
+        self.dispatch[binary](oper)
+
+        self.trace.record(pc, binary, trace_oper, self.a, self.x, self.y, self.sp, \
+                          self.get_status(), self.clk.counter)
+
+        return self.opcodes[binary].code
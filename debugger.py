@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+
+import re
+import sys
+from common import *
+from opcodes import *
+from bus import PAGES
+
+"""
+Breakpoints and watchpoints.
+
+Everything the debugger checks is a 64K bytearray indexed by address:
+    breaks       - PC breakpoints, conditional ones included
+    reads/writes - read and write watchpoints
+so every check is one indexed load. A condition is only evaluated once
+its PC bitmap entry is set.
+
+Watchpoints use the bus watchers, a page is only taken off the fast
+memory path while one of its addresses is watched, every other page keeps
+its memoryview. Addresses are CPU addresses, watching one mirror of RAM
+does not watch the others. Opcode and operand fetches are not data reads
+and do not trigger read watchpoints, the debug loop sets fetching while it
+fetches. Immediate operands are read by the instruction itself, fetching
+stays set while an instruction in the immediate table runs.
+
+The Processor only runs its debug loop while something is set, an
+attached debugger with nothing set costs nothing. The debug loop still
+runs whole blocks from the block cache when no breakpoint lies inside
+them, it stops after the instruction a watchpoint triggered on. Compiled
+blocks are not used while debugging.
+
+A condition is a callable taking the CPU or an expression over the
+registers a, x, y, sp, pc, p (status) and the flags C Z I D V N, with
+$ hex numbers, e.g. 'a == $10 and not C'.
+
+Run as a script:
+    python3 debugger.py [File] [Load Hex Addr] [-b Hex Addr[:Condition]] [-r Range] [-w Range] [-n Max Cycles]
+Ranges are 'start' or 'start-end' in hex, all options may repeat.
+"""
+
+class HitKind(NoValue):
+    BREAK = 'breakpoint'
+    READ = 'read watchpoint'
+    WRITE = 'write watchpoint'
+
+class Hit():
+    __slots__ = ('kind', 'pc', 'addr', 'value')
+
+    def __init__(self, kind, pc, addr=None, value=None):
+        self.kind = kind
+        self.pc = pc
+        self.addr = addr
+        self.value = value
+
+    def __repr__(self):
+        text = '%s at %s' % (self.kind, hexStr(self.pc, size=4, prefix='$'))
+        if self.addr is not None:
+            text += ' %s %s = %s' % ('reading' if self.kind is HitKind.READ else 'writing', \
+                                     hexStr(self.addr, size=4, prefix='$'), \
+                                     hexStr(self.value, prefix='$'))
+        return text
+
+FLAG_BITS = {'C': 0, 'Z': 1, 'I': 2, 'D': 3, 'V': 6, 'N': 7}
+
+class Condition():
+    __slots__ = ('source', 'code')
+
+    def __init__(self, source):
+        self.source = source
+        expr = re.sub(r'\$([0-9a-fA-F]+)', r'0x\1', source)
+        self.code = compile(expr, '<condition>', 'eval')
+
+    def __call__(self, cpu):
+        status = cpu.get_status()
+        names = {'a': cpu.a, 'x': cpu.x, 'y': cpu.y, 'sp': cpu.sp, 'pc': cpu.pc, 'p': status}
+        for flag, bit in FLAG_BITS.items():
+            names[flag] = (status >> bit) & 1
+
+        return eval(self.code, {'__builtins__': {}}, names)
+
+    def __repr__(self):
+        return self.source
+
+class Debugger():
+    def __init__(self, cpu, bus):
+        self.cpu = cpu
+        self.bus = bus
+        self.breaks = bytearray(0x10000)
+        self.reads = bytearray(0x10000)
+        self.writes = bytearray(0x10000)
+        # watched addresses per page
+        self.read_pages = [0] * PAGES
+        self.write_pages = [0] * PAGES
+        self.conditions = {}
+        self.hits = []
+        self.count = 0
+        self.fetching = False
+        self.immediate = bytes(op.mode is AddrMode.IMM for op in cpu.opcodes)
+
+    # the run loop only needs the debug loop while this is true
+    def active(self):
+        return self.count > 0
+
+    def add_break(self, pc, condition=None):
+        if isinstance(condition, str):
+            condition = Condition(condition)
+        if not self.breaks[pc]:
+            self.breaks[pc] = 1
+            self.count += 1
+
+        if condition is not None:
+            self.conditions.setdefault(pc, []).append(condition)
+        else:
+            # an unconditional breakpoint overrides the conditions
+            self.conditions.pop(pc, None)
+
+    def remove_break(self, pc):
+        if self.breaks[pc]:
+            self.breaks[pc] = 0
+            self.count -= 1
+        self.conditions.pop(pc, None)
+
+    def watch(self, start, end=None, read=False, write=True):
+        for addr in range(start, (end if end is not None else start) + 1):
+            if read and not self.reads[addr]:
+                self.reads[addr] = 1
+                self.count += 1
+                self.mark(self.read_pages, addr >> 8, 1, self.bus.watch_reads, self.on_read)
+            if write and not self.writes[addr]:
+                self.writes[addr] = 1
+                self.count += 1
+                self.mark(self.write_pages, addr >> 8, 1, self.bus.watch_writes, self.on_write)
+
+    def unwatch(self, start, end=None, read=True, write=True):
+        for addr in range(start, (end if end is not None else start) + 1):
+            if read and self.reads[addr]:
+                self.reads[addr] = 0
+                self.count -= 1
+                self.mark(self.read_pages, addr >> 8, -1, self.bus.unwatch_reads, self.on_read)
+            if write and self.writes[addr]:
+                self.writes[addr] = 0
+                self.count -= 1
+                self.mark(self.write_pages, addr >> 8, -1, self.bus.unwatch_writes, self.on_write)
+
+    # the bus watcher goes on with the first address of a page and off
+    # with the last
+    def mark(self, pages, page, delta, change, watcher):
+        pages[page] += delta
+        if pages[page] == (1 if delta > 0 else 0):
+            change(page, watcher)
+
+    def clear(self):
+        for pc in [pc for pc in range(0x10000) if self.breaks[pc]]:
+            self.remove_break(pc)
+        self.unwatch(0, 0xffff)
+        del self.hits[:]
+
+    def breakpoints(self):
+        return [(pc, self.conditions.get(pc, [])) for pc in range(0x10000) if self.breaks[pc]]
+
+    def watchpoints(self):
+        return [(addr, bool(self.reads[addr]), bool(self.writes[addr])) \
+                for addr in range(0x10000) if self.reads[addr] or self.writes[addr]]
+
+    # called by the run loop when pc has its bitmap entry set
+    def check(self, pc):
+        conditions = self.conditions.get(pc)
+        if conditions is not None and not any(condition(self.cpu) for condition in conditions):
+            return False
+
+        self.hits.append(Hit(HitKind.BREAK, pc))
+        return True
+
+    def on_read(self, addr, value):
+        if self.reads[addr] and not self.fetching:
+            self.hits.append(Hit(HitKind.READ, None, addr, value))
+
+    def on_write(self, addr, value):
+        if self.writes[addr]:
+            self.hits.append(Hit(HitKind.WRITE, None, addr, value))
+
+    # the run loop knows which instruction the watchpoints triggered on
+    def stopped(self, pc):
+        for hit in self.hits:
+            if hit.pc is None:
+                hit.pc = pc
+
+def usage():
+    return 'python3 %s [File] [Load Hex Addr] [-b Hex Addr[:Condition]] [-r Range] [-w Range] ' \
+           '[-n Max Cycles]' % sys.argv[0]
+
+def parse_range(text):
+    start, _, end = text.partition('-')
+    return int(start, 16), int(end, 16) if end else None
+
+def main(argv):
+    from processor import Processor
+    from loader import load_file
+
+    if len(argv) < 3 or argv[1] == '-h':
+        print(usage())
+        return
+
+    max_cycles = int((pop_options(argv, '-n') or ['10000000'])[-1], 0)
+    proc = Processor()
+    debugger = proc.attach_debugger()
+    for spec in pop_options(argv, '-b'):
+        addr, _, condition = spec.partition(':')
+        debugger.add_break(int(addr, 16), condition or None)
+    for spec in pop_options(argv, '-r'):
+        debugger.watch(*parse_range(spec), read=True, write=False)
+    for spec in pop_options(argv, '-w'):
+        debugger.watch(*parse_range(spec))
+
+    addr = int(argv[2], 16)
+    result = load_file(proc.bus, argv[1], addr=addr)
+    proc.cpu.config(pc=result.entry if result.entry is not None else addr)
+
+    # reports every hit and goes on until the program stops by itself
+    while max_cycles > 0:
+        reason, cycles = proc.run(max_cycles=max_cycles)
+        max_cycles -= cycles
+        for hit in debugger.hits:
+            print(hit)
+        print('%s after %d cycles  %s' % (reason, cycles, proc.cpu.reg_to_str()))
+        if not debugger.hits:
+            break
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -1,35 +1,174 @@
 #!/usr/bin/python3
 
+import os
 import sys
+import mmap
 from common import *
-from processor import *
-
-def disassemble(start_pc, hex_str, verbose):
-    proc = Processor(verbose=verbose)
-    proc.cpu.config(pc=start_pc)
-    proc.ram.load_str(hex_str, start_pc)
-    proc.disassemble(len(hex_str.replace(' ', '')) / 2)
-    
+from optable import *
+
+"""
+Streaming disassembler.
+
+disassemble() walks any buffer (bytes, bytearray, memoryview or mmap)
+and yields one Instruction record per opcode. The buffer is never copied,
+each record only holds the 1 to 3 bytes of its own instruction. Text is
+produced by format_instruction when a record is printed.
+
+disassemble_file() maps a binary file, so multi-megabyte dumps and ROM
+images are swept without being read into memory first.
+
+Bytes that cannot be decoded, illegal opcodes and an instruction cut off
+by the end of the range, come out as records with operand None and show
+as '???'.
+
+The default decode table and format_instruction only use the flat tables
+of optable.py, a record looks its OpCode up when it is asked for, so
+disassembling never builds the opcode enums.
+"""
+
+# operand kinds of the decode table
+NONE = 0
+BYTE = 1
+WORD = 2
+REL = 3
+
+# (opcode, size, kind) of every opcode. Without opcodes the table comes
+# from the flat tables and holds None for the opcode.
+def build_table(opcodes=None):
+    table = []
+    for binary in range(0x100):
+        if opcodes is None:
+            opcode = None
+            illegal = MNEMONICS[binary] is None
+            mode = MODE_NAMES[MODES[binary]]
+            size = SIZES[binary]
+        else:
+            opcode = opcodes[binary]
+            illegal = opcode.code is None
+            mode = opcode.mode.name if opcode.mode is not None else ''
+            size = opcode.size
+
+        if illegal:
+            kind = NONE
+        elif mode == 'REL':
+            kind = REL
+        else:
+            kind = (NONE, BYTE, WORD)[size - 1]
+
+        table.append((opcode, size, kind))
+
+    return table
+
+DECODE_6502 = build_table()
+
+# buf[offset:end] holds the code at address start
+def disassemble(buf, start=0, offset=0, end=None, table=DECODE_6502):
+    if end is None or end > len(buf):
+        end = len(buf)
+
+    pos = offset
+    addr = start
+    while pos < end:
+        opcode, size, kind = table[buf[pos]]
+        if pos + size > end:
+            yield Instruction(addr, buf[pos:end], opcode, None)
+            return
+
+        data = buf[pos:pos+size]
+        if kind == BYTE:
+            oper = data[1]
+        elif kind == WORD:
+            oper = data[1] | (data[2] << 8)
+        elif kind == REL:
+            oper = (addr + 2 + toSigned(data[1])) & 0xffff
+        else:
+            oper = None
+
+        yield Instruction(addr, data, opcode, oper)
+        pos += size
+        addr += size
+
+def disassemble_file(filename, start=0, offset=0, length=None, table=DECODE_6502):
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            end = None if length is None else offset + length
+            yield from disassemble(data, start, offset, end, table)
+
+def format_instruction(ins, verbose=False):
+    opcode = ins.resolved
+    if opcode is None:
+        binary = ins.data[0]
+        mnemonic = MNEMONICS[binary]
+        size = SIZES[binary]
+        fmt = OPERAND_FORMATS[MODES[binary]]
+    else:
+        mnemonic = str(opcode.code) if opcode.code is not None else None
+        size = opcode.size
+        fmt = None
+
+    if mnemonic is None or (ins.oper is None and size > 1):
+        decoded = '???'
+    elif size > 1:
+        decoded = '%s %s' % (mnemonic, fmt % ins.oper if fmt is not None else \
+                                       opcode.mode.print_oper(ins.oper))
+    else:
+        decoded = mnemonic
+
+    if not verbose:
+        return decoded
+
+    addr_str = hexStr(ins.addr, size=4, prefix='$')
+    hex_str = ' '.join(hexStr(x) for x in ins.data)
+    return '%-8s %-10s %-12s' % (addr_str, hex_str, decoded)
+
+def print_header():
+    print('Address  Hexdump    Disassembly')
+    print('-------------------------------')
+
 def usage():
     out = 'python3 %s [Starting Hex Addr] [Byte String]\n' % sys.argv[0]
+    out += 'python3 %s [Starting Hex Addr] -f [Binary File] [-o Offset] [-n Length]\n' % sys.argv[0]
+    out += 'python3 %s -b    (one request per line of stdin, same arguments)\n' % sys.argv[0]
     out += 'Example: \n'
     out += 'python3 %s 0x600 "20 09 06 20 0c 06 20 12 06 a2 00 60 e8 e0 05 d0 fb 60 00"' % sys.argv[0]
     return out
 
 def main(argv):
+    if '-b' in argv:
+        run_batch(disassemble_request, argv[0])
+        return
+
     if len(argv) < 3 or argv[1] == '-h':
         print(usage())
-        return   
+        return
+
+    disassemble_request(argv)
 
+def disassemble_request(argv):
     verbose = False
     if '-v' in argv:
         verbose = True
         argv.remove('-v')
-        
+
+    filename = pop_option(argv, '-f')
+    offset = int(pop_option(argv, '-o', '0'), 0)
+    length = pop_option(argv, '-n')
     start_pc = int(argv[1], 16)
-    hex_str = argv[2]
 
-    disassemble(start_pc, hex_str, verbose)
+    if filename is not None:
+        records = disassemble_file(filename, start_pc, offset, \
+                                   None if length is None else int(length, 0))
+    else:
+        records = disassemble(bytes.fromhex(argv[2]), start_pc)
+
+    if verbose:
+        print_header()
+
+    for ins in records:
+        print(format_instruction(ins, verbose))
 
 if __name__ == '__main__':
     main(sys.argv)
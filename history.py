@@ -0,0 +1,224 @@
+from array import array
+from bisect import bisect_right
+from common import *
+from bus import PAGES
+
+"""
+Execution history for running backwards.
+
+Every write to a writable memory page is journaled as (address, old value)
+by a bus write watcher, in two parallel arrays:
+    addrs - array('H') of the addresses written
+    old   - array('B') of the bytes they held before
+Device and ROM pages are not journaled, their state is part of the
+checkpoints.
+
+A checkpoint is taken at the first instruction boundary after every
+interval instructions, and right after an interrupt is taken, and holds
+the registers, the clock, the pending clock events, the interrupt lines,
+the device state and the journal length. Events that came due after a
+checkpoint are pending again once it is restored. Checkpoint instruction indexes and journal lengths are
+kept in array('Q') so both can be bisected.
+
+Going back to instruction n undoes the journal down to the last checkpoint
+at or before n, restores it and replays forward to n, so the cost depends
+on how far back n is and on the interval, never on the length of the
+history. Replays do not cross an interrupt entry, there is a checkpoint
+after every one. Whatever ran after n is dropped.
+
+The history is bounded by a memory budget in bytes, once it is used up
+the older half of it is dropped.
+
+The Processor feeds the history from its run_debug loop, which it uses
+for every run while history is enabled. Traced runs are not recorded.
+"""
+
+DEFAULT_BUDGET = 16 << 20
+DEFAULT_INTERVAL = 10000
+# rough size of a checkpoint, counted against the budget
+CHECKPOINT_SIZE = 256
+
+class Checkpoint():
+    __slots__ = ('index', 'journal', 'regs', 'clock', 'events', 'lines', 'devices')
+
+    def __init__(self, index, journal, regs, clock, events, lines, devices):
+        self.index = index
+        self.journal = journal
+        self.regs = regs
+        self.clock = clock
+        self.events = events
+        self.lines = lines
+        self.devices = devices
+
+class History():
+    def __init__(self, proc, budget=DEFAULT_BUDGET, interval=DEFAULT_INTERVAL):
+        self.proc = proc
+        self.bus = proc.bus
+        self.budget = budget
+        self.interval = interval
+        self.views = self.bus.base_wpages
+        self.pages = [page for page in range(PAGES) if self.views[page] is not None]
+        for page in self.pages:
+            self.bus.watch_writes(page, self.record)
+
+        self.undoing = False
+        self.clear()
+
+    def close(self):
+        for page in self.pages:
+            self.bus.unwatch_writes(page, self.record)
+
+    # drops the whole history, the current state is the first checkpoint
+    def clear(self, index=0):
+        self.addrs = array('H')
+        self.old = array('B')
+        self.checkpoints = []
+        self.indexes = array('Q')
+        self.marks = array('Q')
+        # journal entries trimmed off the front
+        self.dropped = 0
+        self.count = index
+        self.checkpoint(index)
+
+    def record(self, addr, value):
+        if not self.undoing:
+            self.addrs.append(addr)
+            self.old.append(self.views[addr >> 8][addr & 0xff])
+
+    def size(self):
+        return len(self.addrs) * 3 + len(self.checkpoints) * CHECKPOINT_SIZE
+
+    # oldest instruction index the history reaches back to
+    def first(self):
+        return self.indexes[0]
+
+    def checkpoint(self, index):
+        proc = self.proc
+        cpu = proc.cpu
+        if self.checkpoints and self.indexes[-1] == index:
+            self.drop_last()
+
+        lines = (cpu.irq_lines, cpu.nmi_pending, cpu.reset_pending)
+        self.checkpoints.append(Checkpoint(index, len(self.addrs), cpu.regs(), proc.clk.counter, \
+                                           list(proc.clk.events), lines, proc.device_state()))
+        self.indexes.append(index)
+        self.marks.append(len(self.addrs))
+        self.next = index + self.interval
+
+        if self.size() > self.budget and len(self.checkpoints) > 1:
+            self.trim()
+
+    def drop_last(self):
+        self.checkpoints.pop()
+        self.indexes.pop()
+        self.marks.pop()
+
+    # drops the older half of the checkpoints and the journal before them
+    def trim(self):
+        keep = len(self.checkpoints) // 2
+        cut = self.marks[keep]
+        del self.addrs[:cut]
+        del self.old[:cut]
+        self.dropped += cut
+        del self.checkpoints[:keep]
+        del self.indexes[:keep]
+        for checkpoint in self.checkpoints:
+            checkpoint.journal -= cut
+        self.marks = array('Q', (checkpoint.journal for checkpoint in self.checkpoints))
+
+    # writes back old values down to journal length end, through the bus
+    # so the block cache and the snapshot tracker see them
+    def undo(self, end):
+        addrs = self.addrs
+        old = self.old
+        write = self.bus.write
+        self.undoing = True
+        try:
+            for pos in range(len(addrs) - 1, end - 1, -1):
+                write(addrs[pos], old[pos])
+        finally:
+            self.undoing = False
+
+        del addrs[end:]
+        del old[end:]
+
+    # back to the state before instruction index ran, returns the index
+    # reached, which is the oldest one kept if index lies before it
+    def seek(self, index):
+        index = max(index, self.first())
+        pos = bisect_right(self.indexes, index) - 1
+        checkpoint = self.checkpoints[pos]
+        self.undo(checkpoint.journal)
+        del self.checkpoints[pos + 1:]
+        del self.indexes[pos + 1:]
+        del self.marks[pos + 1:]
+
+        self.restore(checkpoint)
+        if index > checkpoint.index:
+            self.replay(index - checkpoint.index)
+
+        return index
+
+    def restore(self, checkpoint):
+        proc = self.proc
+        cpu = proc.cpu
+        cpu.set_regs(checkpoint.regs)
+        cpu.irq_lines, cpu.nmi_pending, cpu.reset_pending = checkpoint.lines
+        proc.clk.counter = checkpoint.clock
+        proc.set_device_state(checkpoint.devices)
+        proc.set_events(checkpoint.events)
+        self.count = checkpoint.index
+        self.next = checkpoint.index + self.interval
+
+    # runs count instructions without stopping at breakpoints
+    def replay(self, count):
+        proc = self.proc
+        brk_stops = proc.brk_stops
+        proc.brk_stops = False
+        proc.stopping = False
+        try:
+            proc.run_debug(count, -1, quiet=True)
+        finally:
+            proc.brk_stops = brk_stops
+
+    def step_back(self, count=1):
+        return self.count - self.seek(self.count - count)
+
+    # goes back to just before the last write to addr that is still in the
+    # history, returns False if there is none
+    def back_to_write(self, addr):
+        pos = self.find_write(addr)
+        if pos is None:
+            return False
+
+        # the write happened after the last checkpoint taken before it,
+        # replaying from there one instruction at a time finds it. The
+        # replay may trim the history, so positions are counted from the
+        # very first journal entry.
+        at = bisect_right(self.marks, pos) - 1
+        start = self.indexes[at]
+        end = self.indexes[at + 1] if at + 1 < len(self.indexes) else self.count
+        pos += self.dropped
+        self.seek(start)
+        while self.count < end and self.dropped + len(self.addrs) <= pos:
+            self.replay(1)
+
+        if self.dropped + len(self.addrs) > pos:
+            self.seek(self.count - 1)
+        return True
+
+    # journal position of the last write to addr, searched backwards one
+    # chunk at a time
+    def find_write(self, addr, chunk=4096):
+        addrs = self.addrs
+        end = len(addrs)
+        while end > 0:
+            start = max(end - chunk, 0)
+            part = addrs[start:end]
+            part.reverse()
+            try:
+                return end - 1 - part.index(addr)
+            except ValueError:
+                end = start
+
+        return None
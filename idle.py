@@ -0,0 +1,137 @@
+from common import *
+from opcodes import *
+
+"""
+Idle loop detection.
+
+A block that branches back to its own start is a loop. It can be skipped
+over when one pass through it writes no memory, takes the same cycles
+every time and carries no register or flag from one pass into the next,
+other than an X or Y counter:
+    poll loops     - nothing is carried, e.g. 'LDA $2002 / BPL', every
+                     pass after one that branched back is the same, until
+                     a clock event changes what is read
+    counter loops  - X or Y is stepped by one INX, DEX, INY or DEY and BNE
+                     tests it against 0 or a CPX/CPY immediate, e.g.
+                     'INX / CPX #$05 / BNE', the passes left are known
+The reads have to come from memory or from device pages the bus marks as
+plain (Bus.plain), whose values only change by a write or a clock event.
+Indirect and page crossing reads are not allowed, so a pass always costs
+the same cycles.
+
+Processor.run_blocks calls IdleLoop.skip after a pass that branched back.
+It adds the passes the loop would have run whole before the next clock
+event, the instruction budget or the loop exit to the clock at once. The
+last pass, the event and everything after them run as before, so the
+registers, flags and cycles come out the same as stepping through.
+"""
+
+# registers and flags read and written by the instructions loops may hold
+READS = {Op.LDA: '', Op.LDX: '', Op.LDY: '', Op.CMP: 'a', Op.CPX: 'x', Op.CPY: 'y', \
+         Op.BIT: 'a', Op.AND: 'a', Op.ORA: 'a', Op.EOR: 'a', Op.ADC: 'ac', Op.SBC: 'ac', \
+         Op.TAX: 'a', Op.TAY: 'a', Op.TXA: 'x', Op.TYA: 'y', Op.TSX: '', \
+         Op.INX: 'x', Op.DEX: 'x', Op.INY: 'y', Op.DEY: 'y', \
+         Op.ASL: 'a', Op.LSR: 'a', Op.ROL: 'ac', Op.ROR: 'ac', \
+         Op.CLC: '', Op.SEC: '', Op.CLV: '', Op.NOP: '', \
+         Op.BCC: 'c', Op.BCS: 'c', Op.BEQ: 'z', Op.BNE: 'z', Op.BMI: 'n', Op.BPL: 'n', \
+         Op.BVC: 'v', Op.BVS: 'v'}
+WRITES = {Op.LDA: 'anz', Op.LDX: 'xnz', Op.LDY: 'ynz', Op.CMP: 'nzc', Op.CPX: 'nzc', \
+          Op.CPY: 'nzc', Op.BIT: 'nvz', Op.AND: 'anz', Op.ORA: 'anz', Op.EOR: 'anz', \
+          Op.ADC: 'anzcv', Op.SBC: 'anzcv', Op.TAX: 'xnz', Op.TAY: 'ynz', Op.TXA: 'anz', \
+          Op.TYA: 'anz', Op.TSX: 'xnz', Op.INX: 'xnz', Op.DEX: 'xnz', Op.INY: 'ynz', \
+          Op.DEY: 'ynz', Op.ASL: 'anzc', Op.LSR: 'anzc', Op.ROL: 'anzc', Op.ROR: 'anzc', \
+          Op.CLC: 'c', Op.SEC: 'c', Op.CLV: 'v', Op.NOP: '', \
+          Op.BCC: '', Op.BCS: '', Op.BEQ: '', Op.BNE: '', Op.BMI: '', Op.BPL: '', \
+          Op.BVC: '', Op.BVS: ''}
+INDEX = {AddrMode.ZPX: 'x', AddrMode.ZPY: 'y'}
+MEMORY_MODES = (AddrMode.ZP, AddrMode.ZPX, AddrMode.ZPY, AddrMode.ABS)
+SHIFTS = (Op.ASL, Op.LSR, Op.ROL, Op.ROR)
+STEPS = {Op.INX: ('x', 1), Op.DEX: ('x', -1), Op.INY: ('y', 1), Op.DEY: ('y', -1)}
+COMPARES = {Op.CPX: 'x', Op.CPY: 'y'}
+
+class IdleLoop():
+    __slots__ = ('size', 'cycles', 'worst', 'reg', 'step', 'target')
+
+    def __init__(self, size, cycles, worst, reg=None, step=0, target=0):
+        self.size = size
+        self.cycles = cycles
+        self.worst = worst
+        self.reg = reg
+        self.step = step
+        self.target = target
+
+    # skips the passes after the current one that would run whole, returns
+    # the number of instructions skipped
+    def skip(self, cpu, clk, budget):
+        count = min((clk.deadline - self.worst - clk.counter) // self.cycles + 1, \
+                    (budget - 1) // self.size)
+        if self.reg is not None:
+            value = getattr(cpu, self.reg)
+            # the exit pass is left to run
+            count = min(count, (((self.target - value) * self.step) & 0xff) - 1)
+            if count > 0:
+                setattr(cpu, self.reg, (value + count * self.step) & 0xff)
+
+        if count <= 0:
+            return 0
+
+        clk.counter += count * self.cycles
+        return count * self.size
+
+    def __repr__(self):
+        if self.reg is None:
+            return '<IdleLoop poll %d cycles>' % self.cycles
+        return '<IdleLoop %s%+d until %s, %d cycles>' % (self.reg, self.step, \
+               hexStr(self.target, prefix='$'), self.cycles)
+
+# the IdleLoop of block, or None if it is not a loop that can be skipped
+def idle_loop(block, opcodes, bus):
+    ops = block.ops
+    binary, target, size, base = ops[-1]
+    if opcodes[binary].mode is not AddrMode.REL or target != block.start:
+        return None
+
+    carried = set()
+    written = set()
+    steps = []
+    z_setter = None
+    for binary, oper, size, base in ops:
+        opcode = opcodes[binary]
+        code = opcode.code
+        mode = opcode.mode
+        if code not in WRITES or opcode.page_cycles or (code in SHIFTS and mode is not AddrMode.A) \
+           or mode in (AddrMode.INDX, AddrMode.INDY):
+            return None
+        if mode in MEMORY_MODES and not bus.plain[oper >> 8 if mode is AddrMode.ABS else 0]:
+            return None
+
+        carried.update(reg for reg in READS[code] + INDEX.get(mode, '') if reg not in written)
+        writes = WRITES[code]
+        written.update(writes)
+        if code in STEPS:
+            steps.append(code)
+        if 'z' in writes:
+            z_setter = (code, mode, oper)
+
+    cycles = sum(op[3] for op in ops) + 1 + (((block.end ^ block.start) & 0xff00) != 0)
+    if not carried:
+        return IdleLoop(len(ops), cycles, block.cycles)
+
+    if len(carried) > 1 or len(steps) != 1 or opcodes[ops[-1][0]].code is not Op.BNE:
+        return None
+
+    reg, step = STEPS[steps[0]]
+    if carried != {reg} or sum(1 for binary, oper, size, base in ops \
+                               if reg in WRITES[opcodes[binary].code]) != 1:
+        return None
+
+    # BNE tests the zero flag of the step itself or of a later compare
+    code, mode, oper = z_setter
+    if code is steps[0]:
+        target = 0
+    elif COMPARES.get(code) == reg and mode is AddrMode.IMM:
+        target = bus.base_rpages[oper >> 8][oper & 0xff]
+    else:
+        return None
+
+    return IdleLoop(len(ops), cycles, block.cycles, reg, step, target)
@@ -0,0 +1,322 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import mmap
+from common import *
+
+"""
+Program loaders.
+
+Reads raw binaries, Intel HEX, Motorola S-records and hex text and writes
+them into a target, which is anything with load(blob, offset) (Bus, RAM)
+or a writable buffer (bytearray, memoryview) taking slice assignment.
+
+Consecutive records are joined into one run and each run is written with a
+single bulk copy. Record fields are decoded with bytes.fromhex, never one
+character pair at a time. Text formats are read line by line, raw files
+are memory-mapped.
+
+Formats:
+    raw   - the file bytes, loaded at the given address
+    ihex  - ':LLAAAATT<data>CC' records, types 00-05
+    srec  - 'S<type><count><address><data><checksum>', S0-S9
+    hex   - whitespace separated hex bytes, a line may start with an
+            'AAAA:' address the way RAM.to_str prints it. The indented
+            '00 01 02 ..' column header of RAM.to_str is skipped.
+
+The loaders return a LoadResult with the (start, end) ranges written and the
+entry point the file gives (ihex 03/05, srec S7-S9), or None.
+"""
+
+FORMATS = ('raw', 'ihex', 'srec', 'hex')
+HEX_TEXT = set('0123456789abcdefABCDEF: \t\r')
+
+class LoadError(Exception):
+    def __init__(self, lineno, message):
+        self.lineno = lineno
+        super().__init__('line %d: %s' % (lineno, message))
+
+class LoadResult():
+    __slots__ = ('ranges', 'entry')
+
+    def __init__(self, ranges, entry=None):
+        self.ranges = ranges
+        self.entry = entry
+
+    def size(self):
+        return sum(end - start for start, end in self.ranges)
+
+    def __repr__(self):
+        ranges = ' '.join('%s-%s' % (hexStr(start, size=4), hexStr(end - 1, size=4)) \
+                          for start, end in self.ranges)
+        entry = hexStr(self.entry, size=4, prefix='$') if self.entry is not None else None
+        return '<LoadResult %s entry:%s>' % (ranges, entry)
+
+# collects consecutive chunks into runs and writes each run in one go
+class Writer():
+    def __init__(self, target):
+        if hasattr(target, 'load'):
+            self.store = target.load
+        else:
+            self.store = self.assign
+            self.target = target
+            self.size = len(target)
+
+        self.ranges = []
+        self.start = None
+        self.end = None
+        self.chunks = []
+
+    def assign(self, blob, offset):
+        if offset + len(blob) > self.size:
+            raise IndexError('%d bytes at %s do not fit in %d bytes' % \
+                             (len(blob), hexStr(offset, size=4, prefix='$'), self.size))
+
+        self.target[offset:offset+len(blob)] = blob
+
+    def write(self, addr, data):
+        if addr != self.end:
+            self.flush()
+            self.start = self.end = addr
+
+        self.chunks.append(data)
+        self.end += len(data)
+
+    def flush(self):
+        if not self.chunks:
+            return
+
+        blob = self.chunks[0] if len(self.chunks) == 1 else b''.join(self.chunks)
+        self.store(blob, self.start)
+        self.chunks = []
+
+        if self.ranges and self.ranges[-1][1] == self.start:
+            self.ranges[-1] = (self.ranges[-1][0], self.end)
+        else:
+            self.ranges.append((self.start, self.end))
+
+    def result(self, entry=None):
+        self.flush()
+        return LoadResult(self.ranges, entry)
+
+def load_raw(target, data, addr=0):
+    writer = Writer(target)
+    writer.write(addr, data)
+    return writer.result()
+
+def load_ihex(target, lines):
+    writer = Writer(target)
+    base = 0
+    entry = None
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] != ':':
+            raise LoadError(lineno, 'record does not start with ":"')
+
+        try:
+            record = bytes.fromhex(line[1:])
+        except ValueError:
+            raise LoadError(lineno, 'bad hex digits')
+
+        count = record[0]
+        if len(record) != count + 5:
+            raise LoadError(lineno, 'record length %d does not match %d' % (len(record), count + 5))
+        if sum(record) & 0xff:
+            raise LoadError(lineno, 'bad checksum')
+
+        addr = (record[1] << 8) | record[2]
+        kind = record[3]
+        data = record[4:4+count]
+        if kind == 0x00:
+            writer.write(base + addr, data)
+        elif kind == 0x01:
+            break
+        elif kind == 0x02:
+            base = int.from_bytes(data, 'big') << 4
+        elif kind == 0x03:
+            entry = (int.from_bytes(data[:2], 'big') << 4) + int.from_bytes(data[2:], 'big')
+        elif kind == 0x04:
+            base = int.from_bytes(data, 'big') << 16
+        elif kind == 0x05:
+            entry = int.from_bytes(data, 'big')
+        else:
+            raise LoadError(lineno, 'unknown record type %s' % hexStr(kind))
+
+    return writer.result(entry)
+
+# address bytes of the S-record types
+SREC_ADDR = {'0': 2, '1': 2, '2': 3, '3': 4, '5': 2, '6': 3, '7': 4, '8': 3, '9': 2}
+
+def load_srec(target, lines):
+    writer = Writer(target)
+    entry = None
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] not in 'Ss' or line[1:2] not in SREC_ADDR:
+            raise LoadError(lineno, 'not an S-record')
+
+        try:
+            record = bytes.fromhex(line[2:])
+        except ValueError:
+            raise LoadError(lineno, 'bad hex digits')
+
+        if len(record) != record[0] + 1:
+            raise LoadError(lineno, 'record length %d does not match %d' % \
+                            (len(record), record[0] + 1))
+        if sum(record) & 0xff != 0xff:
+            raise LoadError(lineno, 'bad checksum')
+
+        kind = line[1]
+        size = SREC_ADDR[kind]
+        addr = int.from_bytes(record[1:1+size], 'big')
+        if kind in '123':
+            writer.write(addr, record[1+size:-1])
+        elif kind in '789':
+            entry = addr
+
+    return writer.result(entry)
+
+# the column header RAM.to_str prints before the data lines
+def is_column_header(line):
+    if not line[:1].isspace():
+        return False
+
+    try:
+        data = bytes.fromhex(line)
+    except ValueError:
+        return False
+    return len(data) > 1 and data == bytes(range(len(data)))
+
+def load_hex(target, lines, addr=0):
+    writer = Writer(target)
+    for lineno, line in enumerate(lines, 1):
+        line = line.split(';', 1)[0]
+        colon = line.find(':')
+        if colon < 0 and writer.start is None and is_column_header(line):
+            continue
+        if colon >= 0:
+            try:
+                addr = int(line[:colon], 16)
+            except ValueError:
+                raise LoadError(lineno, 'bad address %r' % line[:colon].strip())
+            line = line[colon+1:]
+
+        try:
+            data = bytes.fromhex(line)
+        except ValueError:
+            raise LoadError(lineno, 'bad hex digits')
+
+        if data:
+            writer.write(addr, data)
+            addr += len(data)
+
+    return writer.result()
+
+# guesses the format from the first bytes of a file
+def detect(head):
+    text = head.lstrip()
+    if text[:1] == b':':
+        return 'ihex'
+    if text[:1] in (b'S', b's') and text[1:2].isdigit():
+        return 'srec'
+
+    try:
+        text = text.decode('ascii')
+    except UnicodeDecodeError:
+        return 'raw'
+
+    body = ''.join(line.split(';', 1)[0] for line in text.splitlines())
+    if body.strip() and all(c in HEX_TEXT for c in body):
+        return 'hex'
+
+    return 'raw'
+
+def load_file(target, filename, fmt=None, addr=0):
+    with open(filename, 'rb') as f:
+        if fmt is None:
+            fmt = detect(f.read(256))
+            f.seek(0)
+
+        if fmt == 'raw':
+            if os.fstat(f.fileno()).st_size == 0:
+                return LoadResult([])
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                with memoryview(data) as view:
+                    return load_raw(target, view, addr)
+
+    with open(filename) as f:
+        return load_text(target, f, fmt, addr)
+
+def load_text(target, lines, fmt, addr=0):
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+
+    if fmt == 'ihex':
+        return load_ihex(target, lines)
+    if fmt == 'srec':
+        return load_srec(target, lines)
+    if fmt == 'hex':
+        return load_hex(target, lines, addr)
+
+    raise ValueError('unknown format %r, one of %s' % (fmt, ', '.join(FORMATS)))
+
+# writers for the text formats, used by the loaders micro benchmark in
+# benchsuite.py
+def to_ihex(data, addr=0, entry=None, width=32):
+    lines = []
+    base = None
+    for pos in range(0, len(data), width):
+        chunk = bytes(data[pos:pos+width])
+        start = addr + pos
+        if start >> 16 != base:
+            base = start >> 16
+            lines.append(ihex_record(0x04, 0, base.to_bytes(2, 'big')))
+        lines.append(ihex_record(0x00, start & 0xffff, chunk))
+
+    if entry is not None:
+        lines.append(ihex_record(0x05, 0, entry.to_bytes(4, 'big')))
+    lines.append(ihex_record(0x01, 0, b''))
+    return '\n'.join(lines) + '\n'
+
+def ihex_record(kind, addr, data):
+    record = bytes((len(data), addr >> 8, addr & 0xff, kind)) + data
+    return ':%s%02X' % (record.hex().upper(), -sum(record) & 0xff)
+
+def to_srec(data, addr=0, entry=None, width=32):
+    lines = []
+    for pos in range(0, len(data), width):
+        chunk = bytes(data[pos:pos+width])
+        lines.append(srec_record('3', (addr + pos).to_bytes(4, 'big'), chunk))
+
+    lines.append(srec_record('7', (entry or 0).to_bytes(4, 'big'), b''))
+    return '\n'.join(lines) + '\n'
+
+def srec_record(kind, addr, data):
+    record = bytes((len(addr) + len(data) + 1,)) + addr + data
+    return 'S%s%s%02X' % (kind, record.hex().upper(), ~sum(record) & 0xff)
+
+def to_hex(data, addr=0, width=16):
+    return ''.join('%s: %s\n' % (hexStr(addr + pos, size=4), bytes(data[pos:pos+width]).hex(' ')) \
+                   for pos in range(0, len(data), width))
+
+def usage():
+    return 'python3 %s [File] [-f raw|ihex|srec|hex] [-a Load Hex Addr]' % sys.argv[0]
+
+def main(argv):
+    if len(argv) < 2 or argv[1] == '-h':
+        print(usage())
+        return
+
+    fmt = pop_option(argv, '-f')
+    addr = int(pop_option(argv, '-a', '0'), 16)
+
+    memory = bytearray(0x10000)
+    print(load_file(memory, argv[1], fmt, addr))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,120 @@
+"""
+Flat 6502 opcode tables, indexed by opcode.
+
+Generated by 'python3 opcodes.py' from the definitions in opcodes.py,
+do not edit. See opcodes.py for what the tables hold.
+"""
+
+MODE_NAMES = (
+    '', 'A', 'IMM', 'REL', 'ZP', 'ZPX', 'ZPY', 'ABS', 'ABSX', 'ABSY', 'IND', 'INDX', 'INDY',
+)
+OPERAND_FORMATS = (
+    '', 'A', '#$%02x', '$%04x', '$%02x', '$%02x,X', '$%02x,Y',
+    '$%04x', '$%04x,X', '$%04x,Y', '($%04x)', '($%02x,X)', '($%02x),Y',
+)
+MNEMONICS = (
+    'BRK', 'ORA', None, None, None, 'ORA', 'ASL', None,
+    'PHP', 'ORA', 'ASL', None, None, 'ORA', 'ASL', None,
+    'BPL', 'ORA', None, None, None, 'ORA', 'ASL', None,
+    'CLC', 'ORA', None, None, None, 'ORA', 'ASL', None,
+    'JSR', 'AND', None, None, 'BIT', 'AND', 'ROL', None,
+    'PLP', 'AND', 'ROL', None, 'BIT', 'AND', 'ROL', None,
+    'BMI', 'AND', None, None, None, 'AND', 'ROL', None,
+    'SEC', 'AND', None, None, None, 'AND', 'ROL', None,
+    'RTI', 'EOR', None, None, None, 'EOR', 'LSR', None,
+    'PHA', 'EOR', 'LSR', None, 'JMP', 'EOR', 'LSR', None,
+    'BVC', 'EOR', None, None, None, 'EOR', 'LSR', None,
+    'CLI', 'EOR', None, None, None, 'EOR', 'LSR', None,
+    'RTS', 'ADC', None, None, None, 'ADC', 'ROR', None,
+    'PLA', 'ADC', 'ROR', None, 'JMP', 'ADC', 'ROR', None,
+    'BVS', 'ADC', None, None, None, 'ADC', 'ROR', None,
+    'SEI', 'ADC', None, None, None, 'ADC', 'ROR', None,
+    None, 'STA', None, None, 'STY', 'STA', 'STX', None,
+    'DEY', None, 'TXA', None, 'STY', 'STA', 'STX', None,
+    'BCC', 'STA', None, None, 'STY', 'STA', 'STX', None,
+    'TYA', 'STA', 'TXS', None, None, 'STA', None, None,
+    'LDY', 'LDA', 'LDX', None, 'LDY', 'LDA', 'LDX', None,
+    'TAY', 'LDA', 'TAX', None, 'LDY', 'LDA', 'LDX', None,
+    'BCS', 'LDA', None, None, 'LDY', 'LDA', 'LDX', None,
+    'CLV', 'LDA', 'TSX', None, 'LDY', 'LDA', 'LDX', None,
+    'CPY', 'CMP', None, None, 'CPY', 'CMP', 'DEC', None,
+    'INY', 'CMP', 'DEX', None, 'CPY', 'CMP', 'DEC', None,
+    'BNE', 'CMP', None, None, None, 'CMP', 'DEC', None,
+    'CLD', 'CMP', None, None, None, 'CMP', 'DEC', None,
+    'CPX', 'SBC', None, None, 'CPX', 'SBC', 'INC', None,
+    'INX', 'SBC', 'NOP', None, 'CPX', 'SBC', 'INC', None,
+    'BEQ', 'SBC', None, None, None, 'SBC', 'INC', None,
+    'SED', 'SBC', None, None, None, 'SBC', 'INC', None,
+)
+MODES = (
+    b'\x00\x0b\x00\x00\x00\x04\x04\x00\x00\x02\x01\x00\x00\x07\x07\x00'
+    b'\x03\x0c\x00\x00\x00\x05\x05\x00\x00\t\x00\x00\x00\x08\x08\x00'
+    b'\x07\x0b\x00\x00\x04\x04\x04\x00\x00\x02\x01\x00\x07\x07\x07\x00'
+    b'\x03\x0c\x00\x00\x00\x05\x05\x00\x00\t\x00\x00\x00\x08\x08\x00'
+    b'\x00\x0b\x00\x00\x00\x04\x04\x00\x00\x02\x01\x00\x07\x07\x07\x00'
+    b'\x03\x0c\x00\x00\x00\x05\x05\x00\x00\t\x00\x00\x00\x08\x08\x00'
+    b'\x00\x0b\x00\x00\x00\x04\x04\x00\x00\x02\x01\x00\n\x07\x07\x00'
+    b'\x03\x0c\x00\x00\x00\x05\x05\x00\x00\t\x00\x00\x00\x08\x08\x00'
+    b'\x00\x0b\x00\x00\x04\x04\x04\x00\x00\x00\x00\x00\x07\x07\x07\x00'
+    b'\x03\x0c\x00\x00\x05\x05\x06\x00\x00\t\x00\x00\x00\x08\x00\x00'
+    b'\x02\x0b\x02\x00\x04\x04\x04\x00\x00\x02\x00\x00\x07\x07\x07\x00'
+    b'\x03\x0c\x00\x00\x05\x05\x06\x00\x00\t\x00\x00\x08\x08\t\x00'
+    b'\x02\x0b\x00\x00\x04\x04\x04\x00\x00\x02\x00\x00\x07\x07\x07\x00'
+    b'\x03\x0c\x00\x00\x00\x05\x05\x00\x00\t\x00\x00\x00\x08\x08\x00'
+    b'\x02\x0b\x00\x00\x04\x04\x04\x00\x00\x02\x00\x00\x07\x07\x07\x00'
+    b'\x03\x0c\x00\x00\x00\x05\x05\x00\x00\t\x00\x00\x00\x08\x08\x00'
+)
+SIZES = (
+    b'\x01\x02\x01\x01\x01\x02\x02\x01\x01\x02\x01\x01\x01\x03\x03\x01'
+    b'\x02\x02\x01\x01\x01\x02\x02\x01\x01\x03\x01\x01\x01\x03\x03\x01'
+    b'\x03\x02\x01\x01\x02\x02\x02\x01\x01\x02\x01\x01\x03\x03\x03\x01'
+    b'\x02\x02\x01\x01\x01\x02\x02\x01\x01\x03\x01\x01\x01\x03\x03\x01'
+    b'\x01\x02\x01\x01\x01\x02\x02\x01\x01\x02\x01\x01\x03\x03\x03\x01'
+    b'\x02\x02\x01\x01\x01\x02\x02\x01\x01\x03\x01\x01\x01\x03\x03\x01'
+    b'\x01\x02\x01\x01\x01\x02\x02\x01\x01\x02\x01\x01\x03\x03\x03\x01'
+    b'\x02\x02\x01\x01\x01\x02\x02\x01\x01\x03\x01\x01\x01\x03\x03\x01'
+    b'\x01\x02\x01\x01\x02\x02\x02\x01\x01\x01\x01\x01\x03\x03\x03\x01'
+    b'\x02\x02\x01\x01\x02\x02\x02\x01\x01\x03\x01\x01\x01\x03\x01\x01'
+    b'\x02\x02\x02\x01\x02\x02\x02\x01\x01\x02\x01\x01\x03\x03\x03\x01'
+    b'\x02\x02\x01\x01\x02\x02\x02\x01\x01\x03\x01\x01\x03\x03\x03\x01'
+    b'\x02\x02\x01\x01\x02\x02\x02\x01\x01\x02\x01\x01\x03\x03\x03\x01'
+    b'\x02\x02\x01\x01\x01\x02\x02\x01\x01\x03\x01\x01\x01\x03\x03\x01'
+    b'\x02\x02\x01\x01\x02\x02\x02\x01\x01\x02\x01\x01\x03\x03\x03\x01'
+    b'\x02\x02\x01\x01\x01\x02\x02\x01\x01\x03\x01\x01\x01\x03\x03\x01'
+)
+CYCLES = (
+    b'\x07\x06\x02\x02\x02\x03\x05\x02\x03\x02\x02\x02\x02\x04\x06\x02'
+    b'\x02\x05\x02\x02\x02\x04\x06\x02\x02\x04\x02\x02\x02\x04\x07\x02'
+    b'\x06\x06\x02\x02\x03\x03\x05\x02\x04\x02\x02\x02\x04\x04\x06\x02'
+    b'\x02\x05\x02\x02\x02\x04\x06\x02\x02\x04\x02\x02\x02\x04\x07\x02'
+    b'\x06\x06\x02\x02\x02\x03\x05\x02\x03\x02\x02\x02\x03\x04\x06\x02'
+    b'\x02\x05\x02\x02\x02\x04\x06\x02\x02\x04\x02\x02\x02\x04\x07\x02'
+    b'\x06\x06\x02\x02\x02\x03\x05\x02\x04\x02\x02\x02\x05\x04\x06\x02'
+    b'\x02\x05\x02\x02\x02\x04\x06\x02\x02\x04\x02\x02\x02\x04\x07\x02'
+    b'\x02\x06\x02\x02\x03\x03\x03\x02\x02\x02\x02\x02\x04\x04\x04\x02'
+    b'\x02\x06\x02\x02\x04\x04\x04\x02\x02\x05\x02\x02\x02\x05\x02\x02'
+    b'\x02\x06\x02\x02\x03\x03\x03\x02\x02\x02\x02\x02\x04\x04\x04\x02'
+    b'\x02\x05\x02\x02\x04\x04\x04\x02\x02\x04\x02\x02\x04\x04\x04\x02'
+    b'\x02\x06\x02\x02\x03\x03\x05\x02\x02\x02\x02\x02\x04\x04\x06\x02'
+    b'\x02\x05\x02\x02\x02\x04\x06\x02\x02\x04\x02\x02\x02\x04\x07\x02'
+    b'\x02\x06\x02\x02\x03\x03\x05\x02\x02\x02\x02\x02\x04\x04\x06\x02'
+    b'\x02\x05\x02\x02\x02\x04\x06\x02\x02\x04\x02\x02\x02\x04\x07\x02'
+)
+PAGE_CYCLES = (
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x01\x01\x01\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00'
+    b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+    b'\x00\x01\x00\x00\x00\x00\x00\x00\x00\x01\x00\x00\x00\x01\x00\x00'
+)
@@ -2,8 +2,16 @@
 
 import sys
 from common import *
+from opcodes import *
 from cpu import *
 from ram import *
+from bus import *
+from blockcache import *
+from tracedump import format_records
+from disassembler import disassemble, format_instruction, print_header
+from snapshot import *
+from rom import ROM, create_mapper
+from history import History, DEFAULT_BUDGET, DEFAULT_INTERVAL
 
 """
 memory map:
@@ -16,53 +24,558 @@ memory map:
     6000 - 7FFF: cartridge WRAM
     8000 - FFFF: main area cartridge ROM is mapped to
 
+FFFA - NMI vector
 FFFC - reset vector
+FFFE - IRQ/BRK vector
 """
 
+# breakpoint bitmap of a debug loop run without a debugger
+NO_BREAKS = bytes(0x10000)
+
+class StopReason(NoValue):
+    BRK = 'BRK executed'
+    PC = 'Reached the stop address'
+    CYCLES = 'Cycle budget used up'
+    INSTRUCTIONS = 'Instruction budget used up'
+    ILLEGAL = 'Illegal opcode'
+    BREAK = 'Breakpoint hit'
+    WATCH = 'Watchpoint hit'
+
 class Processor():
 
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, recompile=False, hot_count=32, profile=False):
         self.opcodes = OPCODES_6502
         self.clk = Clock(0)
         self.ram = RAM()
-        self.cpu = CPU(self.clk, self.ram, self.opcodes, self.clk)
+        self.wram = RAM(0x2000)
+        self.prg = RAM(0x8000)
+        self.ppu_regs = Registers(0x2000, 8)
+        self.io_regs = Registers(0x4000, 0x20, mirror=False)
+        self.bus = self.build_bus()
+        for mem, base in ((self.ram, 0x0000), (self.wram, 0x6000), (self.prg, 0x8000)):
+            mem.attach(self.bus, base)
+        self.cpu = CPU(self.clk, self.bus, self.opcodes)
+        self.blocks = BlockCache(self.bus, self.opcodes)
+        self.bus.remap_listeners.append(self.blocks.unmap)
+        self.rom = None
+        self.mapper = None
+        self.recompiler = None
+        if recompile:
+            # the recompiler, profiler and debugger are imported on first
+            # use, a plain run does not pay for them at startup
+            from recompiler import Recompiler
+            self.recompiler = Recompiler(self.cpu, self.blocks, hot_count)
         self.cpu.config(pc=0, status=0x20, a=0, x=0, y=0, sp=0xFF, verbose=verbose)
         self.verbose = verbose
+        self.tracker = None
+        self.power_on = None
+        self.stopping = False
+        # the IllegalOpcode that stopped the last run, with its address
+        self.illegal = None
+        # BRK ends a run, firmware using it as a software interrupt clears this
+        self.brk_stops = True
+        # idle loops are skipped over up to the next clock event
+        self.fast_forward = True
+        self.profiler = None
+        self.debugger = None
+        self.history = None
+        if profile:
+            self.attach_profiler()
+
+    def build_bus(self):
+        bus = Bus()
+        bus.map_memory(0x0000, 0x1FFF, self.ram.data)
+        bus.map_device(0x2000, 0x3FFF, self.ppu_regs.read, self.ppu_regs.write, plain=True)
+        bus.map_device(0x4000, 0x40FF, self.io_regs.read, self.io_regs.write, plain=True)
+        bus.map_memory(0x6000, 0x7FFF, self.wram.data)
+        bus.map_memory(0x8000, 0xFFFF, self.prg.data, writable=False)
+        return bus
+
+    # maps the cartridge PRG ROM at $8000-$FFFF through its mapper and
+    # starts at the reset vector
+    def load_rom(self, rom):
+        if isinstance(rom, str):
+            rom = ROM(rom)
+
+        self.rom = rom
+        self.mapper = create_mapper(rom, self.bus)
+        self.tracker = None
+        self.power_on = None
+        self.cpu.config(pc=self.bus.read_word(0xfffc))
+        return self.mapper
+
+    # the page tracker, made on first use
+    def track(self):
+        if self.tracker is None:
+            self.tracker = PageTracker(self.bus)
+        return self.tracker
+
+    def snapshot(self):
+        tracker = self.track()
+        snapshot = Snapshot(self.cpu.regs(), self.clk.counter, tracker.capture(), \
+                            self.device_state())
+        tracker.sync(snapshot)
+
+        return snapshot
+
+    def restore(self, snapshot):
+        self.track().restore(snapshot, self.blocks.rewrite)
+        self.cpu.set_regs(snapshot.regs)
+        self.clk.counter = snapshot.clock
+        self.set_events()
+        self.set_device_state(snapshot.devices)
+        if self.history is not None:
+            self.history.clear()
+
+    # replaces the pending clock events when the clock is moved, events
+    # scheduled from the abandoned future are dropped. Cancelled events and
+    # interrupt service are left out, interrupts still pending are serviced
+    # again.
+    def set_events(self, events=()):
+        cpu = self.cpu
+        self.clk.set_events(event for event in events \
+                            if event[2] is not None and event[2] != cpu.service)
+        cpu.service_event = None
+        if cpu.nmi_pending or cpu.reset_pending:
+            cpu.request_service()
+        cpu.check_irq()
+
+    def device_state(self):
+        mapper = self.mapper.state() if self.mapper is not None else None
+        return (bytes(self.ppu_regs.data), bytes(self.io_regs.data), mapper)
+
+    def set_device_state(self, devices):
+        ppu, io, mapper = devices
+        self.ppu_regs.data[:], self.io_regs.data[:] = ppu, io
+        if mapper is not None:
+            self.mapper.set_state(mapper)
+
+    # back to the power-on state. A cartridge area is kept, without a
+    # mapper $8000-$FFFF is zeroed like the rest of memory.
+    def reset(self):
+        cpu = self.cpu
+        cpu.irq_lines = 0
+        cpu.nmi_pending = cpu.reset_pending = False
+        prg = self.prg.data
+        if self.mapper is None and prg.count(0) != len(prg):
+            self.prg.load(bytes(len(prg)), 0)
+        if self.power_on is not None:
+            self.restore(self.power_on)
+            return
+
+        self.blocks.flush()
+        for mem in (self.ram, self.wram, self.ppu_regs, self.io_regs):
+            mem.data[:] = bytes(len(mem.data))
+        if self.tracker is not None:
+            self.tracker.mark_all()
+        if self.mapper is not None:
+            self.mapper.reset()
+        self.clk.counter = 0
+        self.set_events()
+        pc = self.bus.read_word(0xfffc) if self.mapper is not None else 0
+        cpu.config(pc=pc, status=0x20, a=0, x=0, y=0, sp=0xFF)
+        self.power_on = self.snapshot()
+        if self.history is not None:
+            self.history.clear()
+
+    # runs go through run_profiled while a profiler is attached
+    def attach_profiler(self, profiler=None):
+        if profiler is None:
+            from profiler import Profiler
+            profiler = Profiler(self.opcodes)
+        profiler.start(self.cpu.pc, self.clk.counter)
+        self.profiler = profiler
+        return profiler
+
+    def detach_profiler(self):
+        profiler = self.profiler
+        self.profiler = None
+        return profiler
+
+    # runs go through run_debug while the debugger has something set
+    def attach_debugger(self):
+        if self.debugger is None:
+            from debugger import Debugger
+            self.debugger = Debugger(self.cpu, self.bus)
+        return self.debugger
+
+    def detach_debugger(self):
+        debugger = self.debugger
+        if debugger is not None:
+            debugger.clear()
+        self.debugger = None
+        return debugger
+
+    # journals every run from here on so it can be stepped back through,
+    # see History.step_back and History.back_to_write
+    def enable_history(self, budget=DEFAULT_BUDGET, interval=DEFAULT_INTERVAL):
+        if self.history is None:
+            self.history = History(self, budget, interval)
+        return self.history
+
+    def disable_history(self):
+        history = self.history
+        if history is not None:
+            history.close()
+        self.history = None
+        return history
 
     def set_verbose(self, verbose):
         self.verbose = verbose
         self.cpu.config(verbose=verbose)
         
     def disassemble(self, size=None):
+        start = self.cpu.pc
         if size is None:
             end = self.ram.size
         else:
-            end = self.cpu.pc + size
+            end = min(start + int(size), 0x10000)
 
         if self.verbose:
-            print('Address  Hexdump    Disassembly')
-            print('-------------------------------')
-            
-        while self.cpu.pc < end:
-            print(self.cpu.decode_next())
+            print_header()
+
+        for ins in disassemble(self.bus[start:end], start):
+            print(format_instruction(ins, self.verbose))
+            self.cpu.pc = ins.addr + ins.size
 
     def execute(self):
-        while (self.cpu.execute() != Op.BRK):
-            continue
-        
-def main():
+        return self.run()
+
+    # runs until BRK or until one of the limits is hit, returns the stop
+    # reason and the number of cycles used. Due clock events, interrupts
+    # among them, run before each instruction. The cycle budget is a clock
+    # event too, so the run stops after the instruction that reaches it.
+    # An illegal opcode stops the run with pc past the opcode byte, its
+    # address is in self.illegal.addr.
+    def run(self, max_cycles=None, max_instructions=None, until_pc=None):
+        clk = self.clk
+        start = clk.counter
+        budget = max_instructions if max_instructions is not None else NEVER
+        stop = until_pc if until_pc is not None else -1
+
+        self.stopping = False
+        self.illegal = None
+        event = None
+        if max_cycles is not None:
+            event = clk.schedule(start + max_cycles, self.stop_run)
+
+        try:
+            if self.verbose:
+                reason = self.run_traced(budget, stop)
+            elif self.history is not None or \
+                 (self.debugger is not None and self.debugger.active()):
+                reason = self.run_debug(budget, stop)
+            elif self.profiler is not None:
+                reason = self.run_profiled(budget, stop)
+            else:
+                reason = self.run_blocks(budget, stop)
+        except IllegalOpcode as e:
+            self.illegal = e
+            reason = StopReason.ILLEGAL
+        finally:
+            if event is not None:
+                clk.cancel(event)
+
+        return reason, clk.counter - start
+
+    def stop_run(self, cycle):
+        self.stopping = True
+
+    # whole blocks run only when their worst case ends before the next clock
+    # event, otherwise the CPU single steps up to it. Idle loops are skipped
+    # up to the last pass that would run whole.
+    def run_blocks(self, budget, stop):
+        cpu = self.cpu
+        clk = self.clk
+        dispatch = cpu.dispatch
+        decoders = cpu.decoders
+        cycles = cpu.cycles
+        blocks = self.blocks
+        recompiler = self.recompiler
+        while True:
+            if clk.counter >= clk.deadline:
+                clk.run_events()
+                if self.stopping:
+                    return StopReason.CYCLES
+
+            block = blocks.get(cpu.pc)
+            if block is None or len(block.ops) > budget or block.start < stop < block.end or \
+               clk.counter + block.cycles > clk.deadline:
+                binary = cpu.read_next()
+                clk.counter += cycles[binary]
+                dispatch[binary](decoders[binary]())
+                budget -= 1
+            else:
+                ops = block.ops
+                budget -= len(ops)
+
+                func = block.func
+                if func is None and recompiler is not None:
+                    func = recompiler.promote(block)
+
+                if func is not None:
+                    binary = func(cpu, ops)
+                else:
+                    for binary, oper, size, base in ops:
+                        cpu.pc += size
+                        clk.counter += base
+                        dispatch[binary](oper)
+
+                if block.idle is not None and cpu.pc == block.start != stop and self.fast_forward:
+                    budget -= block.idle.skip(cpu, clk, budget)
+
+            if binary == 0x00 and self.brk_stops:
+                return StopReason.BRK
+            if cpu.pc == stop:
+                return StopReason.PC
+            if budget <= 0:
+                return StopReason.INSTRUCTIONS
+
+    # run_blocks with every instruction counted into the profiler. Blocks
+    # without page crossing reads are counted once per run and spread over
+    # their instructions by Profiler.flush, the others per instruction.
+    def run_profiled(self, budget, stop):
+        cpu = self.cpu
+        clk = self.clk
+        dispatch = cpu.dispatch
+        decoders = cpu.decoders
+        cycles = cpu.cycles
+        blocks = self.blocks
+        profile = self.profiler
+        counts = profile.counts
+        pc_cycles = profile.cycles
+        op_counts = profile.op_counts
+        op_cycles = profile.op_cycles
+        tracked = profile.tracked
+        if not profile.instructions:
+            profile.start(cpu.pc, clk.counter)
+
+        while True:
+            if clk.counter >= clk.deadline:
+                pc, sp, before = cpu.pc, cpu.sp, clk.counter
+                clk.run_events()
+                if cpu.pc != pc:
+                    profile.interrupt(cpu.pc, pc, sp, before, clk.counter)
+                if self.stopping:
+                    return StopReason.CYCLES
+
+            first = pc = cpu.pc
+            start = clk.counter
+            block = blocks.get(pc)
+            if block is None or len(block.ops) > budget or block.start < stop < block.end or \
+               clk.counter + block.cycles > clk.deadline:
+                binary = cpu.read_next()
+                clk.counter += cycles[binary]
+                dispatch[binary](decoders[binary]())
+                spent = clk.counter - start
+                counts[pc] += 1
+                pc_cycles[pc] += spent
+                op_counts[binary] += 1
+                op_cycles[binary] += spent
+                pc += self.opcodes[binary].size
+                count = 1
+            else:
+                ops = block.ops
+                count = len(ops)
+                stats = tracked.get(block)
+                if stats is None:
+                    stats = profile.track(block)
+
+                if stats.exact:
+                    # every instruction takes its base cycles, only the
+                    # closing branch can add more
+                    for binary, oper, size, base in ops:
+                        cpu.pc += size
+                        clk.counter += base
+                        dispatch[binary](oper)
+
+                    if ops:
+                        stats.runs += 1
+                        stats.cycles += clk.counter - start
+                        pc = block.end
+                    else:
+                        pc = cpu.pc
+                        count = profile.partial(stats, pc)
+                else:
+                    for binary, oper, size, base in ops:
+                        before = clk.counter
+                        cpu.pc = pc + size
+                        clk.counter = before + base
+                        dispatch[binary](oper)
+                        spent = clk.counter - before
+                        counts[pc] += 1
+                        pc_cycles[pc] += spent
+                        op_counts[binary] += 1
+                        op_cycles[binary] += spent
+                        pc += size
+
+            budget -= count
+            profile.after(first, pc, binary, clk.counter - start, count, cpu)
+
+            if binary == 0x00 and self.brk_stops:
+                return StopReason.BRK
+            if cpu.pc == stop:
+                return StopReason.PC
+            if budget <= 0:
+                return StopReason.INSTRUCTIONS
+
+    # run_blocks stopping at breakpoints and after the instruction a
+    # watchpoint triggered on. A block only runs whole without a breakpoint
+    # past its first instruction, the breakpoint a run starts on is passed.
+    # It counts instructions and takes the history checkpoints, quiet runs
+    # ignore the debugger.
+    def run_debug(self, budget, stop, quiet=False):
+        cpu = self.cpu
+        clk = self.clk
+        dispatch = cpu.dispatch
+        decoders = cpu.decoders
+        cycles = cpu.cycles
+        blocks = self.blocks
+        debugger = self.debugger
+        if quiet or debugger is None or not debugger.active():
+            breaks, hits, immediate = NO_BREAKS, [], None
+        else:
+            breaks, hits, immediate = debugger.breaks, debugger.hits, debugger.immediate
+            del hits[:]
+        resume = cpu.pc
+
+        # the instruction index is first - budget
+        history = self.history
+        first = history.count + budget if history is not None else 0
+        try:
+            while True:
+                if clk.counter >= clk.deadline:
+                    pc = cpu.pc
+                    clk.run_events()
+                    # replays never cross an interrupt entry
+                    if history is not None and cpu.pc != pc:
+                        history.checkpoint(first - budget)
+                    if self.stopping:
+                        return StopReason.CYCLES
+                if history is not None and first - budget >= history.next:
+                    history.checkpoint(first - budget)
+
+                pc = cpu.pc
+                if breaks[pc] and pc != resume and debugger.check(pc):
+                    return StopReason.BREAK
+                resume = -1
+
+                block = blocks.get(pc)
+                if block is None or len(block.ops) > budget or block.start < stop < block.end or \
+                   clk.counter + block.cycles > clk.deadline or breaks.find(1, pc + 1, block.end) >= 0:
+                    if immediate is None:
+                        binary = cpu.read_next()
+                        clk.counter += cycles[binary]
+                        dispatch[binary](decoders[binary]())
+                    else:
+                        # fetches do not trigger read watchpoints
+                        debugger.fetching = True
+                        binary = cpu.read_next()
+                        clk.counter += cycles[binary]
+                        oper = decoders[binary]()
+                        debugger.fetching = immediate[binary]
+                        dispatch[binary](oper)
+                        debugger.fetching = False
+                    budget -= 1
+                else:
+                    for binary, oper, size, base in block.ops:
+                        cpu.pc += size
+                        clk.counter += base
+                        if immediate is not None:
+                            debugger.fetching = immediate[binary]
+                        dispatch[binary](oper)
+                        budget -= 1
+                        if hits:
+                            break
+                        pc += size
+                    if immediate is not None:
+                        debugger.fetching = False
+
+                if hits:
+                    debugger.stopped(pc)
+                    return StopReason.WATCH
+                if binary == 0x00 and self.brk_stops:
+                    return StopReason.BRK
+                if cpu.pc == stop:
+                    return StopReason.PC
+                if budget <= 0:
+                    return StopReason.INSTRUCTIONS
+        finally:
+            if immediate is not None:
+                debugger.fetching = False
+            if history is not None:
+                history.count = first - budget
+
+    def run_traced(self, budget, stop):
+        cpu = self.cpu
+        clk = self.clk
+        while True:
+            if clk.counter >= clk.deadline:
+                clk.run_events()
+                if self.stopping:
+                    return StopReason.CYCLES
+
+            code = cpu.execute()
+            budget -= 1
+
+            if code == Op.BRK and self.brk_stops:
+                return StopReason.BRK
+            if cpu.pc == stop:
+                return StopReason.PC
+            if budget <= 0:
+                return StopReason.INSTRUCTIONS
+
+def usage():
+    out = 'python3 %s [Starting Hex Addr] [Byte String] [-n Max Cycles] [-v]\n' % sys.argv[0]
+    out += 'python3 %s -b    (one request per line of stdin, same arguments)\n' % sys.argv[0]
+    out += 'Without arguments it runs a single ADC $20.'
+    return out
+
+def main(argv):
+    if '-h' in argv:
+        print(usage())
+        return
+
+    if '-b' in argv:
+        run_batch(run_request, argv[0])
+        return
+
+    if len(argv) < 3:
+        demo('-v' in argv)
+        return
+
+    run_request(argv)
+
+def demo(verbose):
+    proc = Processor(verbose=verbose)
+    proc.bus.load_str('65 20')
+    proc.bus.load_str('ff', 0x20)
+    proc.execute()
+
+    if verbose:
+        for line in format_records(proc.cpu.trace.records()):
+            print(line)
+
+# runs the program in a new Processor and prints why and where it stopped
+def run_request(argv):
     verbose = False
-    if '-v' in sys.argv:
+    if '-v' in argv:
         verbose = True
-        sys.argv.remove('-v')
-        
+        argv.remove('-v')
+
+    max_cycles = int(pop_option(argv, '-n', '1000000'), 0)
+    addr = int(argv[1], 16)
     proc = Processor(verbose=verbose)
-    proc.ram.load_str('65 20')
-    proc.ram.load_str('ff', 0x20)
-    #print(proc.ram.to_str(0x0, 0x40))
-    #print(proc.cpu.reg_to_str())
-    proc.execute()
+    proc.bus.load_str(argv[2], addr)
+    proc.cpu.config(pc=addr)
+    reason, cycles = proc.run(max_cycles=max_cycles)
+
+    if verbose:
+        for line in format_records(proc.cpu.trace.records()):
+            print(line)
+    if proc.illegal is not None:
+        reason = proc.illegal
+    print('%s after %d cycles  %s' % (reason, cycles, proc.cpu.reg_to_str()))
 
 if __name__ == '__main__':
-    main()
-        
+    main(sys.argv)
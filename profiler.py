@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+
+import sys
+from array import array
+from common import *
+from opcodes import *
+
+"""
+Guest code profiler.
+
+Counters are preallocated array('Q') tables:
+    counts, cycles        - executions and cycles per PC
+    op_counts, op_cycles  - the same per opcode byte
+Per Op and per AddrMode totals are folded from the opcode tables when a
+report asks for them.
+
+Call stacks follow JSR and interrupt entries and are unwound by RTS and
+RTI. A frame is popped once the stack pointer is back above the one it was
+pushed at, so code that drops return addresses or jumps out of a routine
+does not leave the stack growing. Cycles are charged to the stack a block
+ran on, which gives the folded stacks, and every returning frame adds its
+inclusive cost to its call edge, which gives the callgrind call graph.
+
+The profiler is fed by Processor.run_profiled, an instrumented copy of the
+block loop the Processor switches to while a profiler is attached. Without
+one the run loops are unchanged. Compiled blocks are not used while
+profiling. Blocks whose instructions always take their base cycles are
+only counted per run and spread over the tables by flush(). The reports
+flush first, code reading the tables directly calls it itself.
+
+Reports:
+    flat()            - text table of the hottest addresses and opcodes
+    callgrind(f)      - callgrind format for KCachegrind / QCachegrind
+    folded_stacks()   - 'outer;inner cycles' lines for flamegraph.pl
+Run as a script it profiles a program file:
+    python3 profiler.py [File] [Load Hex Addr] [-n Max Cycles] [-c Callgrind File] [-s Folded File]
+"""
+
+ROOT_SP = 0x200
+# tracked blocks kept before a flush, discarded blocks are dropped by it
+MAX_TRACKED = 4096
+
+# runs of a basic block whose cycles only depend on the closing branch
+class BlockStats():
+    __slots__ = ('ops', 'base', 'exact', 'runs', 'cycles')
+
+    def __init__(self, ops, exact):
+        self.ops = ops
+        self.base = sum(base for pc, binary, base in ops)
+        self.exact = exact
+        self.runs = 0
+        self.cycles = 0
+
+class Frame():
+    __slots__ = ('fn', 'caller', 'site', 'sp', 'cycles', 'instructions')
+
+    def __init__(self, fn, caller, site, sp, cycles, instructions):
+        self.fn = fn
+        self.caller = caller
+        self.site = site
+        self.sp = sp
+        self.cycles = cycles
+        self.instructions = instructions
+
+class Profiler():
+    def __init__(self, opcodes=OPCODES_6502):
+        self.opcodes = opcodes
+        self.counts = array('Q', bytes(8 * 0x10000))
+        self.cycles = array('Q', bytes(8 * 0x10000))
+        self.op_counts = array('Q', bytes(8 * 256))
+        self.op_cycles = array('Q', bytes(8 * 256))
+        self.clear()
+
+    def clear(self, pc=0, cycle=0):
+        for table in (self.counts, self.cycles, self.op_counts, self.op_cycles):
+            table[:] = array('Q', bytes(8 * len(table)))
+
+        self.instructions = 0
+        self.tracked = {}
+        self.owner = {}
+        self.calls = {}
+        self.folded = {}
+        self.start(pc, cycle)
+
+    # the root frame, never popped
+    def start(self, pc, cycle):
+        self.clock = cycle
+        self.stack = [Frame(pc, None, None, ROOT_SP, cycle, self.instructions)]
+        self.key = (pc,)
+
+    def track(self, block):
+        if len(self.tracked) >= MAX_TRACKED:
+            self.flush()
+
+        ops = []
+        pc = block.start
+        exact = True
+        for binary, oper, size, base in block.ops:
+            ops.append((pc, binary, base))
+            exact = exact and not self.opcodes[binary].page_cycles
+            pc += size
+
+        stats = self.tracked[block] = BlockStats(tuple(ops), exact)
+        return stats
+
+    # a write discarded the block, the instructions before end ran
+    def partial(self, stats, end):
+        count = 0
+        for pc, binary, base in stats.ops:
+            if pc >= end:
+                break
+            self.count(pc, binary, 1, base)
+            count += 1
+
+        return count
+
+    def count(self, pc, binary, runs, cycles):
+        self.counts[pc] += runs
+        self.cycles[pc] += cycles
+        self.op_counts[binary] += runs
+        self.op_cycles[binary] += cycles
+
+    # spreads the tracked block runs over the counters, branch cycles go to
+    # the branch
+    def flush(self):
+        for block, stats in list(self.tracked.items()):
+            runs = stats.runs
+            if runs:
+                for pc, binary, base in stats.ops:
+                    self.count(pc, binary, runs, runs * base)
+
+                pc, binary, base = stats.ops[-1]
+                extra = stats.cycles - runs * stats.base
+                self.cycles[pc] += extra
+                self.op_cycles[binary] += extra
+                stats.runs = stats.cycles = 0
+
+            if not block.ops:
+                del self.tracked[block]
+
+    # called by the run loop after a block or a single instruction ran
+    # from first to end, binary is the last opcode byte executed
+    def after(self, first, end, binary, spent, count, cpu):
+        self.instructions += count
+        self.clock += spent
+        self.owner[first] = (self.stack[-1].fn, end)
+        key = self.key
+        self.folded[key] = self.folded.get(key, 0) + spent
+
+        if binary == 0x20:
+            self.push(cpu.pc, end - 3, (cpu.sp + 2) & 0xff)
+        elif binary == 0x60 or binary == 0x40:
+            self.pop(cpu.sp)
+
+    # a clock event moved pc from site, an interrupt was taken. Its entry
+    # cycles belong to the handler.
+    def interrupt(self, pc, site, sp, before, now):
+        self.clock = before
+        self.push(pc, site, sp)
+        self.clock = now
+        self.folded[self.key] = self.folded.get(self.key, 0) + now - before
+
+    def push(self, fn, site, sp):
+        stack = self.stack
+        self.pop(sp)
+        stack.append(Frame(fn, stack[-1].fn, site, sp, self.clock, self.instructions))
+        self.key = self.key + (fn,)
+
+    def pop(self, sp):
+        stack = self.stack
+        while len(stack) > 1 and stack[-1].sp <= sp:
+            self.charge(stack.pop())
+            self.key = self.key[:-1]
+
+    def charge(self, frame):
+        edge = (frame.caller, frame.site, frame.fn)
+        total = self.calls.get(edge)
+        if total is None:
+            total = self.calls[edge] = [0, 0, 0]
+
+        total[0] += 1
+        total[1] += self.instructions - frame.instructions
+        total[2] += self.clock - frame.cycles
+
+    # call edges with the frames still open charged up to now
+    def call_edges(self):
+        calls = {edge: list(total) for edge, total in self.calls.items()}
+        for frame in self.stack[1:]:
+            edge = (frame.caller, frame.site, frame.fn)
+            total = calls.setdefault(edge, [0, 0, 0])
+            total[0] += 1
+            total[1] += self.instructions - frame.instructions
+            total[2] += self.clock - frame.cycles
+
+        return calls
+
+    # function of every executed address, from the blocks that ran there
+    def functions(self):
+        self.flush()
+        fn_of = {}
+        counts = self.counts
+        for first, (fn, end) in self.owner.items():
+            for pc in range(first, min(end, 0x10000)):
+                if counts[pc]:
+                    fn_of.setdefault(pc, fn)
+
+        return fn_of
+
+    def hot(self, table, top=None):
+        ranked = sorted((i for i in range(len(table)) if table[i]), key=table.__getitem__, \
+                        reverse=True)
+        return ranked if top is None else ranked[:top]
+
+    def by_code(self):
+        return self.fold(lambda opcode: opcode.code)
+
+    def by_mode(self):
+        return self.fold(lambda opcode: opcode.mode)
+
+    def fold(self, field):
+        self.flush()
+        totals = {}
+        for binary, opcode in enumerate(self.opcodes):
+            if not self.op_counts[binary]:
+                continue
+
+            total = totals.setdefault(field(opcode), [0, 0])
+            total[0] += self.op_counts[binary]
+            total[1] += self.op_cycles[binary]
+
+        return sorted(totals.items(), key=lambda item: item[1][1], reverse=True)
+
+    def flat(self, top=20, labels=None):
+        self.flush()
+        labels = labels or {}
+        total = sum(self.op_cycles) or 1
+        lines = ['%d instructions, %d cycles' % (sum(self.op_counts), sum(self.op_cycles)), '', \
+                 'Address  Count        Cycles       %      Label']
+        for pc in self.hot(self.cycles, top):
+            lines.append('%-8s %-12d %-12d %5.1f%%  %s' % (hexStr(pc, size=4, prefix='$'), \
+                         self.counts[pc], self.cycles[pc], self.cycles[pc] * 100 / total, \
+                         labels.get(pc, '')))
+
+        lines += ['', 'Opcode   Count        Cycles       %']
+        for binary in self.hot(self.op_cycles, top):
+            opcode = self.opcodes[binary]
+            name = '%s %s' % (opcode.code, opcode.mode or '') if opcode.code else '???'
+            lines.append('%-8s %-12d %-12d %5.1f%%  %s' % (hexStr(binary, prefix='$'), \
+                         self.op_counts[binary], self.op_cycles[binary], \
+                         self.op_cycles[binary] * 100 / total, name))
+
+        for title, rows in (('Op', self.by_code()), ('Mode', self.by_mode())):
+            lines += ['', '%-8s Count        Cycles       %%' % title]
+            for key, (count, cycles) in rows:
+                lines.append('%-8s %-12d %-12d %5.1f%%' % (key, count, cycles, cycles * 100 / total))
+
+        return '\n'.join(lines)
+
+    def name(self, fn, labels):
+        if fn in labels:
+            return labels[fn]
+
+        return hexStr(fn, size=4, prefix='$')
+
+    def callgrind(self, f, labels=None):
+        labels = labels or {}
+        fn_of = self.functions()
+        costs = {}
+        for pc, fn in fn_of.items():
+            costs.setdefault(fn, []).append(pc)
+
+        calls = {}
+        for (caller, site, callee), total in self.call_edges().items():
+            if caller is not None:
+                calls.setdefault(caller, []).append((site, callee, total))
+
+        f.write('version: 1\ncreator: py6502\npositions: instr\nevents: Instructions Cycles\n')
+        f.write('summary: %d %d\n' % (sum(self.op_counts), sum(self.op_cycles)))
+        for fn in sorted(set(costs) | set(calls)):
+            f.write('\nfn=%s\n' % self.name(fn, labels))
+            for pc in sorted(costs.get(fn, ())):
+                f.write('0x%04x %d %d\n' % (pc, self.counts[pc], self.cycles[pc]))
+
+            for site, callee, (count, instructions, cycles) in sorted(calls.get(fn, ()), \
+                                                                     key=lambda c: (c[0], c[1])):
+                f.write('cfn=%s\n' % self.name(callee, labels))
+                f.write('calls=%d 0x%04x\n' % (count, callee))
+                f.write('0x%04x %d %d\n' % (site, instructions, cycles))
+
+    def folded_stacks(self, labels=None):
+        labels = labels or {}
+        for key, cycles in sorted(self.folded.items()):
+            if cycles:
+                yield '%s %d' % (';'.join(self.name(fn, labels) for fn in key), cycles)
+
+def usage():
+    return 'python3 %s [File] [Load Hex Addr] [-n Max Cycles] [-c Callgrind File] ' \
+           '[-s Folded File]' % sys.argv[0]
+
+def main(argv):
+    from processor import Processor
+    from loader import load_file
+
+    if len(argv) < 3 or argv[1] == '-h':
+        print(usage())
+        return
+
+    max_cycles = int(pop_option(argv, '-n', '10000000'), 0)
+    callgrind = pop_option(argv, '-c')
+    folded = pop_option(argv, '-s')
+    addr = int(argv[2], 16)
+
+    proc = Processor()
+    result = load_file(proc.bus, argv[1], addr=addr)
+    proc.cpu.config(pc=result.entry if result.entry is not None else addr)
+    profile = proc.attach_profiler()
+    reason, cycles = proc.run(max_cycles=max_cycles)
+
+    print('%s after %d cycles' % (reason, cycles))
+    print(profile.flat())
+
+    if callgrind is not None:
+        with open(callgrind, 'w') as f:
+            profile.callgrind(f)
+    if folded is not None:
+        with open(folded, 'w') as f:
+            for line in profile.folded_stacks():
+                f.write(line + '\n')
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -5,26 +5,42 @@ class RAM():
         self.size = size
         self.addr_size = addr_size
         self.data = bytearray(size)
+        self.bus = None
+        self.base = 0
 
-    # sould be in caller
+    # once the RAM is mapped on a bus at base, load and item assignment
+    # write through Bus.load, so the bus watchers (block cache, snapshot
+    # tracker, debugger) see them. Writing to data directly bypasses them.
+    def attach(self, bus, base):
+        self.bus = bus
+        self.base = base
+
+    # hex digits, see hex_bytes for odd lengths and loader.py for the file
+    # formats
     def load_str(self, input_str, offset=0):
-        blob = bytearray()
-        
-        string = input_str.replace(' ', '')
-        for s in range(0, len(string), 2):
-            i = int('0x' + string[s:s+2], 16)
-            blob.append(i)
-        
-        self.load(blob, offset)
-    
+        self.load(hex_bytes(input_str), offset)
+
     def load(self, blob, offset):
-        self.data[offset:len(blob)] = blob
+        if offset < 0 or offset + len(blob) > len(self.data):
+            raise IndexError('%d bytes at %s do not fit in %d bytes' % \
+                             (len(blob), hexStr(offset, size=4, prefix='$'), len(self.data)))
+
+        if self.bus is not None:
+            self.bus.load(blob, self.base + offset)
+        else:
+            self.data[offset:offset+len(blob)] = blob
 
     def __getitem__(self, pos):
         return self.data[pos]
 
     def __setitem__(self, pos, value):
-        self.data[pos] = value
+        if self.bus is None:
+            self.data[pos] = value
+        elif isinstance(pos, slice):
+            for addr, byte in zip(range(*pos.indices(self.size)), value):
+                self.load(bytes((byte,)), addr)
+        else:
+            self.load(bytes((value,)), pos)
         
     def to_str(self, offset=0, size=0x20, line_size=16, formatted=True):
         out = ''
@@ -40,7 +56,7 @@ class RAM():
             else:
                 data_len = line_size
                 
-            out += (self.get_line_str(a, self.data[a:a+data_len], formatted))
+            out += (self.get_line_str(a, self[a:a+data_len], formatted))
             
             if formatted:
                 out += '\n'
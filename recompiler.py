@@ -0,0 +1,446 @@
+#!/usr/bin/python3
+
+import re
+import sys
+import random
+from common import *
+from opcodes import *
+
+"""
+Block recompiler.
+
+Hot basic blocks from the BlockCache are turned into Python functions
+
+    block(cpu, ops) -> opcode byte of the last instruction executed
+
+with the registers held in local variables, operands and addresses folded
+into constants and the flags kept in the same lazy form as the CPU.
+Instructions without a template (BRK, RTI, PHP, PLP, CLI, illegal opcodes)
+sync the registers back and call the interpreter handler, CLI and PLP so
+a held IRQ line is noticed.
+
+A function is stored on its Block, so it is thrown away with the block
+when its code bytes are written. Writes that leave the fast memory path
+check whether they discarded the running block and return early.
+
+Cycles are the OpCode.cycles of the instructions, summed while generating
+and added to the clock once at each exit. Page crossing indexed reads add
+their cycle where the address is computed, taken branches know their
+penalty from the static target.
+
+Run as a script it does a differential check of compiled blocks against
+the interpreter on random programs:
+    python3 recompiler.py [programs] [seed]
+"""
+
+REGISTERS = ('a', 'x', 'y', 'sp', 'n', 'z', 'c', 'v')
+REGISTER_RE = re.compile(r'\b(%s)\b' % '|'.join(REGISTERS))
+
+SHIFTS = (Op.ASL, Op.LSR, Op.ROL, Op.ROR)
+STORES = {Op.STA: 'a', Op.STX: 'x', Op.STY: 'y'}
+LOADS = {Op.LDA: 'a', Op.LDX: 'x', Op.LDY: 'y'}
+LOGIC = {Op.AND: '&', Op.ORA: '|', Op.EOR: '^'}
+COMPARES = {Op.CMP: 'a', Op.CPX: 'x', Op.CPY: 'y'}
+STEPS = {Op.INX: ('x', '+'), Op.INY: ('y', '+'), Op.DEX: ('x', '-'), Op.DEY: ('y', '-')}
+TRANSFERS = {Op.TAX: ('x', 'a'), Op.TAY: ('y', 'a'), Op.TXA: ('a', 'x'), \
+             Op.TYA: ('a', 'y'), Op.TSX: ('x', 'sp')}
+FLAGS = {Op.CLC: 'c = 0', Op.SEC: 'c = 1', Op.CLV: 'v = 0', Op.CLD: 'cpu.d = 0', \
+         Op.SED: 'cpu.d = 1', Op.SEI: 'cpu.i = 1'}
+BRANCHES = {Op.BCC: 'not c', Op.BCS: 'c', Op.BEQ: 'z == 0', Op.BNE: 'z != 0', \
+            Op.BMI: 'n & 0x80', Op.BPL: 'not n & 0x80', Op.BVS: 'v & 0x80', \
+            Op.BVC: 'not v & 0x80'}
+
+class BlockWriter():
+    def __init__(self, block, opcodes, peek):
+        self.block = block
+        self.opcodes = opcodes
+        self.peek = peek
+        self.lines = []
+        self.indent = 1
+        self.ticks = 0
+        self.calls = False
+        self.done = False
+
+    def emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def sync(self):
+        self.emit('#SYNC')
+
+    def reload(self):
+        self.emit('#RELOAD')
+
+    def exit(self, pc, binary, ticks=None):
+        self.sync()
+        self.emit('clk.counter += %d' % (self.ticks if ticks is None else ticks))
+        self.emit('cpu.pc = 0x%04x' % pc)
+        self.emit('return 0x%02x' % binary)
+
+    def read(self, dst, ea):
+        if isinstance(ea, int):
+            self.emit('p = P[0x%02x]' % (ea >> 8))
+            self.emit('%s = p[0x%02x] if p is not None else rd(0x%04x)' % (dst, ea & 0xff, ea))
+        else:
+            self.emit('p = P[%s >> 8]' % ea)
+            self.emit('%s = p[%s & 0xff] if p is not None else rd(%s)' % (dst, ea, ea))
+
+    def write(self, ea, src, next_pc, binary, check=True):
+        if isinstance(ea, int):
+            self.emit('p = W[0x%02x]' % (ea >> 8))
+            self.emit('if p is not None:')
+            self.emit('    p[0x%02x] = %s' % (ea & 0xff, src))
+        else:
+            self.emit('p = W[%s >> 8]' % ea)
+            self.emit('if p is not None:')
+            self.emit('    p[%s & 0xff] = %s' % (ea, src))
+
+        self.emit('else:')
+        self.indent += 1
+        self.emit('wr(%s, %s)' % (ea if not isinstance(ea, int) else '0x%04x' % ea, src))
+        if check:
+            # the write may have discarded this block
+            self.emit('if not ops:')
+            self.indent += 1
+            self.exit(next_pc, binary)
+            self.indent -= 1
+        self.indent -= 1
+
+    def push(self, src, next_pc, binary, check=True):
+        self.emit('s = 0x100 | sp')
+        self.emit('sp = (sp - 1) & 0xff')
+        self.write('s', src, next_pc, binary, check)
+
+    def pull(self, dst):
+        self.emit('sp = (sp + 1) & 0xff')
+        self.emit('s = 0x100 | sp')
+        self.read(dst, 's')
+
+    def address(self, mode, oper, page_cycles=0):
+        if mode in (AddrMode.ZP, AddrMode.ABS):
+            return oper
+
+        if mode == AddrMode.ZPX:
+            self.emit('ea = (0x%02x + x) & 0xff' % oper)
+        elif mode == AddrMode.ZPY:
+            self.emit('ea = (0x%02x + y) & 0xff' % oper)
+        elif mode == AddrMode.ABSX:
+            self.emit('ea = (0x%04x + x) & 0xffff' % oper)
+            if page_cycles:
+                self.emit('if (ea ^ 0x%04x) & 0xff00: clk.counter += 1' % oper)
+        elif mode == AddrMode.ABSY:
+            self.emit('ea = (0x%04x + y) & 0xffff' % oper)
+            if page_cycles:
+                self.emit('if (ea ^ 0x%04x) & 0xff00: clk.counter += 1' % oper)
+        elif mode == AddrMode.IND:
+            self.read('lo', oper)
+            self.read('hi', (oper & 0xff00) | ((oper + 1) & 0xff))
+            self.emit('ea = lo | (hi << 8)')
+        elif mode == AddrMode.INDX:
+            self.emit('t = (0x%02x + x) & 0xff' % oper)
+            self.read('lo', 't')
+            self.emit('t = (t + 1) & 0xff')
+            self.read('hi', 't')
+            self.emit('ea = lo | (hi << 8)')
+        elif mode == AddrMode.INDY:
+            self.read('lo', oper)
+            self.read('hi', (oper + 1) & 0xff)
+            self.emit('b = lo | (hi << 8)')
+            self.emit('ea = (b + y) & 0xffff')
+            if page_cycles:
+                self.emit('if (ea ^ b) & 0xff00: clk.counter += 1')
+
+        return 'ea'
+
+    def operand(self, opcode, oper):
+        # immediates are folded, the block is discarded if they change
+        if opcode.mode == AddrMode.IMM:
+            return '0x%02x' % self.peek(oper)
+
+        self.read('m', self.address(opcode.mode, oper, opcode.page_cycles))
+        return 'm'
+
+    def generate(self):
+        pc = self.block.start
+        for binary, oper, size, cycles in self.block.ops:
+            next_pc = (pc + size) & 0xffff
+            opcode = self.opcodes[binary]
+            self.emit('# $%04x %s' % (pc, opcode.code))
+            self.instruction(opcode, oper, next_pc)
+            pc = next_pc
+
+        if not self.done:
+            self.exit(pc, self.block.ops[-1][0])
+
+        return self.source()
+
+    def instruction(self, opcode, oper, next_pc):
+        code = opcode.code
+        mode = opcode.mode
+        binary = opcode.binary
+
+        ticks = opcode.cycles
+
+        if code in LOADS:
+            m = self.operand(opcode, oper)
+            self.emit('%s = n = z = %s' % (LOADS[code], m))
+        elif code in STORES:
+            self.ticks += ticks
+            self.write(self.address(mode, oper), STORES[code], next_pc, binary)
+            return
+        elif code in (Op.ADC, Op.SBC):
+            m = self.operand(opcode, oper)
+            if code == Op.SBC:
+                self.emit('m = %s ^ 0xff' % m)
+                m = 'm'
+            self.emit('t = a + %s + c' % m)
+            self.emit('r = t & 0xff')
+            self.emit('v = ~(a ^ %s) & (a ^ r)' % m)
+            self.emit('c = t >> 8')
+            self.emit('a = n = z = r')
+        elif code in LOGIC:
+            m = self.operand(opcode, oper)
+            self.emit('a = n = z = a %s %s' % (LOGIC[code], m))
+        elif code in COMPARES:
+            m = self.operand(opcode, oper)
+            self.emit('t = %s - %s' % (COMPARES[code], m))
+            self.emit('c = 0 if t < 0 else 1')
+            self.emit('n = z = t & 0xff')
+        elif code == Op.BIT:
+            m = self.operand(opcode, oper)
+            self.emit('n = %s' % m)
+            self.emit('v = %s << 1' % m)
+            self.emit('z = a & %s' % m)
+        elif code in SHIFTS or code in (Op.INC, Op.DEC):
+            if mode == AddrMode.A:
+                src = 'a'
+            else:
+                ea = self.address(mode, oper)
+                self.read('m', ea)
+                src = 'm'
+
+            if code == Op.ASL:
+                self.emit('c = %s >> 7' % src)
+                self.emit('r = (%s << 1) & 0xff' % src)
+            elif code == Op.LSR:
+                self.emit('c = %s & 1' % src)
+                self.emit('r = %s >> 1' % src)
+            elif code == Op.ROL:
+                self.emit('r = ((%s << 1) | c) & 0xff' % src)
+                self.emit('c = %s >> 7' % src)
+            elif code == Op.ROR:
+                self.emit('r = (%s >> 1) | (c << 7)' % src)
+                self.emit('c = %s & 1' % src)
+            elif code == Op.INC:
+                self.emit('r = (%s + 1) & 0xff' % src)
+            else:
+                self.emit('r = (%s - 1) & 0xff' % src)
+            self.emit('n = z = r')
+
+            if mode == AddrMode.A:
+                self.emit('a = r')
+            else:
+                self.ticks += ticks
+                self.write(ea, 'r', next_pc, binary)
+                return
+        elif code in STEPS:
+            reg, sign = STEPS[code]
+            self.emit('%s = n = z = (%s %s 1) & 0xff' % (reg, reg, sign))
+        elif code in TRANSFERS:
+            dst, src = TRANSFERS[code]
+            self.emit('%s = n = z = %s' % (dst, src))
+        elif code == Op.TXS:
+            self.emit('sp = x')
+        elif code in FLAGS:
+            self.emit(FLAGS[code])
+        elif code == Op.NOP:
+            pass
+        elif code == Op.PHA:
+            self.ticks += ticks
+            self.push('a', next_pc, binary)
+            return
+        elif code == Op.PLA:
+            self.pull('m')
+            self.emit('a = n = z = m')
+        elif code in BRANCHES:
+            self.ticks += ticks
+            self.emit('if %s:' % BRANCHES[code])
+            self.indent += 1
+            self.exit(oper, binary, self.ticks + 1 + ((next_pc ^ oper) & 0xff00 != 0))
+            self.indent -= 1
+            self.exit(next_pc, binary)
+            self.done = True
+            return
+        elif code == Op.JMP:
+            self.ticks += ticks
+            if mode == AddrMode.IND:
+                self.address(mode, oper)
+                self.sync()
+                self.emit('clk.counter += %d' % self.ticks)
+                self.emit('cpu.pc = ea')
+                self.emit('return 0x%02x' % binary)
+            else:
+                self.exit(oper, binary)
+            self.done = True
+            return
+        elif code == Op.JSR:
+            self.ticks += ticks
+            ret = (next_pc - 1) & 0xffff
+            self.push('0x%02x' % (ret >> 8), next_pc, binary, check=False)
+            self.push('0x%02x' % (ret & 0xff), next_pc, binary, check=False)
+            self.exit(oper, binary)
+            self.done = True
+            return
+        elif code == Op.RTS:
+            self.ticks += ticks
+            self.pull('lo')
+            self.pull('hi')
+            self.sync()
+            self.emit('clk.counter += %d' % self.ticks)
+            self.emit('cpu.pc = ((lo | (hi << 8)) + 1) & 0xffff')
+            self.emit('return 0x%02x' % binary)
+            self.done = True
+            return
+        else:
+            self.fallback(opcode, oper, next_pc)
+            return
+
+        self.ticks += ticks
+
+    def fallback(self, opcode, oper, next_pc):
+        self.calls = True
+        self.ticks += opcode.cycles
+        self.sync()
+        self.emit('clk.counter += %d' % self.ticks)
+        self.ticks = 0
+        self.emit('cpu.pc = 0x%04x' % next_pc)
+        self.emit('D[0x%02x](%s)' % (opcode.binary, oper))
+
+        if opcode.code in (Op.BRK, Op.RTI) or opcode.code is None:
+            self.emit('return 0x%02x' % opcode.binary)
+            self.done = True
+        else:
+            self.reload()
+            self.emit('if not ops or cpu.pc != 0x%04x:' % next_pc)
+            self.emit('    return 0x%02x' % opcode.binary)
+
+    def source(self):
+        body = '\n'.join(self.lines)
+        used = sorted(set(REGISTER_RE.findall(re.sub(r'#.*', '', body))), key=REGISTERS.index)
+        if self.calls:
+            used = list(REGISTERS)
+
+        load = '; '.join('%s = cpu.%s' % (r, r) for r in used) or 'pass'
+        store = '; '.join('cpu.%s = %s' % (r, r) for r in used) or 'pass'
+
+        out = []
+        for line in self.lines:
+            stripped = line.strip()
+            indent = line[:len(line) - len(line.lstrip())]
+            if stripped == '#SYNC':
+                out.append(indent + store)
+            elif stripped == '#RELOAD':
+                out.append(indent + load)
+            else:
+                out.append(line)
+
+        return 'def block(cpu, ops, P=P, W=W, rd=rd, wr=wr, D=D, clk=clk):\n' + \
+               '    ' + load + '\n' + '\n'.join(out) + '\n'
+
+class Recompiler():
+    def __init__(self, cpu, blocks, hot_count=32):
+        self.cpu = cpu
+        self.blocks = blocks
+        self.hot_count = hot_count
+        self.env = {'P': cpu.rpages, 'W': cpu.wpages, 'rd': cpu.ram.read, 'wr': cpu.ram.write, \
+                    'D': cpu.dispatch, 'clk': cpu.clk}
+
+    # counts a run of block and compiles it once it is hot
+    def promote(self, block):
+        block.count += 1
+        if block.count < self.hot_count:
+            return None
+
+        block.func = self.compile(block)
+        return block.func
+
+    def generate(self, block):
+        return BlockWriter(block, self.cpu.opcodes, self.blocks.peek).generate()
+
+    def compile(self, block):
+        name = '<block %s>' % hexStr(block.start, size=4, prefix='$')
+        namespace = {}
+        exec(compile(self.generate(block), name, 'exec'), self.env, namespace)
+        return namespace['block']
+
+def random_program(rng, size):
+    legal = [op for op in OPCODES_6502 if op.code is not None and \
+             op.code not in (Op.BRK, Op.RTI, Op.JMP, Op.JSR, Op.RTS)]
+
+    blob = bytearray()
+    while len(blob) < size:
+        op = rng.choice(legal)
+        blob.append(op.binary)
+        blob.extend(rng.randrange(256) for _ in range(op.size - 1))
+
+    return blob
+
+def run_block(proc, compiled):
+    cpu = proc.cpu
+    block = proc.blocks.get(cpu.pc)
+    if block is None:
+        cpu.execute()
+    elif compiled:
+        func = block.func or proc.recompiler.compile(block)
+        block.func = func
+        func(cpu, block.ops)
+    else:
+        for binary, oper, size, cycles in block.ops:
+            cpu.pc += size
+            proc.clk.counter += cycles
+            cpu.dispatch[binary](oper)
+
+def state(proc):
+    try:
+        return proc.cpu.reg_to_str(), bytes(proc.ram.data), bytes(proc.wram.data)
+    except Exception as e:
+        return repr(e)
+
+def check(seed, blocks=200, size=48, start=0x0600):
+    from processor import Processor
+
+    rng = random.Random(seed)
+    procs = [Processor(recompile=True), Processor()]
+    program = random_program(rng, size) + bytes((0x4c, start & 0xff, start >> 8))
+    for proc in procs:
+        proc.bus.load(program, start)
+        proc.cpu.config(pc=start)
+
+    for count in range(blocks):
+        results = []
+        for proc, compiled in zip(procs, (True, False)):
+            try:
+                run_block(proc, compiled)
+                results.append(state(proc))
+            except Exception as e:
+                results.append(repr(e))
+
+        if results[0] != results[1]:
+            print('seed %d: mismatch after %d blocks' % (seed, count + 1))
+            print('  compiled:    %s' % str(results[0])[:100])
+            print('  interpreted: %s' % str(results[1])[:100])
+            return False
+
+        if isinstance(results[0], str):
+            break
+
+    return True
+
+def main(argv):
+    programs = int(argv[1]) if len(argv) > 1 else 200
+    seed = int(argv[2]) if len(argv) > 2 else 0
+
+    failed = sum(not check(s) for s in range(seed, seed + programs))
+    print('%d/%d programs match' % (programs - failed, programs))
+
+if __name__ == '__main__':
+    main(sys.argv)
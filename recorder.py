@@ -0,0 +1,82 @@
+import struct
+
+"""
+Execution trace ring buffer.
+
+Each executed instruction is packed into a fixed-size record
+    pc, opcode, operand, a, x, y, sp, status, clock counter
+inside a preallocated bytearray. Once the buffer is full the oldest records
+are overwritten, so tracing can stay enabled and only the last records are
+formatted when they are needed (see tracedump.py).
+
+Trace files hold a header followed by the records, oldest first.
+"""
+
+RECORD = struct.Struct('<HBHBBBBBQ')
+HEADER = struct.Struct('<4sHHQ')
+MAGIC = b'P6TR'
+VERSION = 1
+
+class TraceRecorder():
+    def __init__(self, capacity=0x10000):
+        self.capacity = capacity
+        self.buf = bytearray(capacity * RECORD.size)
+        self.pos = 0
+        self.count = 0
+
+    def record(self, pc, opcode, oper, a, x, y, sp, status, cycles):
+        RECORD.pack_into(self.buf, self.pos, pc, opcode, oper, a, x, y, sp, status, cycles)
+        self.count += 1
+        self.pos += RECORD.size
+        if self.pos == len(self.buf):
+            self.pos = 0
+
+    def clear(self):
+        self.pos = 0
+        self.count = 0
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    # the buffer contents, oldest record first
+    def chunks(self):
+        view = memoryview(self.buf)
+        if self.count > self.capacity:
+            return (view[self.pos:], view[:self.pos])
+
+        return (view[:self.pos],)
+
+    def records(self, last=None):
+        skip = 0
+        if last is not None:
+            skip = max(len(self) - last, 0) * RECORD.size
+
+        for chunk in self.chunks():
+            if skip >= len(chunk):
+                skip -= len(chunk)
+                continue
+
+            yield from RECORD.iter_unpack(chunk[skip:])
+            skip = 0
+
+    def flush(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD.size, len(self)))
+            for chunk in self.chunks():
+                f.write(chunk)
+
+def read_trace(filename, last=None):
+    with open(filename, 'rb') as f:
+        magic, version, size, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or size != RECORD.size:
+            raise ValueError('%s is not a version %d trace file' % (filename, VERSION))
+
+        if last is not None and last < count:
+            f.seek((count - last) * RECORD.size, 1)
+
+        while True:
+            data = f.read(RECORD.size * 4096)
+            if not data:
+                break
+
+            yield from RECORD.iter_unpack(data)
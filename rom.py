@@ -1,6 +1,300 @@
+#!/usr/bin/python3
+
+import sys
+import mmap
 from common import *
+from bus import PAGE_SIZE
+
+"""
+iNES / NES 2.0 cartridge images.
+
+The file is memory-mapped read-only and PRG and CHR ROM are memoryview
+slices of the mapping, so nothing is copied and a set of ROMs only costs
+the pages the OS actually reads in.
+
+Header, 16 bytes:
+    0-3  'NES' 1A
+    4    PRG ROM size in 16K units (NES 2.0: low byte, high nibble in 9)
+    5    CHR ROM size in 8K units, 0 means 8K of CHR RAM
+    6    mirroring, battery, trainer, four screen, mapper low nibble
+    7    console type, NES 2.0 signature (bits 2-3 = 10), mapper high nibble
+    8    NES 2.0: mapper bits 8-11, submapper
+    9    NES 2.0: PRG and CHR ROM size high nibbles
+A 512 byte trainer may follow the header, then PRG ROM, then CHR ROM.
+
+Mappers own the $8000-$FFFF window of the bus. Every PRG page gets its
+memoryview built once when the mapper is created, a bank switch only
+points the bus page table entries of the window at other views. Writes to
+the window go to the mapper registers.
+"""
+
+MAGIC = b'NES\x1a'
+HEADER_SIZE = 16
+TRAINER_SIZE = 512
+PRG_BANK = 0x4000
+CHR_BANK = 0x2000
+
+class InvalidROM(Exception):
+    pass
 
 class ROM:
 
     def __init__(self, filename):
         self.filename = filename
+        with open(filename, 'rb') as f:
+            try:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise InvalidROM('%s is empty' % filename)
+
+        self.data = memoryview(self.map)
+        self.parse_header(self.data[:HEADER_SIZE])
+
+        offset = HEADER_SIZE + (TRAINER_SIZE if self.trainer else 0)
+        end = offset + self.prg_size + self.chr_size
+        if len(self.data) < end:
+            raise InvalidROM('%s is truncated, %d bytes of %d' % (filename, len(self.data), end))
+
+        self.prg = self.data[offset:offset+self.prg_size]
+        offset += self.prg_size
+        if self.chr_size:
+            self.chr = self.data[offset:offset+self.chr_size]
+        else:
+            self.chr = memoryview(bytearray(CHR_BANK))
+
+    def parse_header(self, header):
+        if len(header) < HEADER_SIZE or bytes(header[:4]) != MAGIC:
+            raise InvalidROM('%s is not an iNES file' % self.filename)
+
+        flags6 = header[6]
+        flags7 = header[7]
+        self.nes2 = (flags7 & 0x0c) == 0x08
+        self.vertical = flags6 & 1
+        self.battery = (flags6 >> 1) & 1
+        self.trainer = (flags6 >> 2) & 1
+        self.four_screen = (flags6 >> 3) & 1
+        self.mapper = (flags6 >> 4) | (flags7 & 0xf0)
+        self.submapper = 0
+
+        prg_units = header[4]
+        chr_units = header[5]
+        if self.nes2:
+            self.mapper |= (header[8] & 0x0f) << 8
+            self.submapper = header[8] >> 4
+            self.prg_size = self.rom_size(header[9] & 0x0f, prg_units, PRG_BANK)
+            self.chr_size = self.rom_size(header[9] >> 4, chr_units, CHR_BANK)
+        else:
+            self.prg_size = prg_units * PRG_BANK
+            self.chr_size = chr_units * CHR_BANK
+
+        if not self.prg_size:
+            raise InvalidROM('%s has no PRG ROM' % self.filename)
+
+    # NES 2.0 sizes, a high nibble of F selects the exponent-multiplier form
+    @staticmethod
+    def rom_size(high, low, unit):
+        if high == 0x0f:
+            return (1 << (low >> 2)) * ((low & 3) * 2 + 1)
+
+        return ((high << 8) | low) * unit
+
+    def prg_bank(self, bank, size=PRG_BANK):
+        count = len(self.prg) // size
+        start = (bank % count) * size
+        return self.prg[start:start+size]
+
+    def chr_bank(self, bank, size=CHR_BANK):
+        count = max(len(self.chr) // size, 1)
+        start = (bank % count) * size
+        return self.chr[start:start+size]
+
+    def close(self):
+        self.prg.release()
+        self.chr.release()
+        self.data.release()
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return '<ROM %s mapper:%d PRG:%dK CHR:%dK%s>' % (self.filename, self.mapper, \
+               self.prg_size >> 10, self.chr_size >> 10, ' NES 2.0' if self.nes2 else '')
+
+class Mapper():
+    number = None
+    name = None
+
+    def __init__(self, rom, bus):
+        self.rom = rom
+        self.bus = bus
+        self.pages = [rom.prg[i:i+PAGE_SIZE] for i in range(0, len(rom.prg), PAGE_SIZE)]
+        self.prg_banks = len(rom.prg) // PRG_BANK
+        self.chr_bank = [rom.chr_bank(0, 0x1000), rom.chr_bank(1, 0x1000)]
+        self.reset()
+
+    # 16K PRG bank at $8000 (slot 0) or $C000 (slot 1)
+    def map_prg(self, slot, bank):
+        count = PRG_BANK // PAGE_SIZE
+        first = (bank % self.prg_banks) * count
+        window = 0x80 + slot * count
+        if self.bus.base_rpages[window] is self.pages[first]:
+            return
+
+        self.bus.map_pages(window, self.pages[first:first+count], self.write)
+
+    # 8K CHR bank seen by the PPU, as two 4K halves
+    def map_chr(self, slot, bank, size=0x1000):
+        if size == CHR_BANK:
+            self.chr_bank[0] = self.rom.chr_bank(bank * 2, 0x1000)
+            self.chr_bank[1] = self.rom.chr_bank(bank * 2 + 1, 0x1000)
+        else:
+            self.chr_bank[slot] = self.rom.chr_bank(bank, 0x1000)
+
+    def reset(self):
+        self.map_prg(0, 0)
+        self.map_prg(1, self.prg_banks - 1)
+
+    def write(self, addr, value):
+        pass
+
+    def state(self):
+        return ()
+
+    def set_state(self, state):
+        pass
+
+class NROM(Mapper):
+    number = 0
+    name = 'NROM'
+
+class UxROM(Mapper):
+    number = 2
+    name = 'UxROM'
+
+    def reset(self):
+        self.bank = 0
+        super().reset()
+
+    def write(self, addr, value):
+        self.bank = value
+        self.map_prg(0, value)
+
+    def state(self):
+        return (self.bank,)
+
+    def set_state(self, state):
+        self.write(0x8000, state[0])
+
+class CNROM(Mapper):
+    number = 3
+    name = 'CNROM'
+
+    def reset(self):
+        self.bank = 0
+        super().reset()
+
+    def write(self, addr, value):
+        self.bank = value & 3
+        self.map_chr(0, self.bank, CHR_BANK)
+
+    def state(self):
+        return (self.bank,)
+
+    def set_state(self, state):
+        self.write(0x8000, state[0])
+
+class MMC1(Mapper):
+    number = 1
+    name = 'MMC1'
+
+    def reset(self):
+        self.shift = 0x10
+        self.control = 0x0c
+        self.chr0 = 0
+        self.chr1 = 0
+        self.prg = 0
+        super().reset()
+        self.update()
+
+    # five writes of bit 0 load a register, bit 7 resets the shift register
+    def write(self, addr, value):
+        if value & 0x80:
+            self.shift = 0x10
+            self.control |= 0x0c
+            self.update()
+            return
+
+        done = self.shift & 1
+        self.shift = (self.shift >> 1) | ((value & 1) << 4)
+        if not done:
+            return
+
+        reg = (addr >> 13) & 3
+        if reg == 0:
+            self.control = self.shift
+        elif reg == 1:
+            self.chr0 = self.shift
+        elif reg == 2:
+            self.chr1 = self.shift
+        else:
+            self.prg = self.shift & 0x0f
+
+        self.shift = 0x10
+        self.update()
+
+    def update(self):
+        prg_mode = (self.control >> 2) & 3
+        if prg_mode < 2:
+            self.map_prg(0, self.prg & 0x0e)
+            self.map_prg(1, self.prg | 1)
+        elif prg_mode == 2:
+            self.map_prg(0, 0)
+            self.map_prg(1, self.prg)
+        else:
+            self.map_prg(0, self.prg)
+            self.map_prg(1, self.prg_banks - 1)
+
+        if self.control & 0x10:
+            self.map_chr(0, self.chr0)
+            self.map_chr(1, self.chr1)
+        else:
+            self.map_chr(0, self.chr0 >> 1, CHR_BANK)
+
+    def state(self):
+        return (self.shift, self.control, self.chr0, self.chr1, self.prg)
+
+    def set_state(self, state):
+        self.shift, self.control, self.chr0, self.chr1, self.prg = state
+        self.update()
+
+MAPPERS = {mapper.number: mapper for mapper in (NROM, MMC1, UxROM, CNROM)}
+
+def create_mapper(rom, bus):
+    mapper = MAPPERS.get(rom.mapper)
+    if mapper is None:
+        raise InvalidROM('%s uses mapper %d, which is not supported' % (rom.filename, rom.mapper))
+
+    return mapper(rom, bus)
+
+def usage():
+    return 'python3 %s [ROM Files...]' % sys.argv[0]
+
+def main(argv):
+    if len(argv) < 2 or argv[1] == '-h':
+        print(usage())
+        return
+
+    for filename in argv[1:]:
+        try:
+            with ROM(filename) as rom:
+                mapper = MAPPERS.get(rom.mapper)
+                print('%s %s' % (rom, mapper.name if mapper else 'unsupported'))
+        except (InvalidROM, OSError) as e:
+            print('%s: %s' % (filename, e))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,337 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import mmap
+import struct
+import hashlib
+from array import array
+from common import *
+from bus import PAGE_SIZE
+from snapshot import Snapshot
+
+"""
+Save-state files and a content-addressed page store.
+
+A save state is a Snapshot on disk, little-endian:
+    header      - magic 'P65S', format version, flags, clock, registers
+                  (pc, a, x, y, sp, status), mapper number ($FFFF for
+                  none), mapper state, PPU and IO registers and the number
+                  of memory pages
+    directory   - one byte per memory page, the page numbers
+    pages       - inline: the page data, PAGE_SIZE bytes each in directory
+                  order, starting at the first PAGE_SIZE aligned offset
+                  after the directory
+                  stored: one 32 bit page store slot per page instead
+The cartridge area is not part of a state, like for snapshots. A state
+only loads into a Processor with the same mapper.
+
+Loading memory-maps the file read-only and the Snapshot it builds holds
+memoryview slices of the mapping, nothing is parsed or copied but the
+header. Processor.restore then copies in only the pages that differ from
+the tracker baseline, so the machine memory is the private copy and the
+mapped pages are shared until then. Files are written to a temporary name
+and renamed over the old one, a mapping of the old file stays valid.
+
+PageStore is a directory holding many states with their pages stored
+once, by BLAKE2b digest:
+    pages.bin   - the unique pages, slot n at n * PAGE_SIZE
+    pages.idx   - the 16 byte digest of every slot
+    states.bin  - the state records, in the stored form
+    states.idx  - array('Q') of record offsets, the state ids
+All four are append only. A page shared by the snapshot saved before is
+not hashed again, and every slot has one memoryview, so restoring between
+two states of a store only copies the pages whose slots differ.
+
+Run as a script:
+    python3 savestate.py [State Files or Store Directories...] [-c New Store Directory]
+A directory has to hold a page store already, -c creates an empty one.
+"""
+
+MAGIC = b'P65S'
+VERSION = 1
+# pages are page store slots, not inline data
+STORED = 1
+NO_MAPPER = 0xffff
+MAPPER_STATE = 8
+PPU_SIZE = 8
+IO_SIZE = 0x20
+HEADER = struct.Struct('<4sHHQHBBBBBHB%ds%ds%dsH' % (MAPPER_STATE, PPU_SIZE, IO_SIZE))
+DIGEST_SIZE = 16
+
+class InvalidState(Exception):
+    pass
+
+def align(offset):
+    return -(-offset // PAGE_SIZE) * PAGE_SIZE
+
+def little(items):
+    if sys.byteorder != 'little':
+        items.byteswap()
+    return items
+
+# the file form of snapshot, with inline pages or page store slots
+def pack_state(snapshot, mapper, slots=None):
+    ppu, io, state = snapshot.devices
+    state = bytes(state) if state is not None else b''
+    if len(state) > MAPPER_STATE or len(ppu) != PPU_SIZE or len(io) != IO_SIZE:
+        raise InvalidState('device state does not fit the header')
+
+    pages = sorted(snapshot.pages)
+    number = mapper.number if mapper is not None else NO_MAPPER
+    header = HEADER.pack(MAGIC, VERSION, STORED if slots is not None else 0, snapshot.clock, \
+                         *snapshot.regs, number, len(state), state, ppu, io, len(pages))
+    parts = [header, bytes(pages)]
+    if slots is not None:
+        parts.append(little(array('I', (slots[page] for page in pages))).tobytes())
+    else:
+        size = len(header) + len(pages)
+        parts.append(bytes(align(size) - size))
+        parts.extend(snapshot.pages[page] for page in pages)
+
+    return b''.join(parts)
+
+# the Snapshot of a state, data being a memoryview of it, page views are
+# slices of data or come from store
+def unpack_state(data, mapper, store=None):
+    if len(data) < HEADER.size:
+        raise InvalidState('state is truncated')
+
+    magic, version, flags, clock, pc, a, x, y, sp, p, number, size, state, ppu, io, count = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise InvalidState('not a save state')
+    if version != VERSION:
+        raise InvalidState('save state version %d is not supported' % version)
+    expected = mapper.number if mapper is not None else NO_MAPPER
+    if number != expected:
+        raise InvalidState('state is for mapper %s, the machine has %s' % \
+                           (mapper_name(number), mapper_name(expected)))
+
+    start = HEADER.size + count
+    pages = bytes(data[HEADER.size:start])
+    if flags & STORED:
+        if store is None:
+            raise InvalidState('state pages are in a page store')
+        slots = array('I')
+        slots.frombytes(data[start:start + count * 4])
+        if len(slots) != count:
+            raise InvalidState('state is truncated')
+        views = {page: store.page(slot) for page, slot in zip(pages, little(slots))}
+    else:
+        start = align(start)
+        if len(data) < start + count * PAGE_SIZE:
+            raise InvalidState('state is truncated')
+        views = {page: data[start + i * PAGE_SIZE:start + (i + 1) * PAGE_SIZE] \
+                 for i, page in enumerate(pages)}
+
+    devices = (ppu, io, tuple(state[:size]) if number != NO_MAPPER else None)
+    return Snapshot((pc, a, x, y, sp, p), clock, views, devices)
+
+def mapper_name(number):
+    return 'none' if number == NO_MAPPER else str(number)
+
+def map_file(filename):
+    with open(filename, 'rb') as f:
+        try:
+            return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except ValueError:
+            raise InvalidState('%s is empty' % filename)
+
+# restores snapshot into proc once its pages match the memory of proc
+def adopt(proc, snapshot):
+    if set(snapshot.pages) != set(proc.track().views):
+        raise InvalidState('state memory pages do not match the machine')
+
+    proc.restore(snapshot)
+    return snapshot
+
+def save_state(proc, filename):
+    data = pack_state(proc.snapshot(), proc.mapper)
+    temp = filename + '.tmp'
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, filename)
+    return len(data)
+
+def load_state(proc, filename):
+    return adopt(proc, unpack_state(map_file(filename), proc.mapper))
+
+# the files of a page store directory
+STORE_FILES = ('pages.bin', 'pages.idx', 'states.bin', 'states.idx')
+
+def is_store(path):
+    return all(os.path.isfile(os.path.join(path, name)) for name in STORE_FILES)
+
+class PageStore():
+    # opens the store at path, making it first if create is true
+    def __init__(self, path, create=True):
+        if not create and not is_store(path):
+            raise InvalidState('%s is not a page store' % path)
+
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+        index = self.read('pages.idx')
+        count = min(len(index) // DIGEST_SIZE, self.size('pages.bin') // PAGE_SIZE)
+        self.digests = {index[i * DIGEST_SIZE:(i + 1) * DIGEST_SIZE]: i for i in range(count)}
+        self.count = count
+
+        offsets = self.read('states.idx')
+        self.offsets = array('Q')
+        self.offsets.frombytes(offsets[:len(offsets) // 8 * 8])
+        little(self.offsets)
+        self.end = self.size('states.bin')
+
+        # a half written save is dropped
+        self.pages_out = self.append('pages.bin', count * PAGE_SIZE)
+        self.index_out = self.append('pages.idx', count * DIGEST_SIZE)
+        while self.offsets and self.offsets[-1] >= self.end:
+            self.offsets.pop()
+        self.states_out = self.append('states.bin', self.end)
+        self.offsets_out = self.append('states.idx', len(self.offsets) * 8)
+
+        self.views = [None] * count
+        # slot of every page view handed out and of the pages last saved,
+        # by object id
+        self.known = {}
+        self.last = {}
+        self.page_map = None
+        self.state_map = None
+
+    def file(self, name):
+        return os.path.join(self.path, name)
+
+    def read(self, name):
+        try:
+            with open(self.file(name), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return b''
+
+    def size(self, name):
+        path = self.file(name)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def append(self, name, size):
+        f = open(self.file(name), 'ab')
+        f.truncate(size)
+        return f
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # slot of the page data, adding it if the store does not have it
+    def put(self, data):
+        known = self.known.get(id(data)) or self.last.get(id(data))
+        if known is not None and known[0] is data:
+            return known[1]
+
+        digest = hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+        slot = self.digests.get(digest)
+        if slot is None:
+            slot = self.count
+            self.pages_out.write(data)
+            self.index_out.write(digest)
+            self.digests[digest] = slot
+            self.views.append(None)
+            self.count += 1
+        return slot
+
+    # the read-only view of a slot, the same object every time
+    def page(self, slot):
+        if slot >= self.count:
+            raise InvalidState('page store has no slot %d' % slot)
+
+        view = self.views[slot]
+        if view is None:
+            end = (slot + 1) * PAGE_SIZE
+            if self.page_map is None or len(self.page_map) < end:
+                self.pages_out.flush()
+                self.page_map = map_file(self.file('pages.bin'))
+            view = self.page_map[end - PAGE_SIZE:end]
+            self.views[slot] = view
+            self.known[id(view)] = (view, slot)
+        return view
+
+    # saves the state of proc, returns its id
+    def save(self, proc):
+        snapshot = proc.snapshot()
+        slots = {page: self.put(data) for page, data in snapshot.pages.items()}
+        self.last = {id(data): (data, slots[page]) for page, data in snapshot.pages.items()}
+
+        record = pack_state(snapshot, proc.mapper, slots)
+        self.offsets.append(self.end)
+        self.offsets_out.write(little(array('Q', (self.end,))).tobytes())
+        self.states_out.write(record)
+        self.end += len(record)
+        return len(self.offsets) - 1
+
+    def load(self, proc, state):
+        if not 0 <= state < len(self.offsets):
+            raise InvalidState('page store has no state %d' % state)
+
+        start = self.offsets[state]
+        end = self.offsets[state + 1] if state + 1 < len(self.offsets) else self.end
+        if self.state_map is None or len(self.state_map) < end:
+            self.flush()
+            self.state_map = map_file(self.file('states.bin'))
+        return adopt(proc, unpack_state(self.state_map[start:end], proc.mapper, self))
+
+    # pages go out before the states using them
+    def flush(self):
+        for f in (self.pages_out, self.index_out, self.states_out, self.offsets_out):
+            f.flush()
+
+    def disk_size(self):
+        self.flush()
+        return sum(self.size(name) for name in STORE_FILES)
+
+    def close(self):
+        self.flush()
+        for f in (self.pages_out, self.index_out, self.states_out, self.offsets_out):
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return '<PageStore %s states:%d pages:%d>' % (self.path, len(self), self.count)
+
+def describe(data):
+    magic, version, flags, clock, pc, a, x, y, sp, p, number, size, state, ppu, io, count = \
+        HEADER.unpack_from(data)
+    return 'v%d %s clock:%d pc:%s a:%s x:%s y:%s sp:%s p:%s mapper:%s pages:%d' % \
+           (version, 'stored' if flags & STORED else 'inline', clock, hexStr(pc, size=4), \
+            hexStr(a), hexStr(x), hexStr(y), hexStr(sp), hexStr(p), mapper_name(number), count)
+
+def usage():
+    return 'python3 %s [State Files or Store Directories...] [-c New Store Directory]' % sys.argv[0]
+
+def main(argv):
+    if len(argv) < 2 or argv[1] == '-h':
+        print(usage())
+        return
+
+    created = pop_options(argv, '-c')
+    for name in created + argv[1:]:
+        try:
+            if name in created or os.path.isdir(name):
+                with PageStore(name, create=name in created) as store:
+                    size = store.disk_size()
+                    print('%s: %d states, %d unique pages, %d bytes, %d bytes/state' % \
+                          (name, len(store), store.count, size, size // max(len(store), 1)))
+                continue
+
+            data = map_file(name)
+            if len(data) < HEADER.size or bytes(data[:4]) != MAGIC:
+                raise InvalidState('not a save state')
+            print('%s: %s, %d bytes' % (name, describe(data), len(data)))
+        except (InvalidState, OSError) as e:
+            print('%s: %s' % (name, e))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,484 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import struct
+import asyncio
+import tempfile
+from common import *
+from processor import *
+
+"""
+Emulation service.
+
+A long running asyncio server on a Unix or TCP socket holding many
+sessions, each one a Processor. Processors are pooled and brought back to
+their power-on state with Processor.reset when a session is created, all
+of memory included. A session belongs to the connection that created it,
+other connections get NO_SESSION for it.
+
+Protocol, little endian frames:
+    request   <I length> <B command> <I session> payload[length]
+    response  <I length> <B status> payload[length]
+Commands and their payloads:
+    CREATE     -                       -> <I session>
+    DESTROY    -                       -> -
+    LOAD       <H addr> data           -> -
+    RUN        <Q cycles>              -> <B stop reason> <Q cycles used>
+    REGS       -                       -> <H pc> <B a x y sp status> <Q clock>
+    SET_REGS   <H pc> <B a x y sp status>
+    READ       <H addr> <H length>     -> data
+    SNAPSHOT   -                       -> <I snapshot>
+    RESTORE    <I snapshot>            -> -
+    STATS      -                       -> JSON, session 0 for the server
+Stop reasons are numbered in StopReason order. A status other than OK
+comes with an error message as payload.
+
+Scheduling: RUN requests queue their session, one scheduler task runs the
+queued sessions round robin, at most slice cycles at a time, so a long run
+can not hold up the others. Requests on one connection are handled in
+order, clients wanting parallel runs open more connections.
+
+Backpressure: responses are drained before the next request is read, at
+most max_pending runs wait in the queue, a RUN beyond that is not
+answered until there is room, which stops the connection from being read
+further. The session count and the frame size are capped.
+
+Run as a script:
+    python3 server.py [-u Socket Path | -p TCP Port] [-s Slice Cycles]
+    python3 server.py -l [-c Clients] [-n Sessions] [-k Cycles] [-u | -p Server]
+The second form is the load test. It starts a server in the same process
+unless -u or -p point it at a running one, and reports sessions per second
+and the latency percentiles of RUN requests and of whole sessions.
+"""
+
+HEADER = struct.Struct('<IBI')
+RESPONSE = struct.Struct('<IB')
+REGS = struct.Struct('<HBBBBB')
+CLOCK = struct.Struct('<Q')
+RUN_RESULT = struct.Struct('<BQ')
+RANGE = struct.Struct('<HH')
+ADDR = struct.Struct('<H')
+ID = struct.Struct('<I')
+
+COMMANDS = ('CREATE', 'DESTROY', 'LOAD', 'RUN', 'REGS', 'SET_REGS', 'READ', 'SNAPSHOT', \
+            'RESTORE', 'STATS')
+CODES = {name: code for code, name in enumerate(COMMANDS, 1)}
+
+OK = 0
+ERROR = 1
+NO_SESSION = 2
+BUSY = 3
+
+REASONS = list(StopReason)
+
+SLICE = 20000
+MAX_SESSIONS = 4096
+MAX_PENDING = 256
+MAX_FRAME = 0x10000 + 16
+
+class ServerError(Exception):
+    def __init__(self, status, message):
+        self.status = status
+        super().__init__(message)
+
+class Session():
+    __slots__ = ('id', 'proc', 'snapshots', 'created', 'requests', 'runs', 'slices', 'cycles', \
+                 'busy', 'wait', 'run')
+
+    def __init__(self, id, proc):
+        self.id = id
+        self.proc = proc
+        self.snapshots = []
+        self.created = time.monotonic()
+        self.requests = 0
+        self.runs = 0
+        self.slices = 0
+        self.cycles = 0
+        # wall seconds spent running and waiting in the run queue
+        self.busy = 0.0
+        self.wait = 0.0
+        # the pending run: [cycles left, cycles used, future, queued at]
+        self.run = None
+
+    def stats(self):
+        return {'session': self.id, 'age': time.monotonic() - self.created, \
+                'requests': self.requests, 'runs': self.runs, 'slices': self.slices, \
+                'cycles': self.cycles, 'busy': self.busy, 'wait': self.wait, \
+                'snapshots': len(self.snapshots), 'running': self.run is not None}
+
+class Server():
+    def __init__(self, slice=SLICE, max_sessions=MAX_SESSIONS, max_pending=MAX_PENDING, \
+                 recompile=False):
+        self.slice = slice
+        self.max_sessions = max_sessions
+        self.recompile = recompile
+        self.sessions = {}
+        self.pool = []
+        self.next_id = 1
+        self.queue = asyncio.Queue()
+        self.pending = asyncio.Semaphore(max_pending)
+        self.started = time.monotonic()
+        self.created = 0
+        self.requests = 0
+        self.cycles = 0
+        self.handlers = [None] + [getattr(self, 'do_' + name) for name in COMMANDS]
+        self.scheduler = None
+
+    async def start(self, path=None, host='127.0.0.1', port=None):
+        self.scheduler = asyncio.ensure_future(self.schedule())
+        if path is not None:
+            return await asyncio.start_unix_server(self.serve, path)
+
+        return await asyncio.start_server(self.serve, host, port)
+
+    def close(self):
+        if self.scheduler is not None:
+            self.scheduler.cancel()
+
+    async def serve(self, reader, writer):
+        owned = set()
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(HEADER.size)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+
+                length, command, session = HEADER.unpack(header)
+                if length > MAX_FRAME:
+                    self.respond(writer, ERROR, b'frame of %d bytes is too long' % length)
+                    break
+
+                payload = await reader.readexactly(length) if length else b''
+                status, result = await self.handle(command, session, payload, owned)
+                self.respond(writer, status, result)
+                await writer.drain()
+        finally:
+            for id in owned:
+                self.destroy(id)
+            writer.close()
+
+    def respond(self, writer, status, payload):
+        writer.write(RESPONSE.pack(len(payload), status) + payload)
+
+    async def handle(self, command, id, payload, owned):
+        self.requests += 1
+        if not 0 < command < len(self.handlers):
+            return ERROR, b'unknown command %d' % command
+
+        session = None
+        if command != CODES['CREATE'] and (command != CODES['STATS'] or id):
+            session = self.sessions.get(id)
+            # sessions of other connections look like missing ones
+            if session is None or id not in owned:
+                return NO_SESSION, b'no session %d' % id
+            session.requests += 1
+
+        try:
+            result = self.handlers[command](session, payload, owned)
+            if asyncio.iscoroutine(result):
+                result = await result
+        except ServerError as e:
+            return e.status, str(e).encode()
+        except (struct.error, ValueError, IndexError) as e:
+            return ERROR, str(e).encode()
+        # a failing request must not end the connection
+        except Exception as e:
+            return ERROR, ('%s: %s' % (type(e).__name__, e)).encode()
+
+        return OK, result
+
+    def do_CREATE(self, session, payload, owned):
+        if len(self.sessions) >= self.max_sessions:
+            raise ServerError(BUSY, '%d sessions open' % len(self.sessions))
+
+        # reset also zeroes $8000-$FFFF, nothing of the last session is left
+        proc = self.pool.pop() if self.pool else Processor(recompile=self.recompile)
+        proc.reset()
+        id = self.next_id
+        self.next_id = (id + 1) & 0xffffffff or 1
+        self.sessions[id] = Session(id, proc)
+        self.created += 1
+        owned.add(id)
+        return ID.pack(id)
+
+    def do_DESTROY(self, session, payload, owned):
+        owned.discard(session.id)
+        self.destroy(session.id)
+        return b''
+
+    def destroy(self, id):
+        session = self.sessions.pop(id, None)
+        if session is None:
+            return
+
+        future = session.run[2] if session.run is not None else None
+        if future is not None and not future.done():
+            future.set_exception(ServerError(NO_SESSION, 'session %d was destroyed' % id))
+        self.pool.append(session.proc)
+
+    def do_LOAD(self, session, payload, owned):
+        addr, = ADDR.unpack_from(payload)
+        data = payload[ADDR.size:]
+        if addr + len(data) > 0x10000:
+            raise ValueError('%d bytes at %s run past $FFFF' % (len(data), hexStr(addr, size=4, prefix='$')))
+
+        session.proc.bus.load(data, addr)
+        return b''
+
+    async def do_RUN(self, session, payload, owned):
+        cycles, = CLOCK.unpack(payload)
+        if session.run is not None:
+            raise ServerError(BUSY, 'session %d is already running' % session.id)
+
+        async with self.pending:
+            future = asyncio.get_running_loop().create_future()
+            session.run = [cycles, 0, future, time.perf_counter()]
+            session.runs += 1
+            self.queue.put_nowait(session)
+            try:
+                reason, used = await future
+            finally:
+                session.run = None
+
+        return RUN_RESULT.pack(REASONS.index(reason), used)
+
+    def do_REGS(self, session, payload, owned):
+        proc = session.proc
+        return REGS.pack(*proc.cpu.regs()) + CLOCK.pack(proc.clk.counter)
+
+    def do_SET_REGS(self, session, payload, owned):
+        session.proc.cpu.set_regs(REGS.unpack(payload))
+        return b''
+
+    def do_READ(self, session, payload, owned):
+        addr, length = RANGE.unpack(payload)
+        if addr + length > 0x10000:
+            raise ValueError('%d bytes at %s run past $FFFF' % (length, hexStr(addr, size=4, prefix='$')))
+
+        return session.proc.bus[addr:addr+length]
+
+    def do_SNAPSHOT(self, session, payload, owned):
+        session.snapshots.append(session.proc.snapshot())
+        return ID.pack(len(session.snapshots) - 1)
+
+    def do_RESTORE(self, session, payload, owned):
+        index, = ID.unpack(payload)
+        if index >= len(session.snapshots):
+            raise ValueError('no snapshot %d' % index)
+
+        session.proc.restore(session.snapshots[index])
+        return b''
+
+    def do_STATS(self, session, payload, owned):
+        if session is not None:
+            return json.dumps(session.stats()).encode()
+
+        return json.dumps({'uptime': time.monotonic() - self.started, \
+                           'sessions': len(self.sessions), 'created': self.created, \
+                           'pooled': len(self.pool), 'requests': self.requests, \
+                           'cycles': self.cycles, 'queued': self.queue.qsize()}).encode()
+
+    # round robin over the sessions with a pending run, one slice each
+    async def schedule(self):
+        queue = self.queue
+        while True:
+            session = await queue.get()
+            run = session.run
+            if run is None or run[2].done():
+                continue
+
+            self.run_slice(session, run)
+            if not run[2].done():
+                queue.put_nowait(session)
+            # lets the connections in between slices
+            await asyncio.sleep(0)
+
+    def run_slice(self, session, run):
+        left, used, future, queued = run
+        start = time.perf_counter()
+        if not used:
+            session.wait += start - queued
+
+        try:
+            reason, cycles = session.proc.run(max_cycles=min(left, self.slice))
+        # fails this run only, the scheduler goes on with the others
+        except Exception as e:
+            session.busy += time.perf_counter() - start
+            future.set_exception(e)
+            return
+
+        session.busy += time.perf_counter() - start
+        session.slices += 1
+        session.cycles += cycles
+        self.cycles += cycles
+        run[0] = left = left - cycles
+        run[1] = used = used + cycles
+        if reason is not StopReason.CYCLES or left <= 0:
+            future.set_result((reason, used))
+
+class Client():
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def connect(cls, path=None, host='127.0.0.1', port=None):
+        if path is not None:
+            return cls(*await asyncio.open_unix_connection(path))
+
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def request(self, command, session=0, payload=b''):
+        self.writer.write(HEADER.pack(len(payload), CODES[command], session) + payload)
+        await self.writer.drain()
+        length, status = RESPONSE.unpack(await self.reader.readexactly(RESPONSE.size))
+        result = await self.reader.readexactly(length) if length else b''
+        if status != OK:
+            raise ServerError(status, result.decode())
+
+        return result
+
+    async def create(self):
+        return ID.unpack(await self.request('CREATE'))[0]
+
+    async def destroy(self, session):
+        await self.request('DESTROY', session)
+
+    async def load(self, session, data, addr):
+        await self.request('LOAD', session, ADDR.pack(addr) + bytes(data))
+
+    async def run(self, session, cycles):
+        code, used = RUN_RESULT.unpack(await self.request('RUN', session, CLOCK.pack(cycles)))
+        return REASONS[code], used
+
+    async def regs(self, session):
+        result = await self.request('REGS', session)
+        return REGS.unpack_from(result), CLOCK.unpack_from(result, REGS.size)[0]
+
+    async def set_regs(self, session, regs):
+        await self.request('SET_REGS', session, REGS.pack(*regs))
+
+    async def read(self, session, addr, length):
+        return await self.request('READ', session, RANGE.pack(addr, length))
+
+    async def snapshot(self, session):
+        return ID.unpack(await self.request('SNAPSHOT', session))[0]
+
+    async def restore(self, session, snapshot):
+        await self.request('RESTORE', session, ID.pack(snapshot))
+
+    async def stats(self, session=0):
+        return json.loads(await self.request('STATS', session))
+
+    def close(self):
+        self.writer.close()
+
+# the load test program: fills page $03 forever, so every RUN uses its
+# whole cycle budget. LDX #0; loop: TXA; STA $0300,X; INX; JMP loop
+LOAD_PROGRAM = bytes.fromhex('a2008a9d0003e84c0202')
+LOAD_ADDR = 0x0200
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0
+
+async def client_sessions(connect, count, cycles, runs, lifetimes):
+    client = await connect()
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            session = await client.create()
+            await client.load(session, LOAD_PROGRAM, LOAD_ADDR)
+            await client.set_regs(session, (LOAD_ADDR, 0, 0, 0, 0xff, 0x20))
+
+            before = time.perf_counter()
+            reason, used = await client.run(session, cycles)
+            runs.append(time.perf_counter() - before)
+            if reason is not StopReason.CYCLES:
+                raise ServerError(ERROR, 'load test program stopped: %s' % reason)
+
+            await client.read(session, 0x0300, 0x100)
+            await client.destroy(session)
+            lifetimes.append(time.perf_counter() - start)
+    finally:
+        client.close()
+
+async def load_test(clients=16, sessions=50, cycles=100000, path=None, port=None):
+    server = None
+    if path is None and port is None:
+        path = os.path.join(tempfile.mkdtemp(), 'py6502.sock')
+        server = Server()
+        listener = await server.start(path)
+
+    runs = []
+    lifetimes = []
+    connect = lambda: Client.connect(path, port=port)
+    start = time.perf_counter()
+    await asyncio.gather(*(client_sessions(connect, sessions, cycles, runs, lifetimes) \
+                           for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+
+    if server is not None:
+        server.close()
+        listener.close()
+        await listener.wait_closed()
+        os.unlink(path)
+        os.rmdir(os.path.dirname(path))
+
+    return {'sessions': len(lifetimes), 'seconds': elapsed, \
+            'sessions_per_sec': len(lifetimes) / elapsed, \
+            'cycles_per_sec': len(lifetimes) * cycles / elapsed, \
+            'run_p50': percentile(runs, 0.5), 'run_p99': percentile(runs, 0.99), \
+            'run_max': max(runs), 'session_p50': percentile(lifetimes, 0.5), \
+            'session_p99': percentile(lifetimes, 0.99)}
+
+def usage():
+    return 'python3 %s [-u Socket Path | -p TCP Port] [-s Slice Cycles]\n' \
+           'python3 %s -l [-c Clients] [-n Sessions] [-k Cycles] [-u Socket Path | -p TCP Port]' % \
+           (sys.argv[0], sys.argv[0])
+
+async def serve_forever(path, port, slice):
+    server = Server(slice)
+    listener = await server.start(path, port=port)
+    print('serving on %s' % (path or 'port %d' % port))
+    async with listener:
+        await listener.serve_forever()
+
+def main(argv):
+    if '-h' in argv:
+        print(usage())
+        return
+
+    path = pop_option(argv, '-u')
+    port = pop_option(argv, '-p')
+    port = int(port) if port is not None else None
+    if '-l' in argv:
+        argv.remove('-l')
+        clients = int(pop_option(argv, '-c', '16'))
+        sessions = int(pop_option(argv, '-n', '50'))
+        cycles = int(pop_option(argv, '-k', '100000'), 0)
+        result = asyncio.run(load_test(clients, sessions, cycles, path, port))
+        print('%d sessions in %.2f s, %.1f sessions/s, %.0f cycles/s' % (result['sessions'], \
+              result['seconds'], result['sessions_per_sec'], result['cycles_per_sec']))
+        print('RUN      p50 %7.2f ms  p99 %7.2f ms  max %7.2f ms' % (result['run_p50'] * 1e3, \
+              result['run_p99'] * 1e3, result['run_max'] * 1e3))
+        print('session  p50 %7.2f ms  p99 %7.2f ms' % (result['session_p50'] * 1e3, \
+              result['session_p99'] * 1e3))
+        return
+
+    if path is None and port is None:
+        print(usage())
+        return
+
+    slice = int(pop_option(argv, '-s', str(SLICE)), 0)
+    try:
+        asyncio.run(serve_forever(path, port, slice))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,148 @@
+import sys
+from bus import PAGES, PAGE_SIZE
+
+"""
+Machine snapshots with copy-on-write memory.
+
+PageTracker write-watches every writable memory page of the bus. The first
+write to a page marks it dirty and drops the watch, so the page is back on
+the fast path for the rest of the run. Mirrors count as one page.
+
+A snapshot keeps one immutable bytes object per page and shares the
+objects of pages that were not written since the previous snapshot.
+Restoring the snapshot the tracker was last synced with only copies the
+dirty pages back.
+
+Run as a script to check that restores undo writes made through the CPU,
+through Processor.ram and by a reset:
+    python3 snapshot.py
+"""
+
+class Snapshot():
+    __slots__ = ('regs', 'clock', 'pages', 'devices')
+
+    def __init__(self, regs, clock, pages, devices):
+        self.regs = regs
+        self.clock = clock
+        self.pages = pages
+        self.devices = devices
+
+class PageTracker():
+    def __init__(self, bus):
+        self.bus = bus
+        self.views = {}
+        self.aliases = {}
+        self.canon = [None] * PAGES
+        self.dirty = set()
+        self.baseline = None
+
+        for page in range(PAGES):
+            view = bus.base_wpages[page]
+            if view is None or self.canon[page] is not None:
+                continue
+
+            aliases = bus.aliases(page)
+            self.views[page] = view
+            self.aliases[page] = aliases
+            for alias in aliases:
+                self.canon[alias] = page
+                bus.watch_writes(alias, self.mark)
+
+    def mark(self, addr, value):
+        page = self.canon[addr >> 8]
+        self.dirty.add(page)
+        for alias in self.aliases[page]:
+            self.bus.unwatch_writes(alias, self.mark)
+
+    # for memory written behind the bus, like Processor.reset does
+    def mark_all(self):
+        for page in self.views:
+            if page not in self.dirty:
+                self.mark(page << 8, 0)
+
+    def arm(self, page):
+        for alias in self.aliases[page]:
+            self.bus.watch_writes(alias, self.mark)
+
+    def capture(self):
+        base = self.baseline
+        pages = {}
+        for page, view in self.views.items():
+            if base is None or page in self.dirty:
+                pages[page] = bytes(view)
+            else:
+                pages[page] = base.pages[page]
+
+        for page in self.dirty:
+            self.arm(page)
+        self.dirty.clear()
+
+        return pages
+
+    def sync(self, snapshot):
+        self.baseline = snapshot
+
+    # copies back the pages that differ from the snapshot, calling
+    # before_write(page, data) first for each of them
+    def restore(self, snapshot, before_write=None):
+        base = self.baseline
+        if base is None:
+            changed = list(self.views)
+        elif snapshot is base:
+            changed = list(self.dirty)
+        else:
+            changed = [page for page in self.views if page in self.dirty or \
+                       snapshot.pages[page] is not base.pages[page]]
+
+        for page in changed:
+            data = snapshot.pages[page]
+            if before_write is not None:
+                before_write(page, data)
+            self.views[page][:] = data
+
+        for page in self.dirty:
+            self.arm(page)
+        self.dirty.clear()
+        self.baseline = snapshot
+
+        return changed
+
+# writes the pages with write(proc, addr, data), restores and compares
+def check(name, write):
+    from processor import Processor
+
+    proc = Processor()
+    proc.ram.load_str('a9 01 00', 0x200)
+    proc.wram.load_str('a2 02 00', 0x100)
+    before = bytes(proc.ram.data), bytes(proc.wram.data)
+    snapshot = proc.snapshot()
+
+    write(proc, 0x200, bytes.fromhex('a9 09 00'))
+    write(proc, 0x6100, bytes.fromhex('a2 09 00'))
+    write(proc, 0x0a00, bytes.fromhex('a0 09 00'))
+    proc.restore(snapshot)
+
+    match = (bytes(proc.ram.data), bytes(proc.wram.data)) == before
+    print('%-8s %s' % (name, 'ok' if match else 'restore left the written bytes'))
+    return match
+
+def cpu_write(proc, addr, data):
+    for i, value in enumerate(data):
+        proc.bus.write(addr + i, value)
+
+def ram_write(proc, addr, data):
+    if addr >= 0x6000:
+        proc.wram.load(data, addr - 0x6000)
+    else:
+        proc.ram.load(data, addr & 0x7ff)
+
+def reset_write(proc, addr, data):
+    proc.reset()
+
+def main(argv):
+    checks = (('cpu', cpu_write), ('ram', ram_write), ('reset', reset_write))
+    failed = sum(not check(name, write) for name, write in checks)
+    print('%d/%d restores match' % (len(checks) - failed, len(checks)))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,48 @@
+#!/usr/bin/python3
+
+import sys
+from common import *
+from opcodes import *
+from recorder import *
+
+"""
+Formats trace records written by recorder.TraceRecorder, one line per
+instruction in the CPU.reg_to_str style.
+"""
+
+def format_record(record, opcodes=OPCODES_6502):
+    pc, binary, oper, a, x, y, sp, status, cycles = record
+
+    opcode = opcodes[binary]
+    if opcode.code is None:
+        decoded = '???'
+    elif opcode.size > 1:
+        decoded = '%s %s' % (opcode.code, opcode.mode.print_oper(oper))
+    else:
+        decoded = str(opcode.code)
+
+    return '%s %-12s A:%s X:%s Y:%s SP:%s SV-BDIZC:%s Clk:%d' % \
+           (hexStr(pc, size=4, prefix='$'), decoded, hexStr(a), hexStr(x), hexStr(y), \
+            hexStr(sp), binStr(status), cycles)
+
+def format_records(records):
+    for record in records:
+        yield format_record(record)
+
+def usage():
+    return 'python3 %s [Trace File] [-n Last Records]' % sys.argv[0]
+
+def main(argv):
+    if len(argv) < 2 or argv[1] == '-h':
+        print(usage())
+        return
+
+    last = pop_option(argv, '-n')
+    if last is not None:
+        last = int(last)
+
+    for line in format_records(read_trace(argv[1], last)):
+        print(line)
+
+if __name__ == '__main__':
+    main(sys.argv)
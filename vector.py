@@ -0,0 +1,547 @@
+#!/usr/bin/python3
+
+import sys
+import random
+import numpy as np
+from common import *
+from opcodes import *
+from recompiler import random_program
+
+"""
+Lockstep emulation of many CPU instances with NumPy.
+
+Every register and flag is a 1-D array with one entry per lane, kept in the
+same lazy form as the CPU (see cpu.py). Memory is a lanes x 64K uint8
+matrix plus two extra columns: a zero column open-bus reads are mapped to
+and a sink column for writes that are ignored. rmap and wmap translate a
+CPU address into a column and reproduce the Processor memory map, so RAM
+and PPU register mirrors, the read-only cartridge area and unmapped pages
+behave the same.
+
+step() executes one instruction on every running lane. Lanes are grouped
+by their opcode byte and each group runs as array operations, so the cost
+of a step depends on the number of distinct opcodes, not on the number of
+lanes. A lane halts after BRK, the way Processor.run stops, or on an
+illegal opcode. Cycles are OpCode.cycles plus the page crossing and
+branch penalties, the way the interpreter counts them.
+
+Run as a script it cross-checks random lanes against the scalar CPU:
+    python3 vector.py [programs] [lanes] [seed]
+"""
+
+ZERO = 0x10000
+SINK = 0x10001
+COLUMNS = 0x10002
+
+# address to memory column translation of the Processor memory map
+def build_maps():
+    addrs = np.arange(0x10000, dtype=np.int64)
+    rmap = np.full(0x10000, ZERO, dtype=np.int64)
+    wmap = np.full(0x10000, SINK, dtype=np.int64)
+
+    ram = addrs < 0x2000
+    rmap[ram] = wmap[ram] = addrs[ram] & 0x7ff
+
+    ppu = (addrs >= 0x2000) & (addrs < 0x4000)
+    rmap[ppu] = wmap[ppu] = 0x2000 | (addrs[ppu] & 7)
+
+    io = (addrs >= 0x4000) & (addrs < 0x4020)
+    rmap[io] = wmap[io] = addrs[io]
+
+    wram = (addrs >= 0x6000) & (addrs < 0x8000)
+    rmap[wram] = wmap[wram] = addrs[wram]
+
+    prg = addrs >= 0x8000
+    rmap[prg] = addrs[prg]
+
+    return rmap, wmap
+
+class VectorCPU():
+    REGISTERS = ('pc', 'a', 'x', 'y', 'sp', 'n', 'z', 'c', 'v', 'i', 'd', 'b', 'clock')
+
+    # memory_map=False gives every lane a flat, fully writable 64K
+    def __init__(self, lanes, opcodes=OPCODES_6502, memory_map=True):
+        self.lanes = lanes
+        self.opcodes = opcodes
+        self.memory = np.zeros((lanes, COLUMNS), dtype=np.uint8)
+        if memory_map:
+            self.rmap, self.wmap = build_maps()
+        else:
+            self.rmap = self.wmap = np.arange(0x10000, dtype=np.int64)
+
+        for name in VectorCPU.REGISTERS:
+            setattr(self, name, np.zeros(lanes, dtype=np.int64))
+        self.halted = np.zeros(lanes, dtype=bool)
+        self.illegal = np.zeros(lanes, dtype=bool)
+        self.instructions = np.zeros(lanes, dtype=np.int64)
+
+        self.ticks = np.array([opcode.cycles for opcode in opcodes], dtype=np.int64)
+        self.dispatch = self.build_dispatch()
+        self.config(pc=0, status=0x20, a=0, x=0, y=0, sp=0xFF)
+
+    def build_dispatch(self):
+        table = []
+        for opcode in self.opcodes:
+            handler = None
+            if opcode.code is not None:
+                handler = getattr(self, 'do_' + opcode.code.name)
+
+            table.append(handler)
+
+        return table
+
+    # values are scalars or one entry per selected lane
+    def config(self, lanes=None, pc=None, status=None, a=None, x=None, y=None, sp=None, \
+               clk_cnt=None):
+        if lanes is None:
+            lanes = slice(None)
+
+        for name, value in (('pc', pc), ('a', a), ('x', x), ('y', y), ('sp', sp), \
+                            ('clock', clk_cnt)):
+            if value is not None:
+                getattr(self, name)[lanes] = value
+
+        if status is not None:
+            self.set_status(lanes, status)
+
+    def get_status(self, lanes):
+        return (self.n[lanes] & 0x80) | ((self.v[lanes] & 0x80) >> 1) | 0x20 | \
+               (self.b[lanes] << 4) | (self.d[lanes] << 3) | (self.i[lanes] << 2) | \
+               ((self.z[lanes] == 0) << 1) | self.c[lanes]
+
+    def set_status(self, lanes, value):
+        value = np.asarray(value, dtype=np.int64)
+        self.n[lanes] = value & 0x80
+        self.v[lanes] = (value & 0x40) << 1
+        self.b[lanes] = (value >> 4) & 1
+        self.d[lanes] = (value >> 3) & 1
+        self.i[lanes] = (value >> 2) & 1
+        self.z[lanes] = (value & 0x02) == 0
+        self.c[lanes] = value & 1
+
+    # the same tuple CPU.regs returns
+    def regs(self, lane):
+        return (int(self.pc[lane]), int(self.a[lane]), int(self.x[lane]), int(self.y[lane]), \
+                int(self.sp[lane]), int(self.get_status(lane)))
+
+    # writes straight into the backing memory, read-only areas included
+    def load(self, blob, offset, lanes=None):
+        if lanes is None:
+            lanes = np.arange(self.lanes)
+
+        data = np.frombuffer(bytes(blob), dtype=np.uint8)
+        cols = self.rmap[(offset + np.arange(len(data))) & 0xffff]
+        mapped = cols != ZERO
+        self.memory[np.ix_(lanes, cols[mapped])] = data[mapped]
+
+    def load_str(self, input_str, offset=0, lanes=None):
+        self.load(hex_bytes(input_str), offset, lanes)
+
+    # the memory a lane sees at [start, end)
+    def dump(self, lane, start, end):
+        return self.memory[lane, self.rmap[np.arange(start, end) & 0xffff]].tobytes()
+
+    def read(self, lanes, addr):
+        return self.memory[lanes, self.rmap[addr & 0xffff]].astype(np.int64)
+
+    def write(self, lanes, addr, value):
+        self.memory[lanes, self.wmap[addr & 0xffff]] = value
+
+    def push(self, lanes, value):
+        self.write(lanes, 0x100 | self.sp[lanes], value)
+        self.sp[lanes] = (self.sp[lanes] - 1) & 0xff
+
+    def pull(self, lanes):
+        self.sp[lanes] = (self.sp[lanes] + 1) & 0xff
+        return self.read(lanes, 0x100 | self.sp[lanes])
+
+    def push_word(self, lanes, value):
+        self.push(lanes, value >> 8)
+        self.push(lanes, value & 0xff)
+
+    def pull_word(self, lanes):
+        lo = self.pull(lanes)
+        return lo | (self.pull(lanes) << 8)
+
+    # operand resolved the way CPU.decoders do, pc still on the opcode
+    def operand(self, lanes, opcode):
+        pc = self.pc[lanes]
+        if opcode.mode is AddrMode.IMM:
+            return (pc + 1) & 0xffff
+        if opcode.size == 1:
+            return None
+
+        oper = self.read(lanes, pc + 1)
+        if opcode.size == 3:
+            oper |= self.read(lanes, pc + 2) << 8
+        if opcode.mode is AddrMode.REL:
+            oper = (pc + 2 + oper - ((oper & 0x80) << 1)) & 0xffff
+
+        return oper
+
+    # effective address, the CPU.addr_* resolvers for a group of lanes
+    def address(self, lanes, mode, oper, page_cycles=0):
+        if mode is AddrMode.ZPX:
+            return (oper + self.x[lanes]) & 0xff
+        if mode is AddrMode.ZPY:
+            return (oper + self.y[lanes]) & 0xff
+        if mode is AddrMode.ABSX:
+            return self.index(lanes, oper, self.x[lanes], page_cycles)
+        if mode is AddrMode.ABSY:
+            return self.index(lanes, oper, self.y[lanes], page_cycles)
+        if mode is AddrMode.IND:
+            # the high byte is not carried into the next page
+            hi_addr = (oper & 0xff00) | ((oper + 1) & 0xff)
+            return self.read(lanes, oper) | (self.read(lanes, hi_addr) << 8)
+        if mode is AddrMode.INDX:
+            ind_addr = (oper + self.x[lanes]) & 0xff
+            return self.read(lanes, ind_addr) | (self.read(lanes, (ind_addr + 1) & 0xff) << 8)
+        if mode is AddrMode.INDY:
+            base = self.read(lanes, oper) | (self.read(lanes, (oper + 1) & 0xff) << 8)
+            return self.index(lanes, base, self.y[lanes], page_cycles)
+
+        return oper
+
+    # indexed address, reads pay for crossing into the next page
+    def index(self, lanes, base, reg, page_cycles):
+        addr = (base + reg) & 0xffff
+        if page_cycles:
+            self.clock[lanes] += ((addr ^ base) & 0xff00) != 0
+
+        return addr
+
+    def fetch_src(self, lanes, op, oper):
+        if op.mode is AddrMode.A:
+            return self.a[lanes], None
+
+        addr = self.address(lanes, op.mode, oper, op.page_cycles)
+        return self.read(lanes, addr), addr
+
+    def store_src(self, lanes, src, addr):
+        if addr is None:
+            self.a[lanes] = src
+        else:
+            self.write(lanes, addr, src)
+
+    def set_nz(self, lanes, value):
+        self.n[lanes] = value
+        self.z[lanes] = value
+
+    def add(self, lanes, src):
+        a = self.a[lanes]
+        temp = a + src + self.c[lanes]
+        result = temp & 0xff
+
+        self.v[lanes] = ~(a ^ src) & (a ^ result)
+        self.c[lanes] = temp >> 8
+        self.a[lanes] = result
+        self.set_nz(lanes, result)
+
+    def compare(self, lanes, reg, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        temp = reg[lanes] - src
+        self.c[lanes] = temp >= 0
+        self.set_nz(lanes, temp & 0xff)
+
+    # pc is already past the branch, another page costs one more cycle
+    def branch(self, lanes, target, cond):
+        taken = lanes[cond]
+        target = target[cond]
+        self.clock[taken] += 1 + (((self.pc[taken] ^ target) & 0xff00) != 0)
+        self.pc[taken] = target
+
+    def load_reg(self, lanes, reg, value):
+        reg[lanes] = value
+        self.set_nz(lanes, value)
+
+    def do_BRK(self, lanes, op, oper):
+        self.push_word(lanes, (self.pc[lanes] + 1) & 0xffff)
+        self.push(lanes, self.get_status(lanes) | 0x10)
+        self.i[lanes] = 1
+        self.pc[lanes] = self.read(lanes, 0xfffe) | (self.read(lanes, 0xffff) << 8)
+        self.halted[lanes] = True
+
+    def do_ADC(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        self.add(lanes, src)
+
+    def do_SBC(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        self.add(lanes, src ^ 0xff)
+
+    def do_AND(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        self.load_reg(lanes, self.a, self.a[lanes] & src)
+
+    def do_ORA(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        self.load_reg(lanes, self.a, self.a[lanes] | src)
+
+    def do_EOR(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        self.load_reg(lanes, self.a, self.a[lanes] ^ src)
+
+    def do_ASL(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        self.c[lanes] = src >> 7
+        src = (src << 1) & 0xff
+        self.set_nz(lanes, src)
+        self.store_src(lanes, src, addr)
+
+    def do_LSR(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        self.c[lanes] = src & 1
+        src = src >> 1
+        self.set_nz(lanes, src)
+        self.store_src(lanes, src, addr)
+
+    def do_ROL(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        result = ((src << 1) | self.c[lanes]) & 0xff
+        self.c[lanes] = src >> 7
+        self.set_nz(lanes, result)
+        self.store_src(lanes, result, addr)
+
+    def do_ROR(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        result = (src >> 1) | (self.c[lanes] << 7)
+        self.c[lanes] = src & 1
+        self.set_nz(lanes, result)
+        self.store_src(lanes, result, addr)
+
+    def do_BIT(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        self.n[lanes] = src
+        self.v[lanes] = src << 1
+        self.z[lanes] = self.a[lanes] & src
+
+    def do_BCC(self, lanes, op, oper):
+        self.branch(lanes, oper, self.c[lanes] == 0)
+
+    def do_BCS(self, lanes, op, oper):
+        self.branch(lanes, oper, self.c[lanes] != 0)
+
+    def do_BEQ(self, lanes, op, oper):
+        self.branch(lanes, oper, self.z[lanes] == 0)
+
+    def do_BNE(self, lanes, op, oper):
+        self.branch(lanes, oper, self.z[lanes] != 0)
+
+    def do_BMI(self, lanes, op, oper):
+        self.branch(lanes, oper, (self.n[lanes] & 0x80) != 0)
+
+    def do_BPL(self, lanes, op, oper):
+        self.branch(lanes, oper, (self.n[lanes] & 0x80) == 0)
+
+    def do_BVS(self, lanes, op, oper):
+        self.branch(lanes, oper, (self.v[lanes] & 0x80) != 0)
+
+    def do_BVC(self, lanes, op, oper):
+        self.branch(lanes, oper, (self.v[lanes] & 0x80) == 0)
+
+    def do_CLC(self, lanes, op, oper):
+        self.c[lanes] = 0
+
+    def do_CLD(self, lanes, op, oper):
+        self.d[lanes] = 0
+
+    def do_CLI(self, lanes, op, oper):
+        self.i[lanes] = 0
+
+    def do_CLV(self, lanes, op, oper):
+        self.v[lanes] = 0
+
+    def do_SEC(self, lanes, op, oper):
+        self.c[lanes] = 1
+
+    def do_SED(self, lanes, op, oper):
+        self.d[lanes] = 1
+
+    def do_SEI(self, lanes, op, oper):
+        self.i[lanes] = 1
+
+    def do_CMP(self, lanes, op, oper):
+        self.compare(lanes, self.a, op, oper)
+
+    def do_CPX(self, lanes, op, oper):
+        self.compare(lanes, self.x, op, oper)
+
+    def do_CPY(self, lanes, op, oper):
+        self.compare(lanes, self.y, op, oper)
+
+    def do_DEC(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        src = (src - 1) & 0xff
+        self.set_nz(lanes, src)
+        self.store_src(lanes, src, addr)
+
+    def do_INC(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        src = (src + 1) & 0xff
+        self.set_nz(lanes, src)
+        self.store_src(lanes, src, addr)
+
+    def do_DEX(self, lanes, op, oper):
+        self.load_reg(lanes, self.x, (self.x[lanes] - 1) & 0xff)
+
+    def do_DEY(self, lanes, op, oper):
+        self.load_reg(lanes, self.y, (self.y[lanes] - 1) & 0xff)
+
+    def do_INX(self, lanes, op, oper):
+        self.load_reg(lanes, self.x, (self.x[lanes] + 1) & 0xff)
+
+    def do_INY(self, lanes, op, oper):
+        self.load_reg(lanes, self.y, (self.y[lanes] + 1) & 0xff)
+
+    def do_JMP(self, lanes, op, oper):
+        self.pc[lanes] = self.address(lanes, op.mode, oper)
+
+    def do_JSR(self, lanes, op, oper):
+        self.push_word(lanes, (self.pc[lanes] - 1) & 0xffff)
+        self.pc[lanes] = oper
+
+    def do_RTS(self, lanes, op, oper):
+        self.pc[lanes] = (self.pull_word(lanes) + 1) & 0xffff
+
+    def do_RTI(self, lanes, op, oper):
+        self.set_status(lanes, self.pull(lanes))
+        self.pc[lanes] = self.pull_word(lanes)
+
+    def do_LDA(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        self.load_reg(lanes, self.a, src)
+
+    def do_LDX(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        self.load_reg(lanes, self.x, src)
+
+    def do_LDY(self, lanes, op, oper):
+        src, addr = self.fetch_src(lanes, op, oper)
+        self.load_reg(lanes, self.y, src)
+
+    def do_STA(self, lanes, op, oper):
+        self.write(lanes, self.address(lanes, op.mode, oper), self.a[lanes])
+
+    def do_STX(self, lanes, op, oper):
+        self.write(lanes, self.address(lanes, op.mode, oper), self.x[lanes])
+
+    def do_STY(self, lanes, op, oper):
+        self.write(lanes, self.address(lanes, op.mode, oper), self.y[lanes])
+
+    def do_NOP(self, lanes, op, oper):
+        pass
+
+    def do_PHA(self, lanes, op, oper):
+        self.push(lanes, self.a[lanes])
+
+    def do_PHP(self, lanes, op, oper):
+        self.push(lanes, self.get_status(lanes) | 0x10)
+
+    def do_PLA(self, lanes, op, oper):
+        self.load_reg(lanes, self.a, self.pull(lanes))
+
+    def do_PLP(self, lanes, op, oper):
+        self.set_status(lanes, self.pull(lanes))
+
+    def do_TAX(self, lanes, op, oper):
+        self.load_reg(lanes, self.x, self.a[lanes])
+
+    def do_TAY(self, lanes, op, oper):
+        self.load_reg(lanes, self.y, self.a[lanes])
+
+    def do_TSX(self, lanes, op, oper):
+        self.load_reg(lanes, self.x, self.sp[lanes])
+
+    def do_TXA(self, lanes, op, oper):
+        self.load_reg(lanes, self.a, self.x[lanes])
+
+    def do_TXS(self, lanes, op, oper):
+        self.sp[lanes] = self.x[lanes]
+
+    def do_TYA(self, lanes, op, oper):
+        self.load_reg(lanes, self.a, self.y[lanes])
+
+    # one instruction on every running lane, returns the number of lanes run
+    def step(self):
+        active = np.flatnonzero(~self.halted)
+        if not len(active):
+            return 0
+
+        binaries = self.read(active, self.pc[active])
+        for binary in np.unique(binaries):
+            lanes = active[binaries == binary]
+            opcode = self.opcodes[binary]
+            handler = self.dispatch[binary]
+            if handler is None:
+                # the interpreter raises with pc past the opcode byte
+                self.illegal[lanes] = True
+                self.halted[lanes] = True
+                self.pc[lanes] = (self.pc[lanes] + 1) & 0xffff
+                self.clock[lanes] += self.ticks[binary]
+                continue
+
+            oper = self.operand(lanes, opcode)
+            self.pc[lanes] = self.pc[lanes] + opcode.size
+            self.clock[lanes] += self.ticks[binary]
+            handler(lanes, opcode, oper)
+
+        self.instructions[active] += 1
+        return len(active)
+
+    # steps until every lane halted or max_steps steps were taken,
+    # returns the number of steps
+    def run(self, max_steps):
+        for steps in range(max_steps):
+            if not self.step():
+                return steps
+
+        return max_steps
+
+def check(seed, lanes=64, size=48, steps=200, start=0x0600):
+    from processor import Processor, StopReason
+
+    rng = random.Random(seed)
+    program = random_program(rng, size) + bytes((0x4c, start & 0xff, start >> 8))
+    regs = [(start, rng.randrange(256) & 0xf7, rng.randrange(256), rng.randrange(256), \
+             rng.randrange(256), rng.randrange(256)) for _ in range(lanes)]
+
+    vec = VectorCPU(lanes)
+    vec.load(program, start)
+    for name, values in zip(('pc', 'status', 'a', 'x', 'y', 'sp'), zip(*regs)):
+        vec.config(**{name: np.array(values)})
+    vec.run(steps)
+
+    proc = Processor()
+    for lane in range(lanes):
+        proc.reset()
+        proc.bus.load(program, start)
+        pc, status, a, x, y, sp = regs[lane]
+        proc.cpu.config(pc=pc, status=status, a=a, x=x, y=y, sp=sp)
+        reason, cycles = proc.run(max_instructions=steps)
+        illegal = reason is StopReason.ILLEGAL
+
+        expected = (proc.cpu.regs(), proc.clk.counter, illegal, bytes(proc.ram.data), \
+                    bytes(proc.wram.data), bytes(proc.ppu_regs.data), bytes(proc.io_regs.data))
+        result = (vec.regs(lane), int(vec.clock[lane]), bool(vec.illegal[lane]), \
+                  vec.dump(lane, 0, 0x800), vec.dump(lane, 0x6000, 0x8000), \
+                  vec.dump(lane, 0x2000, 0x2008), vec.dump(lane, 0x4000, 0x4020))
+
+        if result != expected:
+            print('seed %d: lane %d differs after %d instructions' % \
+                  (seed, lane, vec.instructions[lane]))
+            print('  vector: %s clk:%d illegal:%s' % result[:3])
+            print('  scalar: %s clk:%d illegal:%s' % expected[:3])
+            return False
+
+    return True
+
+def main(argv):
+    programs = int(argv[1]) if len(argv) > 1 else 20
+    lanes = int(argv[2]) if len(argv) > 2 else 64
+    seed = int(argv[3]) if len(argv) > 3 else 0
+
+    failed = sum(not check(s, lanes) for s in range(seed, seed + programs))
+    print('%d/%d programs match' % (programs - failed, programs))
+
+if __name__ == '__main__':
+    main(sys.argv)